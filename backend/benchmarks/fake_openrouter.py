@@ -0,0 +1,218 @@
+'''
+Local stand-in for the OpenRouter chat completions API, for load tests that should not pay for real completions.
+
+Run it next to the backend and point the backend at it:
+
+    python -m benchmarks.fake_openrouter --port 8001 --tokens-per-second 60 --ttft-ms 400
+    OPENROUTER_BASE_URL=http://localhost:8001/api/v1 uvicorn main:app
+
+Every setting can also be given as an environment variable, e.g. FAKE_OPENROUTER_TTFT_MS=400.
+Replies are generated from a seeded random generator, so the same prompt gets the same reply across runs.
+'''
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+import uuid
+from typing import Any, AsyncGenerator, Dict, List, Optional
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+
+class FakeSettings(BaseModel):
+    # Output speed, 0 sends every token without delay
+    tokens_per_second: float = float(os.getenv('FAKE_OPENROUTER_TOKENS_PER_SECOND', '50'))
+    ttft_ms: float = float(os.getenv('FAKE_OPENROUTER_TTFT_MS', '300'))
+    completion_tokens: int = int(os.getenv('FAKE_OPENROUTER_COMPLETION_TOKENS', '200'))
+    # Share of requests failing with a 502 before any output, and of streams failing midway
+    error_rate: float = float(os.getenv('FAKE_OPENROUTER_ERROR_RATE', '0'))
+    midstream_error_rate: float = float(os.getenv('FAKE_OPENROUTER_MIDSTREAM_ERROR_RATE', '0'))
+    # Requests per second allowed before answering 429, 0 disables rate limiting
+    rate_limit: float = float(os.getenv('FAKE_OPENROUTER_RATE_LIMIT', '0'))
+    retry_after: int = int(os.getenv('FAKE_OPENROUTER_RETRY_AFTER', '1'))
+    seed: int = int(os.getenv('FAKE_OPENROUTER_SEED', '0'))
+
+settings = FakeSettings()
+
+WORDS = (
+    "the student should review how each concept connects to the material and explain the main idea "
+    "with evidence from the document because understanding depends on clear examples and careful "
+    "reasoning about causes effects definitions and the way authors support their arguments"
+).split()
+
+app = FastAPI(title="Fake OpenRouter")
+
+# Shared generator for error and rate limit decisions, so a run with the same seed fails the same requests
+_decisions = random.Random(settings.seed)
+
+class RateLimiter:
+    '''
+    Token bucket allowing `rate` requests per second with bursts of the same size
+    '''
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    def allow(self) -> bool:
+        if self.rate <= 0:
+            return True
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+rate_limiter = RateLimiter(settings.rate_limit)
+
+def error_response(status_code: int, message: str, headers: Optional[Dict[str, str]] = None) -> JSONResponse:
+    return JSONResponse({"error": {"code": status_code, "message": message}}, status_code=status_code, headers=headers)
+
+def prompt_text(body: Dict[str, Any]) -> str:
+    return "\n".join(str(message.get("content", "")) for message in body.get("messages", []))
+
+def request_rng(body: Dict[str, Any]) -> random.Random:
+    '''
+    Generator seeded by the prompt, so replies are reproducible
+    '''
+    digest = hashlib.sha256(f"{settings.seed}:{prompt_text(body)}".encode()).digest()
+    return random.Random(int.from_bytes(digest[:8], "big"))
+
+def sample_text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(max(words, 1)))
+
+def sample_from_schema(schema: Dict[str, Any], rng: random.Random) -> Any:
+    '''
+    Build a value that satisfies the subset of JSON Schema used by structured outputs
+    '''
+    if "enum" in schema:
+        return rng.choice(schema["enum"])
+
+    schema_type = schema.get("type")
+    if schema_type == "object":
+        return {name: sample_from_schema(prop, rng) for name, prop in schema.get("properties", {}).items()}
+    if schema_type == "array":
+        count = rng.randint(schema.get("minItems", 1), schema.get("maxItems", max(schema.get("minItems", 1), 3)))
+        return [sample_from_schema(schema.get("items", {}), rng) for _ in range(count)]
+    if schema_type == "integer":
+        return rng.randint(schema.get("minimum", 0), schema.get("maximum", 100))
+    if schema_type == "number":
+        return round(rng.uniform(schema.get("minimum", 0), schema.get("maximum", 100)), 2)
+    if schema_type == "boolean":
+        return rng.random() < 0.5
+    return sample_text(rng, rng.randint(5, 20)).capitalize() + "."
+
+def completion_tokens(body: Dict[str, Any], rng: random.Random) -> List[str]:
+    '''
+    Split the reply into the tokens that are streamed one by one
+    '''
+    response_format = body.get("response_format") or {}
+    if response_format.get("type") == "json_schema":
+        content = json.dumps(sample_from_schema(response_format["json_schema"]["schema"], rng))
+        # Roughly four characters per token, like real tokenizers
+        return [content[i:i + 4] for i in range(0, len(content), 4)]
+    if response_format.get("type") == "json_object":
+        return [json.dumps({"answer": sample_text(rng, settings.completion_tokens)})]
+
+    words = sample_text(rng, settings.completion_tokens).split(" ")
+    return [word if i == 0 else " " + word for i, word in enumerate(words)]
+
+def usage_block(body: Dict[str, Any], tokens: List[str]) -> Dict[str, Any]:
+    prompt_tokens = max(len(prompt_text(body)) // 4, 1)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": len(tokens),
+        "total_tokens": prompt_tokens + len(tokens),
+        "prompt_tokens_details": {"cached_tokens": 0}
+    }
+
+@app.post("/api/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+
+    if not rate_limiter.allow():
+        return error_response(429, "Rate limit exceeded", headers={"Retry-After": str(settings.retry_after)})
+    if _decisions.random() < settings.error_rate:
+        return error_response(502, "Provider returned error")
+
+    rng = request_rng(body)
+    tokens = completion_tokens(body, rng)
+    completion_id = f"gen-{uuid.uuid4().hex}"
+    model = body.get("model", "openai/gpt-4o")
+
+    if body.get("stream"):
+        fail_at = rng.randrange(len(tokens)) if _decisions.random() < settings.midstream_error_rate else None
+        return StreamingResponse(
+            stream_completion(body, tokens, completion_id, model, fail_at),
+            media_type="text/event-stream"
+        )
+
+    await asyncio.sleep(settings.ttft_ms / 1000 + len(tokens) * token_interval())
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": "".join(tokens)},
+            "finish_reason": "stop"
+        }],
+        "usage": usage_block(body, tokens)
+    }
+
+def token_interval() -> float:
+    '''
+    Seconds between two tokens
+    '''
+    return 1 / settings.tokens_per_second if settings.tokens_per_second > 0 else 0.0
+
+async def stream_completion(body: Dict[str, Any], tokens: List[str], completion_id: str, model: str, fail_at: Optional[int] = None) -> AsyncGenerator[str, None]:
+    '''
+    Stream tokens as OpenRouter does: processing comments until the first token,
+    one chunk per token, a final chunk with the usage if requested, then [DONE]
+    '''
+    def chunk(payload: Dict[str, Any]) -> str:
+        return f"data: {json.dumps({'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model, **payload})}\n\n"
+
+    yield ": OPENROUTER PROCESSING\n\n"
+    await asyncio.sleep(settings.ttft_ms / 1000)
+
+    interval = token_interval()
+    start = time.monotonic()
+    for i, token in enumerate(tokens):
+        if i == fail_at:
+            yield f"data: {json.dumps({'error': {'code': 502, 'message': 'Provider disconnected'}})}\n\n"
+            return
+        yield chunk({"choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]})
+        # Pace against the start time so the rate holds even when writes are slow
+        delay = start + (i + 1) * interval - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    yield chunk({"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+    if (body.get("usage") or {}).get("include"):
+        yield chunk({"choices": [], "usage": usage_block(body, tokens)})
+    yield "data: [DONE]\n\n"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake OpenRouter server for load testing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    for name, field in FakeSettings.model_fields.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=field.annotation, default=getattr(settings, name))
+    args = parser.parse_args()
+
+    for name in FakeSettings.model_fields:
+        setattr(settings, name, getattr(args, name))
+    rate_limiter.rate = rate_limiter.tokens = settings.rate_limit
+    _decisions.seed(settings.seed)
+
+    uvicorn.run(app, host=args.host, port=args.port)
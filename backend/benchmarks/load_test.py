@@ -0,0 +1,330 @@
+'''
+End-to-end load test for the backend.
+
+Drives chat, file upload, file listing, chat history, search and the essay generate/submit flow at rising
+concurrency, and saves latency percentiles, throughput, time to first token and server event loop lag
+as JSON so runs can be compared across commits.
+
+Start Mongo, the fake OpenRouter server and the backend first:
+
+    python -m benchmarks.fake_openrouter --port 8001
+    OPENROUTER_BASE_URL=http://localhost:8001/api/v1 uvicorn main:app --port 8000
+
+Then, from /backend:
+
+    python -m benchmarks.load_test --concurrency 1 8 32 --duration 20
+    python -m benchmarks.load_test --compare benchmarks/results/a.json benchmarks/results/b.json
+'''
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import httpx
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+SCENARIOS = ("chat", "upload", "list_files", "history", "essay", "search")
+# Seconds to wait before the closing /metrics scrape so every worker's snapshot covers the level
+LAG_SNAPSHOT_WAIT = 1.5
+
+# Text uploaded by the upload scenario and used as the essay material, about 20 KB
+SAMPLE_TEXT = (
+    "Photosynthesis converts light energy into chemical energy stored in glucose. "
+    "It takes place in the chloroplasts, where chlorophyll absorbs mostly blue and red light. "
+    "The light reactions produce ATP and NADPH, which the Calvin cycle uses to fix carbon dioxide.\n"
+) * 80
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    '''
+    Nearest-rank percentile, q between 0 and 100
+    '''
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(int(round(q / 100 * len(ordered))) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+def summarize(values: List[float]) -> Dict[str, Optional[float]]:
+    '''
+    Latency summary in milliseconds
+    '''
+    def ms(value: Optional[float]) -> Optional[float]:
+        return round(value * 1000, 2) if value is not None else None
+
+    return {
+        "p50": ms(percentile(values, 50)),
+        "p95": ms(percentile(values, 95)),
+        "p99": ms(percentile(values, 99)),
+        "mean": ms(statistics.fmean(values)) if values else None,
+        "max": ms(max(values)) if values else None
+    }
+
+class Scenario:
+    '''
+    Request flows of the load test. Each method performs one iteration, returns its time to
+    first token if the flow streams, and raises on failure.
+    '''
+
+    def __init__(self, client: httpx.AsyncClient, learning_space_id: str):
+        self.client = client
+        self.learning_space_id = learning_space_id
+
+    async def chat(self) -> Optional[float]:
+        start = time.perf_counter()
+        ttft = None
+        async with self.client.stream(
+            "POST",
+            "/chat/message",
+            json={"content": "Summarize the main idea of the material", "learning_space_id": self.learning_space_id},
+            headers={"Accept": "text/event-stream"}
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if ttft is None and line == "event: token":
+                    ttft = time.perf_counter() - start
+                if line == "event: error":
+                    raise Exception("Chat stream reported an error")
+        return ttft
+
+    async def upload(self) -> None:
+        response = await self.client.post(
+            f"/database/files/upload/{self.learning_space_id}",
+            files={"file": ("notes.txt", SAMPLE_TEXT.encode(), "text/plain")}
+        )
+        response.raise_for_status()
+
+    async def list_files(self) -> None:
+        response = await self.client.get(f"/database/files/learning-space/{self.learning_space_id}")
+        response.raise_for_status()
+
+    async def history(self) -> None:
+        response = await self.client.get(f"/chat/history/{self.learning_space_id}")
+        response.raise_for_status()
+
+    async def search(self) -> None:
+        response = await self.client.get(f"/search/{self.learning_space_id}", params={"q": "photosynthesis energy"})
+        response.raise_for_status()
+
+    async def essay(self) -> None:
+        response = await self.client.post(f"/tools/essay-topic/generate/{self.learning_space_id}")
+        response.raise_for_status()
+        tool_history_id = response.json()["toolHistoryId"]
+        response = await self.client.post(
+            f"/tools/essay-topic/submit/{tool_history_id}",
+            json={"essay_text": SAMPLE_TEXT[:2000]}
+        )
+        response.raise_for_status()
+
+async def scrape_event_loop_lag(client: httpx.AsyncClient) -> Optional[Tuple[Dict[float, float], float, float]]:
+    '''
+    Read the cumulative event_loop_lag_seconds histogram from /metrics: buckets, sum and count.
+    With several workers it is summed over all of them, so the lag covers every worker's loop.
+    Returns None if the server could not be scraped, e.g. while its event loop is blocked.
+    '''
+    try:
+        response = await client.get("/metrics", timeout=30)
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        print(f"Could not scrape /metrics: {type(e).__name__}")
+        return None
+    buckets: Dict[float, float] = {}
+    total = count = 0.0
+    for line in response.text.splitlines():
+        if line.startswith("event_loop_lag_seconds_bucket"):
+            bound = line.split('le="')[1].split('"')[0]
+            buckets[float("inf") if bound == "+Inf" else float(bound)] = float(line.rsplit(" ", 1)[1])
+        elif line.startswith("event_loop_lag_seconds_sum"):
+            total = float(line.rsplit(" ", 1)[1])
+        elif line.startswith("event_loop_lag_seconds_count"):
+            count = float(line.rsplit(" ", 1)[1])
+    return buckets, total, count
+
+def lag_between(before: Optional[Tuple[Dict[float, float], float, float]], after: Optional[Tuple[Dict[float, float], float, float]]) -> Dict[str, Optional[float]]:
+    '''
+    Event loop lag observed between two scrapes. Percentiles are the upper bound of the bucket they fall in.
+    '''
+    if before is None or after is None or after[2] - before[2] <= 0:
+        return {"mean": None, "p99": None, "max_bucket": None}
+    buckets = {bound: after[0][bound] - before[0].get(bound, 0) for bound in sorted(after[0])}
+    count = after[2] - before[2]
+
+    def bucket_percentile(q: float) -> float:
+        for bound, cumulative in buckets.items():
+            if cumulative >= q / 100 * count:
+                return bound
+        return float("inf")
+
+    def ms(value: float) -> Optional[float]:
+        return round(value * 1000, 2) if value != float("inf") else None
+
+    previous = 0.0
+    max_bucket = 0.0
+    for bound, cumulative in buckets.items():
+        if cumulative > previous:
+            max_bucket = bound
+        previous = cumulative
+
+    return {
+        "mean": round((after[1] - before[1]) / count * 1000, 3),
+        "p99": ms(bucket_percentile(99)),
+        "max_bucket": ms(max_bucket)
+    }
+
+async def run_level(
+    base_url: str,
+    scenario_name: str,
+    learning_space_id: str,
+    concurrency: int,
+    duration: float,
+    timeout: float
+) -> Dict[str, Any]:
+    '''
+    Run one scenario with `concurrency` workers issuing requests back to back for `duration` seconds
+    '''
+    limits = httpx.Limits(max_connections=concurrency + 1, max_keepalive_connections=concurrency + 1)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        scenario: Callable[[], Awaitable[Optional[float]]] = getattr(Scenario(client, learning_space_id), scenario_name)
+        latencies: List[float] = []
+        ttfts: List[float] = []
+        errors: Dict[str, int] = {}
+        deadline = time.perf_counter() + duration
+
+        async def worker():
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    ttft = await scenario()
+                except Exception as e:
+                    key = f"{type(e).__name__}: {e}".splitlines()[0][:120]
+                    errors[key] = errors.get(key, 0) + 1
+                    continue
+                latencies.append(time.perf_counter() - start)
+                if ttft is not None:
+                    ttfts.append(ttft)
+
+        lag_before = await scrape_event_loop_lag(client)
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        # With several workers /metrics sums their snapshots, which are up to METRICS_SNAPSHOT_INTERVAL old
+        await asyncio.sleep(LAG_SNAPSHOT_WAIT)
+        lag_after = await scrape_event_loop_lag(client)
+
+    result = {
+        "scenario": scenario_name,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": sum(errors.values()),
+        "errorTypes": errors,
+        "rps": round(len(latencies) / elapsed, 2),
+        "latencyMs": summarize(latencies),
+        "eventLoopLagMs": lag_between(lag_before, lag_after)
+    }
+    if ttfts:
+        result["ttftMs"] = summarize(ttfts)
+    return result
+
+async def setup_learning_space(base_url: str) -> str:
+    '''
+    Create a learning space with one file, so chat and essay requests have material to work with
+    '''
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        response = await client.post("/database/learning-spaces/", params={"name": f"load-test {datetime.now().isoformat()}"})
+        response.raise_for_status()
+        learning_space_id = response.json()["id"]
+        response = await client.post(
+            f"/database/files/upload/{learning_space_id}",
+            files={"file": ("material.txt", SAMPLE_TEXT.encode(), "text/plain")}
+        )
+        response.raise_for_status()
+        return learning_space_id
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+def print_result(result: Dict[str, Any]):
+    latency = {key: "-" if value is None else value for key, value in result["latencyMs"].items()}
+    line = (
+        f"{result['scenario']:<11} c={result['concurrency']:<4} {result['rps']:>8} req/s  "
+        f"p50 {latency['p50']}ms  p95 {latency['p95']}ms  p99 {latency['p99']}ms  errors {result['errors']}"
+    )
+    if "ttftMs" in result:
+        line += f"  ttft p50 {result['ttftMs']['p50']}ms"
+    if result["eventLoopLagMs"]["p99"] is not None:
+        line += f"  loop lag p99 <= {result['eventLoopLagMs']['p99']}ms"
+    print(line)
+
+def compare(baseline_path: str, candidate_path: str):
+    '''
+    Print the change in throughput and p95 latency between two result files
+    '''
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(candidate_path) as f:
+        candidate = json.load(f)
+
+    previous = {(r["scenario"], r["concurrency"]): r for r in baseline["results"]}
+    print(f"{baseline.get('commit')} -> {candidate.get('commit')}")
+    for result in candidate["results"]:
+        before = previous.get((result["scenario"], result["concurrency"]))
+        if not before:
+            continue
+        rps_change = (result["rps"] / before["rps"] - 1) * 100 if before["rps"] else 0
+        p95_before, p95_after = before["latencyMs"]["p95"], result["latencyMs"]["p95"]
+        p95_change = (p95_after / p95_before - 1) * 100 if p95_before and p95_after else 0
+        print(
+            f"{result['scenario']:<11} c={result['concurrency']:<4} "
+            f"rps {before['rps']} -> {result['rps']} ({rps_change:+.1f}%)  "
+            f"p95 {p95_before} -> {p95_after}ms ({p95_change:+.1f}%)"
+        )
+
+async def main(args: argparse.Namespace):
+    learning_space_id = args.learning_space_id or await setup_learning_space(args.base_url)
+
+    results = []
+    for scenario_name in args.scenarios:
+        for concurrency in args.concurrency:
+            result = await run_level(args.base_url, scenario_name, learning_space_id, concurrency, args.duration, args.timeout)
+            print_result(result)
+            results.append(result)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(),
+        "baseUrl": args.base_url,
+        "durationPerLevel": args.duration,
+        "learningSpaceId": learning_space_id,
+        "results": results
+    }
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-{report['commit'] or 'unknown'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved results to {output}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the backend at rising concurrency")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 16, 64])
+    parser.add_argument("--duration", type=float, default=15, help="Seconds per scenario and concurrency level")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--learning-space-id", help="Use an existing learning space instead of creating one")
+    parser.add_argument("--output", help="Result file, defaults to benchmarks/results/<time>-<commit>.json")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CANDIDATE"), help="Compare two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    else:
+        asyncio.run(main(args))
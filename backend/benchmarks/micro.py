@@ -0,0 +1,228 @@
+'''
+Micro-benchmarks for text extraction and prompt building.
+
+Runs parse_pdf_file, parse_text_file, prompt_with_files_context and build_conversation_context over a
+generated corpus (1 to 1000 page PDFs, huge text files, many small files, long chat histories) and
+reports wall time, peak traced memory and retained allocations. From /backend:
+
+    python -m benchmarks.micro
+    python -m benchmarks.micro --only parse_pdf_file --repeat 5
+    python -m benchmarks.micro --compare benchmarks/results/micro-a.json benchmarks/results/micro-b.json
+
+Generated PDFs are cached in benchmarks/.corpus, since building the 1000 page one takes a while.
+'''
+import argparse
+import gc
+import json
+import os
+import random
+import statistics
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import pymupdf
+from internal.common import prompt_with_files_context
+from internal.parsers import parse_pdf_file, parse_text_file
+from internal.chat import build_conversation_context
+from models.database import ChatMessage, File
+
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), ".corpus")
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+WORDS = (
+    "cell membrane protein energy glucose mitochondria enzyme reaction molecule structure function "
+    "transport diffusion osmosis gradient chlorophyll photosynthesis respiration carbon oxygen water"
+).split()
+
+def sentence(rng: random.Random, words: int = 12) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+def paragraph_lines(rng: random.Random, lines: int) -> List[str]:
+    # Indented and blank lines, like text extracted from real PDFs, so the strip and join passes have work to do
+    return [("    " if i % 7 == 0 else "") + sentence(rng) + ("   " if i % 5 == 0 else "") for i in range(lines)]
+
+def build_pdf(pages: int) -> bytes:
+    '''
+    Build (or load from the corpus cache) a PDF with `pages` pages of about 40 lines each
+    '''
+    path = os.path.join(CORPUS_DIR, f"pages-{pages}.pdf")
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    rng = random.Random(pages)
+    doc = pymupdf.open()
+    for _ in range(pages):
+        page = doc.new_page()
+        page.insert_text((50, 60), "\n".join(paragraph_lines(rng, 40)), fontsize=9)
+    content = doc.tobytes()
+    doc.close()
+
+    os.makedirs(CORPUS_DIR, exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+    return content
+
+def build_text(size: int, encoding: str = "utf-8") -> bytes:
+    rng = random.Random(size)
+    lines = []
+    total = 0
+    while total < size:
+        line = sentence(rng, 16)
+        if encoding == "latin-1":
+            # Characters that are not valid UTF-8 once encoded, to exercise the fallback
+            line += " caf\xe9 na\xefve"
+        lines.append(line)
+        total += len(line) + 1
+    return "\n".join(lines).encode(encoding)
+
+def build_files(count: int, size: int) -> List[File]:
+    rng = random.Random(count * size)
+    now = datetime.now()
+    files = []
+    for i in range(count):
+        text = "\n".join(paragraph_lines(rng, max(size // 90, 1)))
+        files.append(File(
+            id=str(i), learningSpaceId="benchmark", name=f"file-{i}.txt", type="txt",
+            size=len(text), mimeType="text/plain", uploadedAt=now, extractedText=text
+        ))
+    return files
+
+def build_messages(count: int, size: int) -> List[ChatMessage]:
+    rng = random.Random(count)
+    start = datetime.now()
+    return [
+        ChatMessage(
+            id=str(i), learningSpaceId="benchmark", role="user" if i % 2 == 0 else "assistant",
+            content=" ".join(sentence(rng) for _ in range(max(size // 90, 1))),
+            timestamp=start + timedelta(seconds=i), messageId=str(i)
+        )
+        for i in range(count)
+    ]
+
+def cases(huge_text_mb: int) -> List[Tuple[str, str, Callable[[], Any]]]:
+    '''
+    (function, case, setup) triples. setup returns the arguments and runs outside the measurement.
+    '''
+    return [
+        *[("parse_pdf_file", f"{pages}_pages", lambda pages=pages: (build_pdf(pages),)) for pages in (1, 10, 100, 1000)],
+        ("parse_text_file", "1mb_utf8", lambda: (build_text(1_000_000),)),
+        ("parse_text_file", f"{huge_text_mb}mb_utf8", lambda: (build_text(huge_text_mb * 1_000_000),)),
+        ("parse_text_file", "10mb_latin1_fallback", lambda: (build_text(10_000_000, "latin-1"),)),
+        ("prompt_with_files_context", "1000_small_files", lambda: ("What is osmosis?", build_files(1000, 2_000))),
+        ("prompt_with_files_context", "3_large_files", lambda: ("What is osmosis?", build_files(3, 2_000_000))),
+        ("build_conversation_context", "5_messages", lambda: (build_messages(5, 1_000), "And diffusion?")),
+        ("build_conversation_context", "500_messages", lambda: (build_messages(500, 1_000), "And diffusion?")),
+        ("build_conversation_context", "5_long_messages", lambda: (build_messages(5, 200_000), "And diffusion?")),
+    ]
+
+FUNCTIONS: Dict[str, Callable[..., Any]] = {
+    "parse_pdf_file": parse_pdf_file,
+    "parse_text_file": parse_text_file,
+    "prompt_with_files_context": prompt_with_files_context,
+    "build_conversation_context": build_conversation_context,
+}
+
+def measure(function: Callable[..., Any], args: tuple, repeat: int) -> Dict[str, Any]:
+    '''
+    Time `repeat` calls, then trace one more call for peak memory and retained allocations.
+    Timing runs without tracemalloc, which slows allocation heavy code several times over.
+    '''
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = function(*args)
+        times.append(time.perf_counter() - start)
+        del result
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    baseline, _ = tracemalloc.get_traced_memory()
+    result = function(*args)
+    current, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    retained_blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0)
+    return {
+        "wallMs": {
+            "min": round(min(times) * 1000, 3),
+            "median": round(statistics.median(times) * 1000, 3),
+            "max": round(max(times) * 1000, 3)
+        },
+        "peakBytes": peak - baseline,
+        "retainedBytes": current - baseline,
+        "retainedBlocks": retained_blocks,
+        "outputChars": len(result) if isinstance(result, str) else None
+    }
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+def compare(baseline_path: str, candidate_path: str):
+    '''
+    Print the change in median wall time and peak memory between two result files
+    '''
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(candidate_path) as f:
+        candidate = json.load(f)
+
+    previous = {(r["function"], r["case"]): r for r in baseline["results"]}
+    print(f"{baseline.get('commit')} -> {candidate.get('commit')}")
+    for result in candidate["results"]:
+        before = previous.get((result["function"], result["case"]))
+        if not before:
+            continue
+        time_change = (result["wallMs"]["median"] / before["wallMs"]["median"] - 1) * 100 if before["wallMs"]["median"] else 0
+        peak_change = (result["peakBytes"] / before["peakBytes"] - 1) * 100 if before["peakBytes"] else 0
+        print(
+            f"{result['function']:<28} {result['case']:<22} "
+            f"median {before['wallMs']['median']} -> {result['wallMs']['median']}ms ({time_change:+.1f}%)  "
+            f"peak {before['peakBytes']} -> {result['peakBytes']}B ({peak_change:+.1f}%)"
+        )
+
+def main(args: argparse.Namespace):
+    results = []
+    for function_name, case, setup in cases(args.huge_text_mb):
+        if args.only and function_name not in args.only:
+            continue
+        function_args = setup()
+        result = {"function": function_name, "case": case, **measure(FUNCTIONS[function_name], function_args, args.repeat)}
+        results.append(result)
+        print(
+            f"{function_name:<28} {case:<22} median {result['wallMs']['median']:>10}ms  "
+            f"peak {result['peakBytes'] / 1_000_000:>9.2f}MB  retained blocks {result['retainedBlocks']}"
+        )
+        del function_args
+
+    report = {"commit": git_commit(), "timestamp": datetime.now().isoformat(), "repeat": args.repeat, "results": results}
+    output = args.output or os.path.join(RESULTS_DIR, f"micro-{datetime.now():%Y%m%d-%H%M%S}-{report['commit'] or 'unknown'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved results to {output}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for extraction and prompt building")
+    parser.add_argument("--only", nargs="+", choices=list(FUNCTIONS), help="Only benchmark these functions")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed calls per case")
+    parser.add_argument("--huge-text-mb", type=int, default=100, help="Size of the huge text file case")
+    parser.add_argument("--output", help="Result file, defaults to benchmarks/results/micro-<time>-<commit>.json")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CANDIDATE"), help="Compare two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    else:
+        main(args)
@@ -0,0 +1,143 @@
+'''
+Per-document cost of building and serializing list responses.
+
+Compares building one validated model per Mongo document (the previous path) with validating the
+whole list in one TypeAdapter call, and measures the response_model pass FastAPI runs afterwards.
+model_construct, jsonable_encoder and orjson are included for reference. From /backend:
+
+    python -m benchmarks.serialization --documents 100 1000
+'''
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List
+from fastapi.encoders import jsonable_encoder
+from models.database import ChatMessage, File
+from internal.database.chat_messages import chat_message_list
+from internal.database.files import file_list
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def chat_documents(count: int) -> List[Dict[str, Any]]:
+    start = datetime(2025, 1, 1)
+    return [
+        {
+            "_id": f"message-{i}",
+            "learningSpaceId": "space",
+            "toolHistoryId": None,
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": "Osmosis is the diffusion of water across a membrane. " * 10,
+            "timestamp": start + timedelta(seconds=i),
+            "messageId": f"id-{i}",
+            "status": "complete",
+            "updatedAt": start + timedelta(seconds=i)
+        }
+        for i in range(count)
+    ]
+
+def file_documents(count: int) -> List[Dict[str, Any]]:
+    return [
+        {
+            "id": f"file-{i}",
+            "learningSpaceId": "space",
+            "name": f"notes-{i}.pdf",
+            "type": "pdf",
+            "size": 120_000,
+            "mimeType": "application/pdf",
+            "uploadedAt": datetime(2025, 1, 1),
+            "extractedText": "Chlorophyll absorbs blue and red light. " * 200
+        }
+        for i in range(count)
+    ]
+
+def chat_fields(doc: Dict[str, Any]) -> Dict[str, Any]:
+    return dict(
+        id=doc["_id"], learningSpaceId=doc["learningSpaceId"], toolHistoryId=doc.get("toolHistoryId"),
+        role=doc["role"], content=doc["content"], timestamp=doc["timestamp"], messageId=doc["messageId"],
+        status=doc.get("status"), error=doc.get("error"), updatedAt=doc.get("updatedAt")
+    )
+
+def chat_per_document(docs):
+    # Previous path: one validated model per document, then the response_model pass
+    messages = [ChatMessage(**chat_fields(doc)) for doc in docs]
+    return chat_message_list.dump_json(chat_message_list.validate_python(messages))
+
+def chat_bulk(docs):
+    for doc in docs:
+        doc["id"] = doc.pop("_id")
+    messages = chat_message_list.validate_python(docs)
+    return chat_message_list.dump_json(chat_message_list.validate_python(messages))
+
+def chat_bulk_without_response_model(docs):
+    for doc in docs:
+        doc["id"] = doc.pop("_id")
+    return chat_message_list.dump_json(chat_message_list.validate_python(docs))
+
+def chat_construct(docs):
+    messages = [ChatMessage.model_construct(**chat_fields(doc)) for doc in docs]
+    return chat_message_list.dump_json(messages)
+
+def chat_jsonable(docs):
+    # FastAPI without a response_model: jsonable_encoder and json.dumps
+    messages = [ChatMessage(**chat_fields(doc)) for doc in docs]
+    return json.dumps(jsonable_encoder(messages)).encode()
+
+def chat_orjson(docs):
+    messages = [ChatMessage(**chat_fields(doc)) for doc in docs]
+    return orjson.dumps([message.model_dump() for message in messages])
+
+def files_per_document(docs):
+    files = [File(**doc) for doc in docs]
+    return file_list.dump_json(file_list.validate_python(files))
+
+def files_bulk(docs):
+    files = file_list.validate_python(docs)
+    return file_list.dump_json(file_list.validate_python(files))
+
+def per_document_us(function: Callable[[List[Dict[str, Any]]], bytes], docs: List[Dict[str, Any]], repeat: int) -> float:
+    '''
+    Best of `repeat` runs, in microseconds per document
+    '''
+    best = float("inf")
+    for _ in range(repeat):
+        # Copies, since the functions may consume the documents
+        batch = [dict(doc) for doc in docs]
+        start = time.perf_counter()
+        function(batch)
+        best = min(best, time.perf_counter() - start)
+    return best / len(docs) * 1_000_000
+
+def main(args: argparse.Namespace):
+    cases = [
+        ("chat messages", chat_documents, [
+            ("model per document", chat_per_document),
+            ("TypeAdapter bulk", chat_bulk),
+            ("bulk, no response_model pass", chat_bulk_without_response_model),
+            ("model_construct", chat_construct),
+            ("jsonable_encoder + json.dumps", chat_jsonable),
+            *([("orjson", chat_orjson)] if orjson else []),
+        ]),
+        ("files", file_documents, [
+            ("model per document", files_per_document),
+            ("TypeAdapter bulk", files_bulk),
+        ]),
+    ]
+
+    for name, build, paths in cases:
+        for count in args.documents:
+            docs = build(count)
+            baseline = None
+            for label, function in paths:
+                cost = per_document_us(function, docs, args.repeat)
+                baseline = baseline or cost
+                print(f"{name:<14} n={count:<6} {label:<30} {cost:>8.2f} us/doc  {baseline / cost:>5.2f}x")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-document cost of list responses")
+    parser.add_argument("--documents", nargs="+", type=int, default=[100, 1000])
+    parser.add_argument("--repeat", type=int, default=20)
+    main(parser.parse_args())
@@ -0,0 +1,54 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Generic, Hashable, Optional, Tuple, TypeVar
+from .metrics import cache_requests, cache_evictions
+
+# Entries are per process, with several workers a write in one is seen by the others after at most the TTL
+CACHE_TTL_SECONDS = float(os.getenv('CACHE_TTL_SECONDS', '10'))
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '1024'))
+
+V = TypeVar("V")
+
+class TTLCache(Generic[V]):
+    '''
+    In-process LRU cache with a time to live per entry.
+    Not locked: it is only used from the event loop, and a lookup, database read and set run without an
+    await in between, so an invalidation cannot slip between the read and the set.
+    '''
+
+    def __init__(self, name: str, ttl: float = CACHE_TTL_SECONDS, max_entries: int = CACHE_MAX_ENTRIES):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[float, V]]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[V]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            cache_requests.inc(cache=self.name, result="miss")
+            return None
+
+        self._entries.move_to_end(key)
+        cache_requests.inc(cache=self.name, result="hit")
+        return entry[1]
+
+    def set(self, key: Hashable, value: V):
+        if self.ttl <= 0 or self.max_entries <= 0:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            cache_evictions.inc(cache=self.name)
+
+    def invalidate(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
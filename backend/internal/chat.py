@@ -1,60 +1,108 @@
-from typing import Optional, AsyncGenerator, List
+from typing import Optional, List
+import asyncio
+import time
 from models.database import ChatMessage
-from .common import open_router_api_streaming
+from .common import open_router_api_streaming, build_files_context, append_files_context, track_llm_usage_later
+from .chat_stream import ChatStreamSession, create_session
+from .metrics import streams_in_flight
+from .tracing import start_span
 from .database.chat_messages import (
-    create_chat_message,
+    enqueue_chat_message,
     get_latest_chat_messages,
     delete_chat_messages_by_learning_space,
     get_chat_messages_by_learning_space
 )
 
-async def send_chat_message_with_streaming(
+async def start_chat_message_stream(
     learning_space_id: str,
     user_message: str,
     model: str = "gpt-4o",
     tool_history_id: Optional[str] = None,
     context_limit: int = 10,
     files: Optional[List] = None
-) -> AsyncGenerator[str, None]:
+) -> ChatStreamSession:
     """
-    Send a chat message and get a streaming response from OpenRouter.
-    Saves both user message and assistant response to the database.
-    
-    Args:
-        learning_space_id: ID of the learning space
-        user_message: The user's message
-        model: Model to use for the response
-        tool_history_id: Optional tool history ID for context
-        context_limit: Number of recent messages to include as context
-    
-    Yields:
-        String chunks of the assistant's response
+    Start generating the assistant's reply to a chat message in the background.
+    The reply is generated independently of any client, so clients can follow it with
+    session.follow() and reconnect later using session.message_id.
     """
-    
-    # 1. Save the user's message to the database
+    session = create_session(learning_space_id, tool_history_id)
+    session.task = asyncio.create_task(
+        generate_assistant_reply(session, user_message, model, context_limit, files)
+    )
+    return session
+
+async def generate_assistant_reply(
+    session: ChatStreamSession,
+    user_message: str,
+    model: str = "gpt-4o",
+    context_limit: int = 10,
+    files: Optional[List] = None
+) -> None:
+    """
+    Generate the assistant's reply into a stream session.
+    Both writes go through the write-behind buffer, and the history read overlaps with
+    building the files context, so no Mongo round-trip is added before the model call.
+    The assistant message is created up front with status 'streaming', checkpointed while
+    the reply is generated and marked final at the end.
+    """
+    streams_in_flight.inc()
     try:
-        user_chat_message = await create_chat_message(
+        with start_span("chat.generate_reply", **{"chat.message_id": session.message_id, "llm.model": model}):
+            await _generate_assistant_reply(session, user_message, model, context_limit, files)
+    except asyncio.CancelledError:
+        # Keep what was generated before the client went away
+        await session.finish("cancelled")
+        raise
+    finally:
+        streams_in_flight.dec()
+        if not session.finished:
+            await session.finish("error")
+
+async def _generate_assistant_reply(
+    session: ChatStreamSession,
+    user_message: str,
+    model: str,
+    context_limit: int,
+    files: Optional[List]
+) -> None:
+    learning_space_id = session.learning_space_id
+    tool_history_id = session.tool_history_id
+
+    # 1. Queue the user's message for saving
+    try:
+        user_chat_message = await enqueue_chat_message(
             learning_space_id=learning_space_id,
             role="user",
             content=user_message,
             tool_history_id=tool_history_id
         )
     except Exception as e:
-        yield f"Error saving message: {str(e)}"
+        await session.finish("error", error=f"Error saving message: {str(e)}")
         return
     
-    # 2. Get recent conversation context
-    try:
-        recent_messages = await get_latest_chat_messages(
-            learning_space_id=learning_space_id,
-            tool_history_id=tool_history_id,
-            limit=context_limit
+    # 2. Get recent conversation context while the files context is built
+    with start_span("chat.fetch_context"):
+        recent_messages, files_context = await asyncio.gather(
+            get_latest_chat_messages(
+                learning_space_id=learning_space_id,
+                tool_history_id=tool_history_id,
+                limit=context_limit
+            ),
+            asyncio.to_thread(traced_build_files_context, files),
+            return_exceptions=True
         )
-    except Exception as e:
+    if isinstance(recent_messages, BaseException):
         recent_messages = []
+    if isinstance(files_context, BaseException):
+        files_context = ""
+
+    # The queued user message is already part of the history, it is added back as the current message
+    recent_messages = [msg for msg in recent_messages if msg.id != user_chat_message.id]
     
     # 3. Build the conversation context for the model
-    conversation_context = build_conversation_context(recent_messages, user_message)
+    with start_span("chat.build_prompt", **{"chat.history_messages": len(recent_messages)}):
+        conversation_context = build_conversation_context(recent_messages, user_message)
 
     # Master prompt with rules and instructions
     master_prompt = """
@@ -73,30 +121,46 @@ async def send_chat_message_with_streaming(
     If no relevant information is found in the provided documents, clearly state this and ask if they would like you to provide general knowledge on the topic instead.
     """
     conversation_context = f"{master_prompt}\n\nConversation Context:\n{conversation_context}"
+    conversation_context = append_files_context(conversation_context, files_context)
 
-    # 4. Stream the response from OpenRouter
-    assistant_response = ""
+    # 4. Create the assistant message up front so the reply survives disconnects and restarts
     try:
-        async for chunk in open_router_api_streaming(model=model, prompt=conversation_context, files=files):
-            assistant_response += chunk
-            yield chunk
-            
+        await enqueue_chat_message(
+            learning_space_id=learning_space_id,
+            role="assistant",
+            content="",
+            tool_history_id=tool_history_id,
+            message_id=session.message_id,
+            status="streaming"
+        )
     except Exception as e:
-        error_message = f"Error getting response: {str(e)}"
-        assistant_response = error_message
-        yield error_message
-    
-    # 5. Save the complete assistant response to the database
-    if assistant_response:
-        try:
-            await create_chat_message(
-                learning_space_id=learning_space_id,
-                role="assistant",
-                content=assistant_response,
-                tool_history_id=tool_history_id
-            )
-        except Exception as e:
-            yield f"Error saving assistant response: {str(e)}"
+        await session.finish("error", error=f"Error saving message: {str(e)}")
+        return
+
+    # 5. Stream the response from OpenRouter, checkpointing it as it arrives
+    usage = {}
+    start = time.perf_counter()
+    try:
+        async for chunk in open_router_api_streaming(model=model, prompt=conversation_context, usage=usage):
+            await session.append(chunk)
+
+        session.usage = usage or None
+
+        # 6. Mark the assistant message final
+        await session.finish("complete")
+    except Exception as e:
+        await session.finish("error", error=f"Error getting response: {str(e)}")
+    finally:
+        # Recorded once the reply is final, in the background so the done event never waits on Mongo.
+        # The usage chunk only arrives at the end, failed and cancelled generations count without tokens.
+        track_llm_usage_later(learning_space_id, "chat", model, usage, time.perf_counter() - start)
+
+def traced_build_files_context(files: Optional[List] = None) -> str:
+    """
+    build_files_context with its own span, for running in a worker thread
+    """
+    with start_span("chat.build_files_context", **{"chat.files": len(files or [])}):
+        return build_files_context(files)
 
 def build_conversation_context(recent_messages: List[ChatMessage], current_message: str) -> str:
     """
@@ -108,7 +172,7 @@ def build_conversation_context(recent_messages: List[ChatMessage], current_messa
     # Build a conversation history (limit to avoid token limits)
     context_parts = []
     
-    # Add recent messages (excluding the current one we just saved)
+    # Add recent messages (the current one is appended below)
     for msg in recent_messages[-5:]:  # Last 5 messages for context
         if msg.role == "user":
             context_parts.append(f"User: {msg.content}")
@@ -0,0 +1,192 @@
+import asyncio
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import AsyncGenerator, Dict, List, Optional
+from .metrics import llm_generations_cancelled
+from .database.chat_messages import (
+    enqueue_chat_message_append,
+    enqueue_chat_message_status,
+    get_chat_message_by_id
+)
+
+# Checkpoint the partial reply after this many characters or seconds, whichever comes first
+CHECKPOINT_CHARS = int(os.getenv('CHAT_CHECKPOINT_CHARS', '512'))
+CHECKPOINT_INTERVAL = float(os.getenv('CHAT_CHECKPOINT_INTERVAL', '1.0'))
+# How long a finished session stays in memory for reconnecting clients
+SESSION_RETENTION = float(os.getenv('CHAT_SESSION_RETENTION', '60'))
+# A stored message that has not been checkpointed for this long is treated as interrupted
+STALE_STREAM_SECONDS = float(os.getenv('CHAT_STALE_STREAM_SECONDS', '30'))
+# Generation is cancelled once no client has followed the stream for this long
+DISCONNECT_GRACE_SECONDS = float(os.getenv('CHAT_DISCONNECT_GRACE_SECONDS', '10'))
+
+_sessions: Dict[str, 'ChatStreamSession'] = {}
+
+class ChatStreamSession:
+    '''
+    In-process state of an assistant message that is being generated.
+    Chunks are kept in memory so any number of clients can follow the stream from an offset,
+    and are checkpointed to the stored message in batches.
+    '''
+
+    def __init__(self, learning_space_id: str, tool_history_id: Optional[str] = None):
+        self.message_id = str(uuid.uuid4())
+        self.learning_space_id = learning_space_id
+        self.tool_history_id = tool_history_id
+        self.status = "streaming"
+        self.error: Optional[str] = None
+        self.usage: Optional[dict] = None
+        self.task: Optional[asyncio.Task] = None
+        self._chunks: List[str] = []
+        self._length = 0
+        self._checkpointed_chunks = 0
+        self._checkpointed_length = 0
+        self._last_checkpoint = time.monotonic()
+        self._changed = asyncio.Condition()
+        self._followers = 0
+        self._cancel_handle: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status != "streaming"
+
+    def text(self) -> str:
+        '''
+        Get the reply generated so far
+        '''
+        return "".join(self._chunks)
+
+    async def append(self, chunk: str):
+        '''
+        Add a generated chunk, wake up followers and checkpoint if a batch is due
+        '''
+        self._chunks.append(chunk)
+        self._length += len(chunk)
+
+        if (
+            self._length - self._checkpointed_length >= CHECKPOINT_CHARS
+            or time.monotonic() - self._last_checkpoint >= CHECKPOINT_INTERVAL
+        ):
+            self.checkpoint()
+
+        async with self._changed:
+            self._changed.notify_all()
+
+    def checkpoint(self):
+        '''
+        Queue an append of everything generated since the last checkpoint
+        '''
+        if self._checkpointed_length < self._length:
+            batch = "".join(self._chunks[self._checkpointed_chunks:])
+            enqueue_chat_message_append(self.message_id, self._checkpointed_length, batch)
+            self._checkpointed_chunks = len(self._chunks)
+            self._checkpointed_length = self._length
+        self._last_checkpoint = time.monotonic()
+
+    async def finish(self, status: str = "complete", error: Optional[str] = None):
+        '''
+        Write the final checkpoint, mark the stored message final and release followers
+        '''
+        self.checkpoint()
+        self.status = status
+        self.error = error
+        enqueue_chat_message_status(self.message_id, status, error)
+
+        async with self._changed:
+            self._changed.notify_all()
+
+        # Keep the session around for a while so clients that reconnect can still replay it
+        asyncio.get_running_loop().call_later(SESSION_RETENTION, _sessions.pop, self.message_id, None)
+
+    def cancel(self):
+        '''
+        Cancel the generation, which closes the upstream LLM connection
+        '''
+        if self.task is not None and not self.task.done():
+            llm_generations_cancelled.inc(endpoint="chat")
+            self.task.cancel()
+
+    async def follow(self, offset: int = 0) -> AsyncGenerator[str, None]:
+        '''
+        Replay the reply from a character offset and keep following the live stream.
+        When the last follower leaves before the reply is finished, the generation is cancelled
+        after DISCONNECT_GRACE_SECONDS unless a client resumes the stream in the meantime.
+        '''
+        self._followers += 1
+        if self._cancel_handle is not None:
+            self._cancel_handle.cancel()
+            self._cancel_handle = None
+
+        try:
+            index = 0
+            position = 0  # Characters replayed or skipped so far
+            while True:
+                async with self._changed:
+                    await self._changed.wait_for(lambda: len(self._chunks) > index or self.finished)
+                chunks = self._chunks[index:]
+                index += len(chunks)
+                text = "".join(chunks)
+                if position + len(text) > offset:
+                    yield text[max(offset - position, 0):]
+                position += len(text)
+                if self.finished and index == len(self._chunks):
+                    return
+        finally:
+            self._followers -= 1
+            if self._followers == 0 and not self.finished:
+                self._cancel_handle = asyncio.get_running_loop().call_later(DISCONNECT_GRACE_SECONDS, self.cancel)
+
+async def drain_sessions(timeout: float):
+    '''
+    Wait up to timeout seconds for replies that are still being generated, then cancel the rest.
+    Used at shutdown so in-flight replies are finished or marked cancelled before the worker exits.
+    '''
+    tasks = [session.task for session in _sessions.values() if session.task is not None and not session.task.done()]
+    if not tasks:
+        return
+
+    print(f"Waiting up to {timeout}s for {len(tasks)} chat replies to finish")
+    _, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.wait(pending)
+
+def create_session(learning_space_id: str, tool_history_id: Optional[str] = None) -> ChatStreamSession:
+    '''
+    Create and register a session for a new assistant message
+    '''
+    session = ChatStreamSession(learning_space_id, tool_history_id)
+    _sessions[session.message_id] = session
+    return session
+
+def get_session(message_id: str) -> Optional[ChatStreamSession]:
+    '''
+    Get the live session of a message generated by this worker, if any
+    '''
+    return _sessions.get(message_id)
+
+async def follow_stored_message(message_id: str, offset: int = 0) -> AsyncGenerator[str, None]:
+    '''
+    Follow a message from its stored checkpoints.
+    Used when the message is being generated by another worker or the session has expired.
+    Stops once the message is final or it has not been checkpointed for STALE_STREAM_SECONDS.
+    '''
+    while True:
+        message = await get_chat_message_by_id(message_id)
+        if not message:
+            return
+
+        if offset < len(message.content):
+            yield message.content[offset:]
+            offset = len(message.content)
+
+        if message.status in (None, "complete", "cancelled", "error"):
+            return
+
+        last_update = message.updatedAt or message.timestamp
+        if datetime.now() - last_update > timedelta(seconds=STALE_STREAM_SECONDS):
+            return
+
+        await asyncio.sleep(CHECKPOINT_INTERVAL)
@@ -1,8 +1,23 @@
-import requests
+import asyncio
+import httpx
 import json
 import os
-from typing import Optional, List
-import pymupdf
+import time
+from typing import Optional, List, Set
+from .tracing import start_span, SPAN_KIND_CLIENT
+from .database.llm_usage import record_llm_usage
+from .metrics import (
+    llm_request_duration,
+    llm_time_to_first_token,
+    llm_tokens_per_second
+)
+
+# Point this at benchmarks/fake_openrouter.py for load tests that should not hit the real API
+OPENROUTER_BASE_URL = os.getenv('OPENROUTER_BASE_URL', 'https://openrouter.ai/api/v1').rstrip('/')
+# Connections to OpenRouter per worker, one per concurrent call or stream
+OPENROUTER_MAX_CONNECTIONS = int(os.getenv('OPENROUTER_MAX_CONNECTIONS', '1000'))
+# Seconds without data from OpenRouter before a call fails, reasoning models can think for minutes
+OPENROUTER_READ_TIMEOUT = float(os.getenv('OPENROUTER_READ_TIMEOUT', '300'))
 
 MODELS = {
     # Selected models for this API
@@ -15,98 +30,236 @@ MODELS = {
     
 }
 
-async def open_router_api(model: str = "gpt-4o", prompt: str = "", files: Optional[List] = None, response_format: Optional[dict] = None) -> dict:
+MODEL_PRICING = {
+    # USD per million tokens: prompt, completion, cached prompt
+    "gpt-4o": (2.50, 10.00, 1.25),
+    "gemini-2.0-flash-001": (0.10, 0.40, 0.025),
+    "claude-sonnet-4": (3.00, 15.00, 0.30),
+    "claude-3-5-sonnet": (3.00, 15.00, 0.30),
+    "deepseek-r1-0528": (0.50, 2.15, 0.50),
+    "o1": (15.00, 60.00, 7.50),
+}
 
+def usage_with_cost(model: str, usage: dict) -> dict:
     '''
-    OpenRouter API wrapper
-    Returns: response from OpenRouter API
+    Normalize an OpenRouter usage block to prompt, completion and cached token counts and a cost in USD.
+    Cached prompt tokens are priced at the cached rate. Models without a MODEL_PRICING entry use
+    the cost reported by OpenRouter, if any.
+    '''
+    prompt_tokens = usage.get("prompt_tokens") or 0
+    completion_tokens = usage.get("completion_tokens") or 0
+    cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+
+    pricing = MODEL_PRICING.get(model)
+    if pricing:
+        prompt_price, completion_price, cached_price = pricing
+        cost = (
+            (prompt_tokens - cached_tokens) * prompt_price
+            + cached_tokens * cached_price
+            + completion_tokens * completion_price
+        ) / 1_000_000
+    else:
+        cost = usage.get("cost") or 0.0
+
+    return {
+        "promptTokens": prompt_tokens,
+        "completionTokens": completion_tokens,
+        "cachedTokens": cached_tokens,
+        "cost": cost
+    }
+
+async def track_llm_usage(learning_space_id: Optional[str], tool_type: str, model: str, usage: Optional[dict], duration: float = 0.0):
+    '''
+    Price the usage of an LLM call and add it to the usage totals.
+    Calls without usage (failed or cancelled before the last chunk) still count as a request with their duration.
+    Failures are logged and never fail the call that is being accounted for.
     '''
     try:
-        # Build the complete prompt with file context
-        prompt = prompt_with_files_context(prompt, files)
-
-        response = requests.post(
-            url="https://openrouter.ai/api/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {os.getenv('OPENROUTER_API_KEY')}",
-                "Content-Type": "application/json"
-            },
-            data=json.dumps({
-                "model": MODELS[model], # optional
-                "messages": [
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-                ],
-                **({"response_format": response_format} if response_format else {})
-            })
-        )
+        await record_llm_usage(learning_space_id, tool_type, model, usage_with_cost(model, usage or {}), duration)
     except Exception as e:
-        return {"error": f"Failed to get response from OpenRouter API {e}"}
+        print(f"Error recording LLM usage: {e}")
 
-    return response.json()
+# Usage recordings started by track_llm_usage_later, referenced until done so they are not garbage collected
+_usage_tasks: Set[asyncio.Task] = set()
 
-async def open_router_api_streaming(model: str = "gpt-4o", prompt: str = "", files: Optional[List] = None, response_format: Optional[dict] = None):
+def track_llm_usage_later(learning_space_id: Optional[str], tool_type: str, model: str, usage: Optional[dict], duration: float = 0.0):
     '''
-    OpenRouter API wrapper for streaming. https://openrouter.ai/docs/api-reference/streaming
-    Yields: content chunks from OpenRouter API stream
+    track_llm_usage in a background task, for callers that should not wait for the write
     '''
-    try:
-        # Build the complete prompt with file context
-        prompt = prompt_with_files_context(prompt, files)
-        
-        response = requests.post(
-            url="https://openrouter.ai/api/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {os.getenv('OPENROUTER_API_KEY')}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "model": MODELS[model],
-                "messages": [
+    task = asyncio.get_running_loop().create_task(track_llm_usage(learning_space_id, tool_type, model, usage, duration))
+    _usage_tasks.add(task)
+    task.add_done_callback(_usage_tasks.discard)
+
+_http_client: Optional[httpx.AsyncClient] = None
+
+def http_client() -> httpx.AsyncClient:
+    '''
+    The worker's client for OpenRouter. Requests and stream reads run on the event loop, so the number of
+    live streams is not limited by the thread pool used by asyncio.to_thread.
+    '''
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(OPENROUTER_READ_TIMEOUT, connect=10.0),
+            limits=httpx.Limits(max_connections=OPENROUTER_MAX_CONNECTIONS, max_keepalive_connections=100)
+        )
+    return _http_client
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+def openrouter_headers() -> dict:
+    return {
+        "Authorization": f"Bearer {os.getenv('OPENROUTER_API_KEY')}",
+        "Content-Type": "application/json"
+    }
+
+async def open_router_api(model: str = "gpt-4o", prompt: str = "", files: Optional[List] = None, response_format: Optional[dict] = None, usage: Optional[dict] = None) -> dict:
+
+    '''
+    OpenRouter API wrapper
+    Returns: response from OpenRouter API
+    If a usage dict is given, it is filled with the token usage of the response.
+    '''
+    with start_span("openrouter chat.completions", kind=SPAN_KIND_CLIENT, **{"llm.model": model, "llm.streaming": False}) as span:
+        start = time.perf_counter()
+        try:
+            # Build the complete prompt with file context
+            prompt = prompt_with_files_context(prompt, files)
+
+            # Cancelling the call closes the connection
+            response = await http_client().post(
+                f"{OPENROUTER_BASE_URL}/chat/completions",
+                headers=openrouter_headers(),
+                content=json.dumps({
+                    "model": MODELS[model], # optional
+                    "messages": [
                     {
                         "role": "user",
                         "content": prompt
                     }
-                ],
-                "stream": True,
-                **({"response_format": response_format} if response_format else {})
-            },
-            stream=True
-        )
+                    ],
+                    "usage": {"include": True},
+                    **({"response_format": response_format} if response_format else {})
+                })
+            )
+            span.set_attribute("http.status_code", response.status_code)
+        except Exception as e:
+            return {"error": f"Failed to get response from OpenRouter API {e}"}
+        finally:
+            llm_request_duration.observe(time.perf_counter() - start, model=model, streaming="false")
+
+    response_json = response.json()
+    if usage is not None and response_json.get("usage"):
+        usage.update(response_json["usage"])
+    return response_json
+
+class StreamError(Exception):
+    '''
+    Error reported by OpenRouter inside an SSE stream
+    '''
+
+async def open_router_api_streaming(model: str = "gpt-4o", prompt: str = "", files: Optional[List] = None, response_format: Optional[dict] = None, usage: Optional[dict] = None):
+    '''
+    OpenRouter API wrapper for streaming. https://openrouter.ai/docs/api-reference/streaming
+    Yields: content chunks from OpenRouter API stream
+    Raises: an exception if the request fails or OpenRouter reports an error mid-stream
+    Closing or cancelling the generator closes the upstream connection.
+    If a usage dict is given, it is filled with the token usage reported in the final chunk.
+    '''
+    # The span is not made current because generators can be resumed from other contexts
+    with start_span("openrouter chat.completions", kind=SPAN_KIND_CLIENT, activate=False, **{"llm.model": model, "llm.streaming": True}) as span:
+        response = None
+        start = time.perf_counter()
+        first_token_at = None
+        chunk_count = 0
+        try:
+            # Build the complete prompt with file context
+            prompt = prompt_with_files_context(prompt, files)
         
-        buffer = ""
-        for chunk in response.iter_content(chunk_size=1024, decode_unicode=True):
-            buffer += chunk
-            while True:
-                try:
-                    # Find the next complete SSE line
-                    line_end = buffer.find('\n')
-                    if line_end == -1:
-                        break
+            request = http_client().build_request(
+                "POST",
+                f"{OPENROUTER_BASE_URL}/chat/completions",
+                headers=openrouter_headers(),
+                json={
+                    "model": MODELS[model],
+                    "messages": [
+                        {
+                            "role": "user",
+                            "content": prompt
+                        }
+                    ],
+                    "stream": True,
+                    # Ask for the token usage in the final chunk
+                    "usage": {"include": True},
+                    **({"response_format": response_format} if response_format else {})
+                }
+            )
+            response = await http_client().send(request, stream=True)
+
+            span.set_attribute("http.status_code", response.status_code)
+            if response.status_code != 200:
+                await response.aread()
+                raise Exception(f"OpenRouter returned {response.status_code}: {response.text}")
+        
+            buffer = ""
+            async for chunk in response.aiter_text():
+                buffer += chunk
+                while True:
+                    try:
+                        # Find the next complete SSE line
+                        line_end = buffer.find('\n')
+                        if line_end == -1:
+                            break
                     
-                    line = buffer[:line_end].strip()
-                    buffer = buffer[line_end + 1:]
+                        line = buffer[:line_end].strip()
+                        buffer = buffer[line_end + 1:]
                     
-                    if line.startswith('data: '):
-                        data = line[6:]
-                        if data == '[DONE]':
-                            return
+                        if line.startswith('data: '):
+                            data = line[6:]
+                            if data == '[DONE]':
+                                return
                         
-                        try:
-                            data_obj = json.loads(data)
-                            content = data_obj["choices"][0]["delta"].get("content")
-                            if content:
-                                yield content
-                        except json.JSONDecodeError:
-                            # Skip non-JSON payloads (like comments)
-                            pass
-                except Exception:
-                    break
+                            try:
+                                data_obj = json.loads(data)
+                            except json.JSONDecodeError:
+                                # Skip non-JSON payloads (like comments)
+                                continue
+
+                            if "error" in data_obj:
+                                raise StreamError(data_obj["error"].get("message", "Unknown error"))
+                            if usage is not None and data_obj.get("usage"):
+                                usage.update(data_obj["usage"])
+                            if data_obj.get("choices"):
+                                content = data_obj["choices"][0]["delta"].get("content")
+                                if content:
+                                    if first_token_at is None:
+                                        first_token_at = time.perf_counter()
+                                        llm_time_to_first_token.observe(first_token_at - start, model=model)
+                                        span.set_attribute("llm.time_to_first_token_ms", (first_token_at - start) * 1000)
+                                    chunk_count += 1
+                                    yield content
+                    except StreamError:
+                        raise
+                    except Exception:
+                        break
                     
-    except Exception as e:
-        yield f"Error: Failed to get streaming response from OpenRouter API - {str(e)}"
+        except Exception as e:
+            raise Exception(f"Failed to get streaming response from OpenRouter API - {str(e)}") from e
+        finally:
+            # Also runs on cancellation and when the generator is closed, releasing the upstream connection
+            if response is not None:
+                await response.aclose()
+
+            end = time.perf_counter()
+            llm_request_duration.observe(end - start, model=model, streaming="true")
+            if first_token_at is not None and end > first_token_at:
+                # Prefer the reported completion tokens, content chunks are a close stand-in otherwise
+                completion_tokens = (usage or {}).get("completion_tokens") or chunk_count
+                llm_tokens_per_second.observe(completion_tokens / (end - first_token_at), model=model)
 
 def prompt_with_files_context(prompt: str, files: Optional[List] = None) -> str:
     """
@@ -119,8 +272,20 @@ def prompt_with_files_context(prompt: str, files: Optional[List] = None) -> str:
     Returns:
         Complete prompt with context appended
     """
+    return append_files_context(prompt, build_files_context(files))
+
+def build_files_context(files: Optional[List] = None) -> str:
+    """
+    Build the context section from the extracted text of the given files
+    
+    Args:
+        files: List of File objects (Pydantic models) or dicts with extractedText
+    
+    Returns:
+        Context section with one entry per file, empty if no file has text
+    """
     if not files:
-        return prompt
+        return ""
     
     # Filter files that have extractedText
     files_with_text = []
@@ -139,9 +304,6 @@ def prompt_with_files_context(prompt: str, files: Optional[List] = None) -> str:
                 'extractedText': extracted_text
             })
     
-    if not files_with_text:
-        return prompt
-    
     # Build context section
     context_parts = []
     for file in files_with_text:
@@ -150,92 +312,13 @@ def prompt_with_files_context(prompt: str, files: Optional[List] = None) -> str:
         
         context_parts.append(f"{filename}:\n{extracted_text}")
     
-    # Combine prompt with context
-    context_section = '\n\n'.join(context_parts)
-    prompt = f"{prompt}\n\nContext:\n{context_section}"
-    
-    return prompt
+    return '\n\n'.join(context_parts)
 
-def parse_file(content: bytes, file_type: str, mime_type: str) -> Optional[str]:
-    """
-    Parse and extract text content from different file types
-    
-    Args:
-        content: Raw file content as bytes
-        file_type: File type ('pdf', 'txt')
-        mime_type: MIME type of the file
-    
-    Returns:
-        Extracted text content or None if extraction fails
+def append_files_context(prompt: str, files_context: str) -> str:
     """
-    try:
-        # Handle text files
-        if file_type == 'txt' or 'text' in mime_type:
-            return parse_text_file(content)
-        
-        # Handle PDF files
-        elif file_type == 'pdf' or 'pdf' in mime_type:
-            return parse_pdf_file(content)
-        
-        else:
-            return None
-            
-    except Exception:
-        return None
-
-def parse_text_file(content: bytes) -> Optional[str]:
+    Append a context section built by build_files_context to a prompt
     """
-    Parse text from text files (.txt, .md, etc.)
-    
-    Args:
-        content: Raw file content as bytes
-    
-    Returns:
-        Extracted text content or None if extraction fails
-    """
-    try:
-        # Try UTF-8 first
-        return content.decode('utf-8')
-    except UnicodeDecodeError:
-        try:
-            # Fallback to latin-1 for other encodings
-            return content.decode('latin-1')
-        except Exception:
-            return None
-
-def parse_pdf_file(content: bytes) -> Optional[str]:
-    """
-    Parse text from PDF files using PyMuPDF
-    Based on: https://pymupdf.readthedocs.io/en/latest/the-basics.html
-    
-    Args:
-        content: Raw file content as bytes
+    if not files_context:
+        return prompt
     
-    Returns:
-        Extracted text content or None if extraction fails
-    """
-    try:
-        
-        # Open document from bytes stream
-        doc = pymupdf.open(stream=content, filetype="pdf")
-        
-        # Extract text from each page
-        text_content = []
-        for page in doc:  # iterate the document pages
-            text = page.get_text()  # get plain text (is in UTF-8)
-            if text.strip():  # only add non-empty pages
-                text_content.append(text)
-        
-        # Close the document
-        doc.close()
-        
-        # Join all pages with double newlines
-        extracted_text = '\n\n'.join(text_content)
-        
-        # Clean up extra whitespace
-        extracted_text = '\n'.join(line.strip() for line in extracted_text.split('\n') if line.strip())
-        
-        return extracted_text if extracted_text.strip() else None
-        
-    except Exception as e:
-        return f"Error: {str(e)}"
+    return f"{prompt}\n\nContext:\n{files_context}"
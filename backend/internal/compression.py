@@ -0,0 +1,214 @@
+import asyncio
+import os
+import zlib
+from typing import Callable, Dict, List, Optional, Tuple
+from starlette.datastructures import Headers, MutableHeaders
+from .metrics import http_response_bytes
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Responses smaller than this are sent as they are, compression would not pay for its CPU time
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', '1024'))
+GZIP_LEVEL = int(os.getenv('GZIP_LEVEL', '6'))
+# Low brotli quality and zstd level: on-the-fly compression, the high levels are meant for static assets
+BROTLI_QUALITY = int(os.getenv('BROTLI_QUALITY', '4'))
+ZSTD_LEVEL = int(os.getenv('ZSTD_LEVEL', '3'))
+# Bodies above this are compressed in a worker thread so the event loop keeps serving other requests
+COMPRESSION_THREAD_SIZE = int(os.getenv('COMPRESSION_THREAD_SIZE', str(256 * 1024)))
+
+# Already compressed formats
+SKIP_CONTENT_TYPES = ("application/pdf", "image/", "video/", "audio/", "application/zip", "application/gzip")
+
+class Compressor:
+    '''
+    Incremental compressor. flush() ends a block so everything passed so far can be decoded by the client,
+    which is what streamed responses need after every chunk.
+    '''
+
+    def __init__(self, compress: Callable[[bytes], bytes], flush: Callable[[], bytes], finish: Callable[[], bytes]):
+        self.compress = compress
+        self.flush = flush
+        self.finish = finish
+
+def gzip_compressor() -> Compressor:
+    # wbits 31 writes a gzip header and trailer
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    return Compressor(
+        compressor.compress,
+        lambda: compressor.flush(zlib.Z_SYNC_FLUSH),
+        compressor.flush
+    )
+
+def brotli_compressor() -> Compressor:
+    compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+    return Compressor(compressor.process, compressor.flush, compressor.finish)
+
+def zstd_compressor() -> Compressor:
+    compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    return Compressor(
+        compressor.compress,
+        lambda: compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK),
+        compressor.flush
+    )
+
+# Server preference when the client accepts several encodings equally
+ENCODINGS: Dict[str, Callable[[], Compressor]] = {
+    **({"zstd": zstd_compressor} if zstandard else {}),
+    **({"br": brotli_compressor} if brotli else {}),
+    "gzip": gzip_compressor,
+}
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    '''
+    Pick a content coding from an Accept-Encoding header, highest q-value first, then server preference
+    '''
+    weights: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        weights[name] = quality
+
+    candidates: List[Tuple[float, int, str]] = []
+    for preference, encoding in enumerate(ENCODINGS):
+        quality = weights.get(encoding, weights.get("*", 0.0))
+        if quality > 0:
+            candidates.append((-quality, preference, encoding))
+    return min(candidates)[2] if candidates else None
+
+def no_compression(endpoint: Callable) -> Callable:
+    '''
+    Route decorator that opts an endpoint out of response compression. Place it below the router decorator.
+    '''
+    endpoint.__no_compression__ = True
+    return endpoint
+
+def is_compressible(headers: Headers) -> bool:
+    if "content-encoding" in headers:
+        return False
+    if "no-transform" in headers.get("cache-control", ""):
+        return False
+    content_type = headers.get("content-type", "")
+    return not content_type.startswith(SKIP_CONTENT_TYPES)
+
+class CompressionMiddleware:
+    '''
+    ASGI middleware compressing responses with zstd, brotli or gzip, whichever the client prefers among
+    the installed ones. Complete bodies are only compressed above COMPRESSION_MIN_SIZE. Streamed bodies
+    (chat replies, event streams) are compressed chunk by chunk and flushed after each one, so tokens
+    reach the client as soon as they are produced.
+    '''
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        compressor: Optional[Compressor] = None
+        # Set once it is decided whether this response is compressed
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, compressor, passthrough
+
+            if message["type"] == "http.response.start":
+                start_message = message
+                headers = Headers(raw=message["headers"])
+                endpoint = getattr(scope.get("route"), "endpoint", None)
+                if (
+                    message["status"] < 200 or message["status"] in (204, 304)
+                    or scope["method"] == "HEAD"
+                    or getattr(endpoint, "__no_compression__", False)
+                    or not is_compressible(headers)
+                ):
+                    passthrough = True
+                    await send(message)
+                # Otherwise wait for the first body message to see whether the body is complete
+                return
+
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if compressor is None:
+                if not more_body and len(body) < self.minimum_size:
+                    # Small complete response, not worth compressing
+                    passthrough = True
+                    headers = MutableHeaders(raw=start_message["headers"])
+                    headers.add_vary_header("Accept-Encoding")
+                    await send(start_message)
+                    await send(message)
+                    return
+
+                compressor = ENCODINGS[encoding]()
+                headers = MutableHeaders(raw=start_message["headers"])
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                # The compressed body is a different representation, so strong validators become weak
+                etag = headers.get("etag")
+                if etag and not etag.startswith("W/"):
+                    headers["ETag"] = f"W/{etag}"
+
+                if not more_body:
+                    compressed = await self.compress_all(compressor, body)
+                    headers["Content-Length"] = str(len(compressed))
+                    self.record(encoding, len(body), len(compressed))
+                    await send(start_message)
+                    await send({"type": "http.response.body", "body": compressed})
+                    return
+
+                del headers["Content-Length"]
+                await send(start_message)
+
+            # Streamed body: flush every chunk so the client can decode it right away
+            data = compressor.compress(body)
+            data += compressor.finish() if not more_body else compressor.flush()
+            self.record(encoding, len(body), len(data))
+            await send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
+
+    @staticmethod
+    async def compress_all(compressor: Compressor, body: bytes) -> bytes:
+        def run() -> bytes:
+            return compressor.compress(body) + compressor.finish()
+
+        if len(body) >= COMPRESSION_THREAD_SIZE:
+            # zlib, brotli and zstandard release the GIL while compressing
+            return await asyncio.to_thread(run)
+        return run()
+
+    @staticmethod
+    def record(encoding: str, identity_size: int, compressed_size: int):
+        http_response_bytes.inc(identity_size, encoding=encoding, stage="identity")
+        http_response_bytes.inc(compressed_size, encoding=encoding, stage="compressed")
@@ -1,11 +1,73 @@
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
+from pymongo.client_session import ClientSession
+from pymongo import monitoring
+from contextlib import contextmanager
 import os
-from typing import Optional
+import threading
+from typing import Any, Dict, Iterator, Optional
+from ..metrics import Gauge
+
+def _int_env(name: str) -> Optional[int]:
+    value = os.getenv(name)
+    return int(value) if value else None
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    '''
+    Tracks the connection pool through pymongo's monitoring events, for the readiness probe and /metrics
+    '''
+
+    def __init__(self):
+        self.open = 0
+        self.checked_out = 0
+        self.waiting = 0
+        self.checkout_failures = 0
+        self._lock = threading.Lock()
+
+    def _add(self, field: str, amount: int):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + amount)
+
+    def connection_created(self, event):
+        self._add("open", 1)
+
+    def connection_closed(self, event):
+        self._add("open", -1)
+
+    def connection_check_out_started(self, event):
+        self._add("waiting", 1)
+
+    def connection_checked_out(self, event):
+        self._add("waiting", -1)
+        self._add("checked_out", 1)
+
+    def connection_check_out_failed(self, event):
+        self._add("waiting", -1)
+        self._add("checkout_failures", 1)
+
+    def connection_checked_in(self, event):
+        self._add("checked_out", -1)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
 
 class MongoConnection:
     '''
-    Singleton MongoDB connection class for the iLearner application
+    Singleton MongoDB connection class for the iLearner application.
+    The client is created lazily, once per process, so importing the app does not need a database
+    and forked workers never share a client. The FastAPI lifespan connects and closes it.
     '''
     _instance: Optional['MongoConnection'] = None
     database_name = 'ilearner'
@@ -16,53 +78,169 @@ class MongoConnection:
         return cls._instance
 
     def __init__(self):
-        if not hasattr(self, 'client'):
-            self._connect()
+        if not hasattr(self, '_client'):
+            self._client: Optional[MongoClient] = None
+            self._pid: Optional[int] = None
+            self._lock = threading.Lock()
+            self._supports_transactions: Optional[bool] = None
+            self.pool_stats = PoolStats()
 
-    def _connect(self):
+    def client_options(self) -> Dict[str, Any]:
         '''
-        Establish connection to MongoDB using environment variables
+        MongoClient options from environment variables. Unset options keep the driver defaults.
         '''
-        mongo_uri = os.getenv('MONGO_URI', 'mongodb://mongodb:27017') # Defaults to a local MongoDB instance
-        self.client = MongoClient(mongo_uri, server_api=ServerApi('1'))
-        self.db = self.client[self.database_name]
+        options = {
+            "maxPoolSize": _int_env('MONGO_MAX_POOL_SIZE'),
+            "minPoolSize": _int_env('MONGO_MIN_POOL_SIZE'),
+            "maxIdleTimeMS": _int_env('MONGO_MAX_IDLE_TIME_MS'),
+            "waitQueueTimeoutMS": _int_env('MONGO_WAIT_QUEUE_TIMEOUT_MS'),
+            "connectTimeoutMS": _int_env('MONGO_CONNECT_TIMEOUT_MS'),
+            "serverSelectionTimeoutMS": _int_env('MONGO_SERVER_SELECTION_TIMEOUT_MS'),
+            "socketTimeoutMS": _int_env('MONGO_SOCKET_TIMEOUT_MS'),
+            "compressors": os.getenv('MONGO_COMPRESSORS'),  # e.g. "zstd,snappy,zlib"
+            "readPreference": os.getenv('MONGO_READ_PREFERENCE'),  # e.g. "primaryPreferred"
+            "appname": os.getenv('MONGO_APP_NAME', 'ilearner-backend'),
+        }
+        return {key: value for key, value in options.items() if value is not None}
+
+    def connect(self) -> MongoClient:
+        '''
+        Create this process's client if it does not exist yet
+        '''
+        with self._lock:
+            if self._client is None or self._pid != os.getpid():
+                mongo_uri = os.getenv('MONGO_URI', 'mongodb://mongodb:27017') # Defaults to a local MongoDB instance
+                self.pool_stats = PoolStats()
+                self._client = MongoClient(
+                    mongo_uri,
+                    server_api=ServerApi('1'),
+                    event_listeners=[self.pool_stats],
+                    **self.client_options()
+                )
+                self._pid = os.getpid()
+                self._supports_transactions = None
+            return self._client
+
+    @property
+    def client(self) -> MongoClient:
+        if self._client is None or self._pid != os.getpid():
+            return self.connect()
+        return self._client
+
+    @property
+    def db(self):
+        return self.client[self.database_name]
 
     def get_client(self):
         '''
         Get the MongoDB client instance
         '''
         return self.client
-    
+
     def get_database(self):
         '''
         Get the database instance
         '''
         return self.db
-    
-    def get_collection(self, collection_name: str):
+
+    def get_collection(self, collection_name: str) -> 'LazyCollection':
         '''
-        Get a specific collection from the database
+        Get a specific collection from the database.
+        The collection is resolved on first use, so modules can keep it at module level.
         '''
-        return self.db[collection_name]
-    
+        return LazyCollection(self, collection_name)
+
     def close(self):
         '''
         Close the MongoDB connection
         '''
-        if hasattr(self, 'client'):
-            self.client.close()
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+    def ping(self):
+        '''
+        Round trip to the server, raises if it cannot be reached
+        '''
+        self.client.admin.command('ping')
+
+    def supports_transactions(self) -> bool:
+        '''
+        Whether the server is a replica set or sharded cluster. Standalone servers reject transactions.
+        '''
+        if self._supports_transactions is None:
+            hello = self.client.admin.command('hello')
+            self._supports_transactions = "setName" in hello or hello.get("msg") == "isdbgrid"
+        return self._supports_transactions
+
+    @contextmanager
+    def transaction(self) -> Iterator[Optional[ClientSession]]:
+        '''
+        Run the writes inside the block as one unit: pass the yielded session to every operation.
+        It is committed when the block ends and aborted if it raises. On a standalone server the
+        session is None and the writes run one after another.
+        '''
+        if not self.supports_transactions():
+            yield None
+            return
+
+        with self.client.start_session() as session:
+            with session.start_transaction():
+                yield session
 
     def get_all_collections(self):
         '''
         Get list of all collection names in the database
         '''
         return self.db.list_collection_names()
-    
+
     def get_all_databases(self):
         '''
         Get list of all database names
         '''
         return self.client.list_database_names()
 
+class LazyCollection:
+    '''
+    Stand-in for a pymongo Collection that resolves it from the current client on use
+    '''
+
+    def __init__(self, connection: MongoConnection, name: str):
+        self._connection = connection
+        self._name = name
+        self._client: Optional[MongoClient] = None
+        self._collection = None
+
+    def _resolve(self):
+        client = self._connection.client
+        if client is not self._client:
+            self._collection = client[self._connection.database_name][self._name]
+            self._client = client
+        return self._collection
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    def __getattr__(self, attribute: str):
+        return getattr(self._resolve(), attribute)
+
 # Create a single instance to be used throughout the application
-mongo_connection = MongoConnection()
\ No newline at end of file
+mongo_connection = MongoConnection()
+
+mongo_pool_open = Gauge(
+    "mongo_pool_connections",
+    "Open connections in the MongoDB connection pool",
+    function=lambda: mongo_connection.pool_stats.open
+)
+mongo_pool_checked_out = Gauge(
+    "mongo_pool_checked_out_connections",
+    "MongoDB connections currently in use",
+    function=lambda: mongo_connection.pool_stats.checked_out
+)
+mongo_pool_waiting = Gauge(
+    "mongo_pool_waiting_operations",
+    "Operations waiting for a MongoDB connection",
+    function=lambda: mongo_connection.pool_stats.waiting
+)
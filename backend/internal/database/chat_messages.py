@@ -1,44 +1,132 @@
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 from models.database import ChatMessage
 from .MongoConnection import mongo_connection
+from ..metrics import mongo_timed, Gauge
+from .write_behind import WriteBehindBuffer
+from .ids import to_object_id, id_match
+from pymongo import ReturnDocument, UpdateOne
+from pydantic import TypeAdapter
 from datetime import datetime
+import asyncio
 import uuid
 
 collection = mongo_connection.get_collection("ChatMessages")
 
-async def create_chat_message(
+chat_message_list = TypeAdapter(List[ChatMessage])
+
+# Chat turns queue their writes here so they stay off the streaming critical path
+chat_write_buffer = WriteBehindBuffer(collection)
+
+# Appends of streaming messages that are queued but not written yet: message ID -> (sequence number, offset, text)
+# Reads apply them so a reply being generated is not returned with stale content
+_pending_appends: Dict[str, List[Tuple[int, int, str]]] = {}
+
+chat_write_queue_depth = Gauge(
+    "chat_write_behind_queue_depth",
+    "Chat message writes queued in the write-behind buffer",
+    function=lambda: chat_write_buffer.depth
+)
+
+async def enqueue_chat_message(
     learning_space_id: str,
     role: str,
     content: str,
-    tool_history_id: Optional[str] = None
+    tool_history_id: Optional[str] = None,
+    message_id: Optional[str] = None,
+    status: Optional[str] = None
 ) -> ChatMessage:
     """
-    Save a new chat message to the database
+    Queue a new chat message through the write-behind buffer.
+    The message is returned immediately, is visible to get_latest_chat_messages
+    and is persisted by the buffer's background flush.
+    Messages created with status 'streaming' are filled in by enqueue_chat_message_append.
     """
+    now = datetime.now()
     message_data = {
-        "_id": str(uuid.uuid4()),
-        "learningSpaceId": learning_space_id,
-        "toolHistoryId": tool_history_id,
+        "_id": message_id or str(uuid.uuid4()),
+        "learningSpaceId": to_object_id(learning_space_id),
+        "toolHistoryId": to_object_id(tool_history_id),
         "role": role,
         "content": content,
-        "timestamp": datetime.now(),
+        "timestamp": now,
         "messageId": str(uuid.uuid4())
     }
-    
-    result = collection.insert_one(message_data)
-    if result.inserted_id:
-        return ChatMessage(
-            id=message_data["_id"],
-            learningSpaceId=message_data["learningSpaceId"],
-            toolHistoryId=message_data["toolHistoryId"],
-            role=message_data["role"],
-            content=message_data["content"],
-            timestamp=message_data["timestamp"],
-            messageId=message_data["messageId"]
-        )
-    else:
-        raise Exception("Failed to create chat message")
+    if status is not None:
+        message_data["status"] = status
+        message_data["contentLength"] = len(content)
+        message_data["updatedAt"] = now
+
+    chat_write_buffer.insert(message_data)
+
+    return ChatMessage(
+        id=message_data["_id"],
+        learningSpaceId=message_data["learningSpaceId"],
+        toolHistoryId=message_data["toolHistoryId"],
+        role=message_data["role"],
+        content=message_data["content"],
+        timestamp=message_data["timestamp"],
+        messageId=message_data["messageId"],
+        status=status,
+        updatedAt=message_data.get("updatedAt")
+    )
+
+def enqueue_chat_message_append(message_id: str, offset: int, text: str) -> None:
+    """
+    Queue an append of a checkpoint batch to a streaming message.
+    The update only applies while the stored content is exactly `offset` characters long,
+    so a batch that is retried after a failed flush is never appended twice.
+    """
+    sequence = chat_write_buffer.enqueue(UpdateOne(
+        {"_id": message_id, "contentLength": offset},
+        [{"$set": {
+            "content": {"$concat": ["$content", {"$literal": text}]},
+            "contentLength": offset + len(text),
+            "updatedAt": datetime.now()
+        }}]
+    ))
+    _prune_pending_appends()
+    _pending_appends.setdefault(message_id, []).append((sequence, offset, text))
+
+def _prune_pending_appends() -> None:
+    """
+    Forget appends the buffer has written
+    """
+    written = chat_write_buffer.written
+    for message_id in list(_pending_appends):
+        appends = [append for append in _pending_appends[message_id] if append[0] > written]
+        if appends:
+            _pending_appends[message_id] = appends
+        else:
+            del _pending_appends[message_id]
+
+def _with_pending_appends(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Copy of a message with its queued appends applied the way the stored update applies them
+    """
+    appends = _pending_appends.get(doc["_id"])
+    if not appends:
+        return doc
+    doc = dict(doc)
+    for _, offset, text in appends:
+        if doc.get("contentLength") == offset:
+            doc["content"] += text
+            doc["contentLength"] = offset + len(text)
+    return doc
+
+def enqueue_chat_message_status(message_id: str, status: str, error: Optional[str] = None) -> None:
+    """
+    Queue a status change of a streaming message, e.g. marking it complete
+    """
+    update_data = {"status": status, "updatedAt": datetime.now()}
+    if error is not None:
+        update_data["error"] = error
 
+    chat_write_buffer.enqueue(UpdateOne(
+        {"_id": message_id},
+        {"$set": update_data}
+    ))
+
+@mongo_timed("ChatMessages")
 async def get_chat_messages_by_learning_space(
     learning_space_id: str,
     tool_history_id: Optional[str] = None,
@@ -48,32 +136,29 @@ async def get_chat_messages_by_learning_space(
     """
     Get chat messages for a learning space, optionally filtered by tool history
     """
-    query = {"learningSpaceId": learning_space_id}
+    await chat_write_buffer.flush()
+
+    query = {"learningSpaceId": id_match(learning_space_id)}
     if tool_history_id is not None:
-        query["toolHistoryId"] = tool_history_id
+        query["toolHistoryId"] = id_match(tool_history_id)
     
     cursor = collection.find(query).sort("timestamp", 1).skip(skip or 0)
     if limit:
         cursor = cursor.limit(limit)
     
-    messages = []
-    for doc in cursor:
-        messages.append(ChatMessage(
-            id=doc["_id"],
-            learningSpaceId=doc["learningSpaceId"],
-            toolHistoryId=doc.get("toolHistoryId"),
-            role=doc["role"],
-            content=doc["content"],
-            timestamp=doc["timestamp"],
-            messageId=doc["messageId"]
-        ))
-    
-    return messages
+    # Validate the whole page in one call instead of building each model from Python
+    docs = list(cursor)
+    for doc in docs:
+        doc["id"] = doc.pop("_id")
+    return chat_message_list.validate_python(docs)
 
+@mongo_timed("ChatMessages")
 async def get_chat_message_by_id(message_id: str) -> Optional[ChatMessage]:
     """
     Get a chat message by its ID
     """
+    await chat_write_buffer.flush()
+
     doc = collection.find_one({"_id": message_id})
     if doc:
         return ChatMessage(
@@ -83,32 +168,45 @@ async def get_chat_message_by_id(message_id: str) -> Optional[ChatMessage]:
             role=doc["role"],
             content=doc["content"],
             timestamp=doc["timestamp"],
-            messageId=doc["messageId"]
+            messageId=doc["messageId"],
+            status=doc.get("status"),
+            error=doc.get("error"),
+            updatedAt=doc.get("updatedAt")
         )
     return None
 
+@mongo_timed("ChatMessages")
 async def update_chat_message(message_id: str, update_data: Dict[str, Any]) -> Optional[ChatMessage]:
     """
     Update a chat message
     """
+    await chat_write_buffer.flush()
+
     update_data["updatedAt"] = datetime.now()
     
-    result = collection.update_one(
+    # Update and get the updated message in the same round trip
+    doc = collection.find_one_and_update(
         {"_id": message_id},
-        {"$set": update_data}
+        {"$set": update_data},
+        return_document=ReturnDocument.AFTER
     )
     
-    if result.modified_count > 0:
-        return await get_chat_message_by_id(message_id)
+    if doc:
+        doc["id"] = doc.pop("_id")
+        return ChatMessage(**doc)
     return None
 
+@mongo_timed("ChatMessages")
 async def delete_chat_message(message_id: str) -> bool:
     """
     Delete a chat message
     """
+    await chat_write_buffer.flush()
+
     result = collection.delete_one({"_id": message_id})
     return result.deleted_count > 0
 
+@mongo_timed("ChatMessages")
 async def delete_chat_messages_by_learning_space(
     learning_space_id: str,
     tool_history_id: Optional[str] = None
@@ -117,13 +215,16 @@ async def delete_chat_messages_by_learning_space(
     Delete all chat messages for a learning space, optionally filtered by tool history
     Returns the number of deleted messages
     """
-    query = {"learningSpaceId": learning_space_id}
+    await chat_write_buffer.flush()
+
+    query = {"learningSpaceId": id_match(learning_space_id)}
     if tool_history_id is not None:
-        query["toolHistoryId"] = tool_history_id
+        query["toolHistoryId"] = id_match(tool_history_id)
     
     result = collection.delete_many(query)
     return result.deleted_count
 
+@mongo_timed("ChatMessages")
 async def get_latest_chat_messages(
     learning_space_id: str,
     tool_history_id: Optional[str] = None,
@@ -131,15 +232,33 @@ async def get_latest_chat_messages(
 ) -> List[ChatMessage]:
     """
     Get the latest chat messages for a learning space
+    Messages still queued in the write-behind buffer are merged in so a turn always sees the previous one
     """
-    query = {"learningSpaceId": learning_space_id}
+    query = {"learningSpaceId": id_match(learning_space_id)}
     if tool_history_id is not None:
-        query["toolHistoryId"] = tool_history_id
+        query["toolHistoryId"] = id_match(tool_history_id)
     
-    cursor = collection.find(query).sort("timestamp", -1).limit(limit)
+    # Run the cursor in a worker thread so the read can overlap with other work on the event loop
+    docs = await asyncio.to_thread(
+        lambda: list(collection.find(query).sort("timestamp", -1).limit(limit))
+    )
+
+    # Queued documents are always in the canonical form
+    pending_query = {"learningSpaceId": to_object_id(learning_space_id)}
+    if tool_history_id is not None:
+        pending_query["toolHistoryId"] = to_object_id(tool_history_id)
+    pending_docs = chat_write_buffer.pending_documents(pending_query)
+    if pending_docs:
+        seen_ids = {doc["_id"] for doc in docs}
+        docs.extend(doc for doc in pending_docs if doc["_id"] not in seen_ids)
+        docs.sort(key=lambda doc: doc["timestamp"], reverse=True)
+        docs = docs[:limit]
+
+    _prune_pending_appends()
+    docs = [_with_pending_appends(doc) for doc in docs]
     
     messages = []
-    for doc in cursor:
+    for doc in docs:
         messages.append(ChatMessage(
             id=doc["_id"],
             learningSpaceId=doc["learningSpaceId"],
@@ -147,7 +266,10 @@ async def get_latest_chat_messages(
             role=doc["role"],
             content=doc["content"],
             timestamp=doc["timestamp"],
-            messageId=doc["messageId"]
+            messageId=doc["messageId"],
+            status=doc.get("status"),
+            error=doc.get("error"),
+            updatedAt=doc.get("updatedAt")
         ))
     
     # Return in chronological order (oldest first)
@@ -0,0 +1,110 @@
+from bson import ObjectId
+from typing import Optional
+from models.dashboard import LearningSpaceDashboard
+from ..metrics import mongo_timed
+from .learning_spaces import learning_spaces_collection
+from .chat_messages import chat_write_buffer
+from .ids import ID_DUAL_READ
+
+@mongo_timed("LearningSpaces")
+async def get_learning_space_dashboard(
+    learning_space_id: str,
+    tool_history_limit: int = 20,
+    chat_limit: int = 50
+) -> Optional[LearningSpaceDashboard]:
+    '''
+    Everything the learning space page needs in one aggregation: the space, its files without content,
+    the most recent tool history entries with counts per type, and the latest chat messages.
+    '''
+    try:
+        space_id = ObjectId(learning_space_id)
+    except Exception:
+        return None
+
+    pipeline = [
+        {"$match": {"_id": space_id}},
+        # Joining on an array matches either element, so documents not migrated yet are found too
+        {"$addFields": {"spaceIds": ["$_id", {"$toString": "$_id"}] if ID_DUAL_READ else ["$_id"]}},
+        {"$lookup": {
+            "from": "Files",
+            "localField": "spaceIds",
+            "foreignField": "learningSpaceId",
+            "pipeline": [
+                {"$sort": {"uploadedAt": -1}},
+                {"$project": {"name": 1, "type": 1, "size": 1, "mimeType": 1, "uploadedAt": 1, "textPreview": 1}}
+            ],
+            "as": "files"
+        }},
+        {"$lookup": {
+            "from": "ToolHistory",
+            "localField": "spaceIds",
+            "foreignField": "learningSpaceId",
+            "pipeline": [
+                {"$facet": {
+                    "recent": [
+                        {"$sort": {"createdAt": -1}},
+                        {"$limit": tool_history_limit},
+                        {"$project": {
+                            "type": 1, "status": 1, "createdAt": 1, "updatedAt": 1,
+                            "topic": "$toolData.topic",
+                            "score": "$toolData.feedback.score"
+                        }}
+                    ],
+                    "counts": [
+                        {"$group": {"_id": "$type", "count": {"$sum": 1}}}
+                    ]
+                }}
+            ],
+            "as": "toolHistory"
+        }},
+        {"$lookup": {
+            "from": "ChatMessages",
+            "localField": "spaceIds",
+            "foreignField": "learningSpaceId",
+            "pipeline": [
+                {"$sort": {"timestamp": -1}},
+                {"$limit": chat_limit}
+            ],
+            "as": "chatMessages"
+        }}
+    ]
+
+    docs = list(learning_spaces_collection.aggregate(pipeline))
+    if not docs:
+        return None
+    doc = docs[0]
+
+    # The $facet stage always returns exactly one document
+    tool_history = doc["toolHistory"][0] if doc["toolHistory"] else {"recent": [], "counts": []}
+
+    # Chat turns still queued in the write-behind buffer are merged in, like get_latest_chat_messages does
+    messages = doc["chatMessages"]
+    pending_docs = chat_write_buffer.pending_documents({"learningSpaceId": space_id})
+    if pending_docs:
+        seen_ids = {message["_id"] for message in messages}
+        # Copies, the buffer still needs its documents
+        messages.extend(dict(message) for message in pending_docs if message["_id"] not in seen_ids)
+        messages.sort(key=lambda message: message["timestamp"], reverse=True)
+        messages = messages[:chat_limit]
+
+    for file in doc["files"]:
+        file["id"] = str(file.pop("_id"))
+    for entry in tool_history["recent"]:
+        entry["id"] = str(entry.pop("_id"))
+    for message in messages:
+        message["id"] = message.pop("_id")
+
+    return LearningSpaceDashboard.model_validate({
+        "learningSpace": {
+            "id": learning_space_id,
+            "name": doc["name"],
+            "createdAt": doc["createdAt"],
+            "updatedAt": doc["updatedAt"],
+            "fileCount": doc["fileCount"]
+        },
+        "files": doc["files"],
+        "toolHistory": tool_history["recent"],
+        "toolHistoryCounts": {group["_id"]: group["count"] for group in tool_history["counts"]},
+        # Oldest first, like the chat history endpoint
+        "chatMessages": messages[::-1]
+    })
@@ -0,0 +1,159 @@
+from bson import ObjectId
+from pymongo.client_session import ClientSession
+from typing import Any, Dict, List, Optional
+from models.file_pages import FilePage, FilePageRange, FileTextRange
+from .MongoConnection import mongo_connection
+from ..metrics import mongo_timed
+from .ids import to_object_id, id_match
+from .file_text import TEXT_COMPRESSION, compress_text, decompress_text, decode_text_fields
+from ..text_normalization import SECTION_SEPARATOR
+
+# Text of each page (or section) of a file, next to the whole text stored on the Files document
+pages_collection = mongo_connection.get_collection('FilePages')
+files_collection = mongo_connection.get_collection('Files')
+
+def ensure_file_page_indexes():
+    '''
+    Indexes for page lookups, offset lookups and deleting a learning space's pages
+    '''
+    try:
+        pages_collection.create_index([("fileId", 1), ("page", 1)], unique=True)
+        pages_collection.create_index([("fileId", 1), ("start", 1)])
+        pages_collection.create_index([("learningSpaceId", 1)])
+    except Exception as e:
+        print(f"Error creating file page indexes: {e}")
+
+def encode_pages(sections: List[str]) -> List[Dict[str, Any]]:
+    '''
+    One compressed page per non-empty section, without the file it belongs to. start and end are
+    character offsets in the file's extractedText, which joins the non-empty sections with SECTION_SEPARATOR.
+    CPU-bound on large files, callers run it off the event loop.
+    '''
+    pages = []
+    start = 0
+    for number, section in enumerate(sections, 1):
+        if not section.strip():
+            continue
+        pages.append({
+            "page": number,
+            "start": start,
+            "end": start + len(section),
+            "textCompressed": compress_text(section),
+            "textEncoding": TEXT_COMPRESSION
+        })
+        start += len(section) + len(SECTION_SEPARATOR)
+    return pages
+
+def page_from_doc(doc: Dict[str, Any]) -> FilePage:
+    text = decompress_text(doc["textCompressed"], doc["textEncoding"])
+    return FilePage(page=doc["page"], start=doc["start"], length=len(text), text=text)
+
+@mongo_timed("FilePages")
+async def create_file_pages(file_id: ObjectId, learning_space_id: str, pages: List[Dict[str, Any]],
+                            session: Optional[ClientSession] = None) -> int:
+    '''
+    Store the pages of a new file, encoded by encode_pages, in the same transaction as the file when a
+    session is given
+    '''
+    learning_space_ref = to_object_id(learning_space_id)
+    docs = [{"fileId": file_id, "learningSpaceId": learning_space_ref, **page} for page in pages]
+    if docs:
+        pages_collection.insert_many(docs, session=session)
+    return len(docs)
+
+def legacy_page(file_id: str) -> Optional[FilePage]:
+    '''
+    Files stored before pages were kept have no FilePages, their whole text is served as page 1
+    '''
+    doc = files_collection.find_one(
+        {"_id": ObjectId(file_id)},
+        {"extractedText": 1, "extractedTextCompressed": 1, "textEncoding": 1}
+    )
+    text = decode_text_fields(doc).get("extractedText") if doc else None
+    return FilePage(page=1, start=0, length=len(text), text=text) if text else None
+
+@mongo_timed("FilePages")
+async def get_file_pages(file_id: str, first: int, last: int) -> Optional[FilePageRange]:
+    '''
+    Text of pages first to last, None if the file does not exist
+    '''
+    if not ObjectId.is_valid(file_id):
+        return None
+    file_doc = files_collection.find_one({"_id": ObjectId(file_id)}, {"pageCount": 1})
+    if not file_doc:
+        return None
+
+    if file_doc.get("pageCount") is None:
+        page = legacy_page(file_id)
+        pages = [page] if page and first <= 1 <= last else []
+        return FilePageRange(fileId=file_id, pageCount=1 if page else 0, first=first, last=last, pages=pages)
+
+    docs = pages_collection.find(
+        {"fileId": ObjectId(file_id), "page": {"$gte": first, "$lte": last}},
+        {"page": 1, "start": 1, "textCompressed": 1, "textEncoding": 1}
+    ).sort("page", 1)
+    return FilePageRange(
+        fileId=file_id,
+        pageCount=file_doc["pageCount"],
+        first=first,
+        last=last,
+        pages=[page_from_doc(doc) for doc in docs]
+    )
+
+@mongo_timed("FilePages")
+async def get_file_text_range(file_id: str, offset: int, length: int) -> Optional[FileTextRange]:
+    '''
+    length characters of the file's extractedText from offset, read from the pages that overlap them.
+    None if the file does not exist.
+    '''
+    if not ObjectId.is_valid(file_id):
+        return None
+    file_doc = files_collection.find_one({"_id": ObjectId(file_id)}, {"pageCount": 1, "textLength": 1})
+    if not file_doc:
+        return None
+
+    if file_doc.get("pageCount") is None:
+        page = legacy_page(file_id)
+        pages = [page] if page else []
+        text_length = page.length if page else 0
+    else:
+        docs = pages_collection.find(
+            {
+                "fileId": ObjectId(file_id),
+                "start": {"$lt": offset + length},
+                # The page before is read too when the range starts in the separator after it
+                "end": {"$gt": offset - len(SECTION_SEPARATOR)}
+            },
+            {"page": 1, "start": 1, "textCompressed": 1, "textEncoding": 1}
+        ).sort("start", 1)
+        pages = [page_from_doc(doc) for doc in docs]
+        text_length = file_doc.get("textLength") or 0
+
+    text = ""
+    if pages:
+        # Stored pages are consecutive in extractedText, separated by SECTION_SEPARATOR
+        region = SECTION_SEPARATOR.join(page.text for page in pages)
+        if pages[-1].start + pages[-1].length < text_length:
+            # The range can end inside the separator after the last page
+            region += SECTION_SEPARATOR
+        start = offset - pages[0].start
+        text = region[start:start + length]
+
+    return FileTextRange(
+        fileId=file_id,
+        offset=offset,
+        length=len(text),
+        textLength=text_length,
+        pages=[page.page for page in pages if page.start < offset + length and page.start + page.length > offset],
+        text=text
+    )
+
+@mongo_timed("FilePages")
+async def delete_file_pages(file_id: str, session: Optional[ClientSession] = None) -> int:
+    result = pages_collection.delete_many({"fileId": ObjectId(file_id)}, session=session)
+    return result.deleted_count
+
+@mongo_timed("FilePages")
+async def delete_pages_by_learning_space(learning_space_id: str) -> int:
+    result = pages_collection.delete_many({"learningSpaceId": id_match(learning_space_id)})
+    return result.deleted_count
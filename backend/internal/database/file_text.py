@@ -0,0 +1,97 @@
+import os
+import re
+import zlib
+from collections import Counter
+from typing import Any, Dict, Optional
+from bson import Binary
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Storage format of a file's extracted text, kept on the document as textVersion.
+# Version 1 (no textVersion field): the text as a string in extractedText.
+# Version 2: the text compressed in extractedTextCompressed, with textEncoding, textPreview and searchTerms.
+TEXT_VERSION = 2
+
+# 'zstd' or 'zlib'. zstd is used when the zstandard package is installed.
+TEXT_COMPRESSION = os.getenv('TEXT_COMPRESSION', 'zstd' if zstandard else 'zlib')
+TEXT_ZSTD_LEVEL = int(os.getenv('TEXT_ZSTD_LEVEL', '9'))
+TEXT_ZLIB_LEVEL = int(os.getenv('TEXT_ZLIB_LEVEL', '6'))
+# Characters of extracted text kept uncompressed for file lists and dashboards
+TEXT_PREVIEW_LENGTH = int(os.getenv('TEXT_PREVIEW_LENGTH', '300'))
+
+# Copies of a word kept in searchTerms. MongoDB scores a word found n times as 1 + 1/2 + ... + 1/2^(n-1),
+# so past 4 occurrences the text score barely moves, and the terms rank like the full text would
+SEARCH_TERM_MAX_REPEATS = 4
+
+# Fields holding the full text in either version, left out of projections that do not need it
+TEXT_FIELDS = ("extractedText", "extractedTextCompressed", "searchTerms")
+
+def compress_text(text: str) -> Binary:
+    data = text.encode("utf-8")
+    if TEXT_COMPRESSION == "zstd":
+        return Binary(zstandard.ZstdCompressor(level=TEXT_ZSTD_LEVEL).compress(data))
+    return Binary(zlib.compress(data, TEXT_ZLIB_LEVEL))
+
+def decompress_text(data: bytes, encoding: str) -> str:
+    if encoding == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Extracted text is stored with zstd but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().decompress(data).decode("utf-8")
+    return zlib.decompress(data).decode("utf-8")
+
+def text_preview(text: Optional[str]) -> Optional[str]:
+    '''
+    The start of the text, cut at a word boundary
+    '''
+    if not text:
+        return None
+    text = " ".join(text[:TEXT_PREVIEW_LENGTH * 2].split())
+    if len(text) <= TEXT_PREVIEW_LENGTH:
+        return text
+    cut = text.rfind(" ", 0, TEXT_PREVIEW_LENGTH)
+    return text[:cut if cut > 0 else TEXT_PREVIEW_LENGTH] + "…"
+
+def search_terms(text: str) -> str:
+    '''
+    The words of the text in order of first use, each repeated as often as it occurs up to
+    SEARCH_TERM_MAX_REPEATS. Compressed text cannot be text indexed, the search index is built over this
+    instead. Keeping the repeats keeps term frequency, so files rank as they did on their full text and on
+    the same scale as files stored before compression. Stored uncompressed since it is indexed, it is bounded
+    by the vocabulary and far shorter than the text on anything longer than a few pages.
+    '''
+    counts = Counter(re.findall(r"\w+", text.lower()))
+    return " ".join(" ".join([word] * min(count, SEARCH_TERM_MAX_REPEATS)) for word, count in counts.items())
+
+def encode_text_fields(text: Optional[str]) -> Dict[str, Any]:
+    '''
+    Fields storing extracted text on a Files document
+    '''
+    if not text:
+        return {"textVersion": TEXT_VERSION, "extractedTextCompressed": None, "textEncoding": None,
+                "textPreview": None, "searchTerms": None}
+    return {
+        "textVersion": TEXT_VERSION,
+        "extractedTextCompressed": compress_text(text),
+        "textEncoding": TEXT_COMPRESSION,
+        "textPreview": text_preview(text),
+        "searchTerms": search_terms(text)
+    }
+
+def decode_text_fields(doc: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Replace the stored text fields of a Files document read from Mongo with extractedText and textPreview,
+    whichever version the document was written with. extractedText is only set if the text was read.
+    '''
+    compressed = doc.pop("extractedTextCompressed", None)
+    encoding = doc.pop("textEncoding", None)
+    doc.pop("searchTerms", None)
+    doc.pop("textVersion", None)
+    if compressed is not None:
+        doc["extractedText"] = decompress_text(compressed, encoding)
+    if "textPreview" not in doc and doc.get("extractedText"):
+        # Version 1 documents have no stored preview
+        doc["textPreview"] = text_preview(doc["extractedText"])
+    return doc
@@ -1,14 +1,22 @@
+import asyncio
 from bson import ObjectId, Binary
-from typing import List, Optional
+from pydantic import TypeAdapter
+from typing import Any, Dict, List, Optional, Tuple
 from datetime import datetime
 from models.database import File
 from .MongoConnection import mongo_connection
+from ..metrics import mongo_timed
 from .learning_spaces import update_file_count
-from ..common import parse_file
+from .ids import to_object_id, id_match
+from ..parsers import parse_file
+from .file_text import TEXT_FIELDS, encode_text_fields, decode_text_fields
+from .file_pages import encode_pages, create_file_pages, delete_file_pages, delete_pages_by_learning_space
 
 # Get the files collection
 files_collection = mongo_connection.get_collection('Files')
 
+file_list = TypeAdapter(List[File])
+
 def object_id_to_str(doc):
     '''
     Convert ObjectId to string and map _id to id for Pydantic model
@@ -18,46 +26,83 @@ def object_id_to_str(doc):
         del doc["_id"]
     return doc
 
-async def create_file(learning_space_id: str, name: str, file_type: str, size: int, mime_type: str, content: bytes) -> File:
+def file_projection(include_content: bool, include_text: bool) -> dict:
+    projection = {} if include_content else {"content": 0}
+    if not include_text:
+        projection.update({field: 0 for field in TEXT_FIELDS})
+    return projection
+
+def encode_file_text(text: Optional[str], sections: List[str]) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    '''
+    Compressed text fields of the Files document and the compressed pages, in one call for a worker thread
+    '''
+    return encode_text_fields(text), encode_pages(sections)
+
+async def create_file(learning_space_id: str, name: str, size: int, mime_type: str, content: bytes) -> File:
     '''
-    Create a new file record with content storage and text extraction
+    Create a new file record with content storage and text extraction.
+    The file type is detected from the content, name and MIME type by the parser registry.
+    The extracted text is stored compressed, with an uncompressed preview, and page by page in FilePages.
     '''
     now = datetime.now()
     
     # Extract text from the file content
-    extracted_text = parse_file(content, file_type, mime_type)
+    parsed = await parse_file(content, name, mime_type)
+    extracted_text = parsed.text if parsed else None
+    sections = parsed.sections if parsed else []
+    # Compressing megabytes of text and counting its words would stall every stream of this worker
+    text_fields, pages = await asyncio.to_thread(encode_file_text, extracted_text, sections)
     
     file_doc = {
-        "learningSpaceId": learning_space_id,
+        "learningSpaceId": to_object_id(learning_space_id),
         "name": name,
-        "type": file_type,
+        "type": parsed.file_type if parsed else "binary",
         "size": size,
         "mimeType": mime_type,
         "uploadedAt": now,
         "content": Binary(content),  # Store content as BSON Binary
-        "extractedText": extracted_text  # Store extracted text
+        **text_fields,  # Store extracted text compressed
+        "tokenCount": parsed.tokens if parsed else 0,
+        "tokensSaved": parsed.tokens_saved if parsed else 0,
+        "pageCount": len(sections),
+        "textLength": len(extracted_text or "")
     }
     
-    result = files_collection.insert_one(file_doc)
-    file_doc["id"] = str(result.inserted_id)
+    file_id = await insert_file(file_doc, learning_space_id, pages)
+
+    file_doc.pop("_id", None)
+    file_doc["id"] = str(file_id)
     
     # Remove binary content for the response (we'll fetch it separately when needed)
     file_doc.pop("content", None)
+    # The text is already at hand, no need to decompress what was just compressed
+    file_doc.pop("extractedTextCompressed", None)
+    file_doc["extractedText"] = extracted_text
     
-    # Update file count in learning space
-    await update_file_count(learning_space_id, 1)
-    
-    return File(**file_doc)
+    return File(**decode_text_fields(file_doc))
 
-async def get_file(file_id: str, include_content: bool = False) -> Optional[File]:
+@mongo_timed("Files")
+async def insert_file(file_doc: dict, learning_space_id: str, pages: List[Dict[str, Any]]) -> ObjectId:
     '''
-    Get a file by ID, optionally including content
+    Write a new file, its pages and the learning space's file count as one unit.
+    Timed on its own so parsing in create_file is not counted as Mongo latency.
+    '''
+    with mongo_connection.transaction() as session:
+        result = files_collection.insert_one(file_doc, session=session)
+        await create_file_pages(result.inserted_id, learning_space_id, pages, session=session)
+        await update_file_count(learning_space_id, 1, session=session)
+    return result.inserted_id
+
+@mongo_timed("Files")
+async def get_file(file_id: str, include_content: bool = False, include_text: bool = True) -> Optional[File]:
+    '''
+    Get a file by ID, optionally including content.
+    include_text=False also leaves out the extracted text, for callers that only need metadata.
     '''
     try:
-        projection = {"content": 0} if not include_content else {}
-        doc = files_collection.find_one({"_id": ObjectId(file_id)}, projection)
+        doc = files_collection.find_one({"_id": ObjectId(file_id)}, file_projection(include_content, include_text))
         if doc:
-            doc = object_id_to_str(doc)
+            doc = object_id_to_str(decode_text_fields(doc))
             # Convert Binary content back to bytes if included
             if include_content and "content" in doc:
                 doc["content"] = bytes(doc["content"])
@@ -66,6 +111,7 @@ async def get_file(file_id: str, include_content: bool = False) -> Optional[File
     except Exception:
         return None
 
+@mongo_timed("Files")
 async def get_file_content(file_id: str) -> Optional[bytes]:
     '''
     Get only the file content by ID
@@ -78,52 +124,51 @@ async def get_file_content(file_id: str) -> Optional[bytes]:
     except Exception:
         return None
 
-async def get_files_by_learning_space(learning_space_id: str) -> List[File]:
+@mongo_timed("Files")
+async def get_files_by_learning_space(learning_space_id: str, include_text: bool = True) -> List[File]:
     '''
-    Get all files for a specific learning space (without content)
+    Get all files for a specific learning space (without content).
+    include_text=False leaves out the extracted text, textPreview is still returned.
     '''
     docs = files_collection.find(
-        {"learningSpaceId": learning_space_id}, 
-        {"content": 0}  # Exclude content for performance
+        {"learningSpaceId": id_match(learning_space_id)}, 
+        file_projection(False, include_text)  # Exclude content for performance
     ).sort("uploadedAt", -1)
-    files = []
-    
-    for doc in docs:
-        doc = object_id_to_str(doc)
-        files.append(File(**doc))
-    
-    return files
 
+    # Validate the whole list in one call instead of building each model from Python
+    return file_list.validate_python([object_id_to_str(decode_text_fields(doc)) for doc in docs])
+
+@mongo_timed("Files")
 async def delete_file(file_id: str) -> bool:
     '''
     Delete a file and its content
     '''
     try:
-        # First get the file to know which learning space to update
-        file_doc = files_collection.find_one({"_id": ObjectId(file_id)}, {"learningSpaceId": 1})
-        if not file_doc:
-            return False
-        
-        learning_space_id = file_doc["learningSpaceId"]
-        
-        # Delete the file record and content
-        result = files_collection.delete_one({"_id": ObjectId(file_id)})
-        
-        if result.deleted_count == 1:
+        with mongo_connection.transaction() as session:
+            # Delete the file record and content, the deleted document tells which learning space to update
+            file_doc = files_collection.find_one_and_delete(
+                {"_id": ObjectId(file_id)},
+                projection={"learningSpaceId": 1},
+                session=session
+            )
+            if not file_doc:
+                return False
+
+            await delete_file_pages(file_id, session=session)
             # Update file count in learning space
-            await update_file_count(learning_space_id, -1)
-            return True
-        
-        return False
+            await update_file_count(str(file_doc["learningSpaceId"]), -1, session=session)
+        return True
     except Exception:
         return False
 
+@mongo_timed("Files")
 async def delete_files_by_learning_space(learning_space_id: str) -> int:
     '''
     Delete all files for a learning space (used when deleting a learning space)
     '''
     try:
-        result = files_collection.delete_many({"learningSpaceId": learning_space_id})
+        result = files_collection.delete_many({"learningSpaceId": id_match(learning_space_id)})
+        await delete_pages_by_learning_space(learning_space_id)
         return result.deleted_count
     except Exception:
         return 0
@@ -0,0 +1,35 @@
+import os
+from bson import ObjectId
+from typing import Any, List
+
+# References to other documents (learningSpaceId, toolHistoryId) are stored as ObjectIds.
+# Documents written before that held strings, so until `python -m migrations.normalize_ids` has
+# rewritten and verified them, reads match both forms. Set ID_DUAL_READ=false afterwards.
+ID_DUAL_READ = os.getenv('ID_DUAL_READ', 'true').lower() not in ('false', '0', 'no')
+
+def to_object_id(value: Any) -> Any:
+    '''
+    Canonical stored form of a reference. Values that are not valid ObjectIds are kept as they are.
+    '''
+    if isinstance(value, str) and ObjectId.is_valid(value):
+        return ObjectId(value)
+    return value
+
+def id_match(value: Any) -> Any:
+    '''
+    Query value matching a reference, in its legacy string form too while dual reads are on
+    '''
+    canonical = to_object_id(value)
+    if ID_DUAL_READ and isinstance(canonical, ObjectId):
+        return {"$in": [canonical, str(canonical)]}
+    return canonical
+
+def id_values(value: Any) -> List[Any]:
+    '''
+    Every form a reference can be stored in, for queries that need an equality match on it
+    such as the prefix of a compound text index, which rejects $in
+    '''
+    canonical = to_object_id(value)
+    if ID_DUAL_READ and isinstance(canonical, ObjectId):
+        return [canonical, str(canonical)]
+    return [canonical]
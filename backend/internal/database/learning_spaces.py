@@ -1,12 +1,19 @@
 from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.client_session import ClientSession
 from typing import List, Optional, Dict, Any
 from datetime import datetime
 from models.database import LearningSpace
 from .MongoConnection import mongo_connection
+from ..metrics import mongo_timed
+from ..cache import TTLCache
 
 # Get the learning spaces collection
 learning_spaces_collection = mongo_connection.get_collection('LearningSpaces')
 
+# Read-through cache for get_learning_space, every write below invalidates its entry
+learning_space_cache: TTLCache[LearningSpace] = TTLCache("learning_spaces")
+
 def object_id_to_str(doc):
     '''
     Convert ObjectId to string and map _id to id for Pydantic model
@@ -16,6 +23,7 @@ def object_id_to_str(doc):
         del doc["_id"]
     return doc
 
+@mongo_timed("LearningSpaces")
 async def create_learning_space(name: str) -> LearningSpace:
     '''
     Create a new learning space
@@ -33,19 +41,27 @@ async def create_learning_space(name: str) -> LearningSpace:
     
     return LearningSpace(**learning_space)
 
+@mongo_timed("LearningSpaces")
 async def get_learning_space(learning_space_id: str) -> Optional[LearningSpace]:
     '''
     Get a learning space by ID
     '''
+    cached = learning_space_cache.get(learning_space_id)
+    if cached is not None:
+        return cached.model_copy()
+
     try:
         doc = learning_spaces_collection.find_one({"_id": ObjectId(learning_space_id)})
         if doc:
             doc = object_id_to_str(doc)
-            return LearningSpace(**doc)
+            learning_space = LearningSpace(**doc)
+            learning_space_cache.set(learning_space_id, learning_space)
+            return learning_space.model_copy()
         return None
     except Exception:
         return None
 
+@mongo_timed("LearningSpaces")
 async def get_all_learning_spaces() -> List[LearningSpace]:
     '''
     Get all learning spaces
@@ -59,6 +75,7 @@ async def get_all_learning_spaces() -> List[LearningSpace]:
     
     return learning_spaces
 
+@mongo_timed("LearningSpaces")
 async def update_learning_space(learning_space_id: str, update_data: Dict[str, Any]) -> Optional[LearningSpace]:
     '''
     Update a learning space
@@ -67,42 +84,70 @@ async def update_learning_space(learning_space_id: str, update_data: Dict[str, A
         # Always update the updatedAt field
         update_data["updatedAt"] = datetime.now()
         
-        # Perform update
-        result = learning_spaces_collection.update_one(
+        # Perform update and get the updated document in the same round trip
+        doc = learning_spaces_collection.find_one_and_update(
             {"_id": ObjectId(learning_space_id)},
-            {"$set": update_data}
+            {"$set": update_data},
+            return_document=ReturnDocument.AFTER
         )
+        learning_space_cache.invalidate(learning_space_id)
         
-        if result.modified_count == 1:
-            # Return updated document
-            doc = learning_spaces_collection.find_one({"_id": ObjectId(learning_space_id)})
-            if doc:
-                doc = object_id_to_str(doc)
-                return LearningSpace(**doc)
+        if doc:
+            doc = object_id_to_str(doc)
+            return LearningSpace(**doc)
         
         return None
     except Exception:
         return None
 
+@mongo_timed("LearningSpaces")
 async def delete_learning_space(learning_space_id: str) -> bool:
     '''
     Delete a learning space
     '''
     try:
         result = learning_spaces_collection.delete_one({"_id": ObjectId(learning_space_id)})
+        learning_space_cache.invalidate(learning_space_id)
         return result.deleted_count == 1
     except Exception:
         return False
 
-async def update_file_count(learning_space_id: str, count_change: int = 1) -> bool:
+@mongo_timed("LearningSpaces")
+async def update_file_count(learning_space_id: str, count_change: int = 1, session: Optional[ClientSession] = None) -> bool:
     '''
-    Update the file count for a learning space
+    Update the file count for a learning space, within the caller's transaction if a session is given
     '''
     try:
         result = learning_spaces_collection.update_one(
             {"_id": ObjectId(learning_space_id)},
-            {"$inc": {"fileCount": count_change}}
+            {
+                # filesVersion and filesUpdatedAt validate cached file lists
+                "$inc": {"fileCount": count_change, "filesVersion": 1},
+                "$set": {"filesUpdatedAt": datetime.now()}
+            },
+            session=session
         )
+        learning_space_cache.invalidate(learning_space_id)
         return result.modified_count == 1
     except Exception:
         return False
+
+@mongo_timed("LearningSpaces")
+async def get_learning_space_versions(learning_space_id: str) -> Optional[Dict[str, Any]]:
+    '''
+    Get the version counter of a learning space's files, without anything else.
+    Counters start at 0 for spaces that have not changed since they were introduced.
+    '''
+    try:
+        doc = learning_spaces_collection.find_one(
+            {"_id": ObjectId(learning_space_id)},
+            {"updatedAt": 1, "filesVersion": 1, "filesUpdatedAt": 1}
+        )
+    except Exception:
+        return None
+    if not doc:
+        return None
+    return {
+        "filesVersion": doc.get("filesVersion", 0),
+        "filesUpdatedAt": doc.get("filesUpdatedAt") or doc.get("updatedAt")
+    }
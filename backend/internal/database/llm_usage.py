@@ -0,0 +1,117 @@
+import asyncio
+from typing import List, Optional, Dict, Any
+from datetime import datetime, date
+from pymongo.errors import DuplicateKeyError
+from models.usage import LLMUsageTotals
+from .MongoConnection import mongo_connection
+from ..metrics import mongo_timed
+from .ids import to_object_id, id_match
+
+collection = mongo_connection.get_collection("LLMUsage")
+
+# Fields a usage query can be grouped by
+USAGE_GROUP_FIELDS = ("learningSpaceId", "toolType", "model", "day")
+
+def ensure_llm_usage_indexes():
+    """
+    One totals document per learning space, tool type, model and day: the upsert below finds it through
+    this index, and concurrent first calls of a day cannot both insert one
+    """
+    try:
+        collection.create_index(
+            [("learningSpaceId", 1), ("toolType", 1), ("model", 1), ("day", 1)],
+            name="usage_totals",
+            unique=True
+        )
+    except Exception as e:
+        print(f"Error creating LLM usage indexes: {e}")
+
+@mongo_timed("LLMUsage")
+async def record_llm_usage(
+    learning_space_id: Optional[str],
+    tool_type: str,
+    model: str,
+    usage: Dict[str, Any],
+    duration: float = 0.0
+) -> None:
+    """
+    Add the usage of one LLM call to the daily totals of its learning space, tool type and model.
+    usage is the normalized dict returned by usage_with_cost. Totals are updated with a single
+    $inc upsert, so concurrent calls never overwrite each other.
+    The write runs in a worker thread, usage is recorded after replies and must not hold up the event loop.
+    """
+    today = datetime.combine(date.today(), datetime.min.time())
+    query = {
+        "learningSpaceId": to_object_id(learning_space_id),
+        "toolType": tool_type,
+        "model": model,
+        "day": today
+    }
+    update = {
+        "$inc": {
+            "requests": 1,
+            "promptTokens": usage.get("promptTokens", 0),
+            "completionTokens": usage.get("completionTokens", 0),
+            "cachedTokens": usage.get("cachedTokens", 0),
+            "cost": usage.get("cost", 0.0),
+            "durationSeconds": duration
+        },
+        "$set": {"updatedAt": datetime.now()}
+    }
+    try:
+        await asyncio.to_thread(collection.update_one, query, update, upsert=True)
+    except DuplicateKeyError:
+        # Another call inserted the day's document first, it now exists and the update applies to it
+        await asyncio.to_thread(collection.update_one, query, update, upsert=True)
+
+@mongo_timed("LLMUsage")
+async def get_llm_usage_totals(
+    learning_space_id: Optional[str] = None,
+    tool_type: Optional[str] = None,
+    model: Optional[str] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    group_by: Optional[List[str]] = None
+) -> List[LLMUsageTotals]:
+    """
+    Sum the daily usage totals matching the filters, optionally grouped by
+    learningSpaceId, toolType, model and/or day. Both dates are inclusive.
+    """
+    query: Dict[str, Any] = {}
+    if learning_space_id:
+        query["learningSpaceId"] = id_match(learning_space_id)
+    if tool_type:
+        query["toolType"] = tool_type
+    if model:
+        query["model"] = model
+    if start_date or end_date:
+        query["day"] = {}
+        if start_date:
+            query["day"]["$gte"] = datetime.combine(start_date, datetime.min.time())
+        if end_date:
+            query["day"]["$lte"] = datetime.combine(end_date, datetime.min.time())
+
+    group_by = group_by or []
+    pipeline = [
+        {"$match": query},
+        {"$group": {
+            # Totals written before references were ObjectIds hold the string form, both group together
+            "_id": {
+                field: {"$toString": f"${field}"} if field == "learningSpaceId" else f"${field}"
+                for field in group_by
+            } or None,
+            "requests": {"$sum": "$requests"},
+            "promptTokens": {"$sum": "$promptTokens"},
+            "completionTokens": {"$sum": "$completionTokens"},
+            "cachedTokens": {"$sum": "$cachedTokens"},
+            "cost": {"$sum": "$cost"},
+            "durationSeconds": {"$sum": "$durationSeconds"}
+        }},
+        {"$sort": {"cost": -1}}
+    ]
+
+    totals = []
+    for doc in collection.aggregate(pipeline):
+        group = doc.pop("_id") or {}
+        totals.append(LLMUsageTotals(**group, **doc))
+    return totals
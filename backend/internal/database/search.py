@@ -0,0 +1,223 @@
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+from models.search import SearchResult, SearchResults
+from ..metrics import mongo_timed
+from .files import files_collection
+from .chat_messages import collection as chat_messages_collection, chat_write_buffer
+from .ids import id_values
+from .file_text import decode_text_fields
+
+# Characters of context shown around the first match
+SNIPPET_LENGTH = 240
+
+SEARCH_SOURCES = ("file", "chat")
+
+# extractedText holds the text of files stored before it was compressed, searchTerms the words of the others.
+# Both keep term frequency, so their scores are comparable.
+FILE_SEARCH_WEIGHTS = {"name": 5, "extractedText": 1, "searchTerms": 1}
+CHAT_SEARCH_WEIGHTS = {"content": 1}
+# Fields needed to read a file's text in either storage version
+FILE_TEXT_PROJECTION = {"extractedText": 1, "extractedTextCompressed": 1, "textEncoding": 1}
+# Best scored files whose text is decompressed to check quoted phrases, phrase matches past them are not found
+PHRASE_CANDIDATE_LIMIT = int(os.getenv('SEARCH_PHRASE_CANDIDATES', '200'))
+
+PHRASE = re.compile(r'(-?)"([^"]*)"')
+
+def search_index_keys(weights: Dict[str, int]) -> List[Tuple[str, Any]]:
+    # learningSpaceId first, so a search only scores the text of one learning space
+    return [("learningSpaceId", 1)] + [(field, "text") for field in weights]
+
+def search_index_current(collection, weights: Dict[str, int]) -> Optional[bool]:
+    '''
+    Whether the collection's search index has the current fields, None if it has none
+    '''
+    existing = collection.index_information().get("search_text")
+    if not existing:
+        return None
+    return existing["key"][0][0] == "learningSpaceId" and existing.get("weights") == weights
+
+def create_search_index(collection, weights: Dict[str, int]):
+    collection.create_index(search_index_keys(weights), name="search_text", weights=weights)
+
+def replace_search_index(collection, weights: Dict[str, int]) -> bool:
+    '''
+    Drop a text index over other fields and build the current one. A collection has at most one
+    text index, so search fails until the new one is built. Run once, by migrations.search_indexes.
+    '''
+    current = search_index_current(collection, weights)
+    if current:
+        return False
+    if current is False:
+        collection.drop_index("search_text")
+    create_search_index(collection, weights)
+    return True
+
+def ensure_search_indexes():
+    '''
+    Create the text indexes searched below. MongoDB keeps them up to date on every insert and delete,
+    and creating an index that already exists does nothing, so every worker can run this at startup.
+    An older index is left in place for the migration to replace, workers never drop indexes.
+    '''
+    for name, collection, weights in (
+        ("files", files_collection, FILE_SEARCH_WEIGHTS),
+        ("chat messages", chat_messages_collection, CHAT_SEARCH_WEIGHTS)
+    ):
+        try:
+            if search_index_current(collection, weights) is False:
+                print(f"The {name} search index is outdated, run python -m migrations.search_indexes to rebuild it")
+            else:
+                create_search_index(collection, weights)
+        except Exception as e:
+            print(f"Error creating the {name} search index: {e}")
+
+def query_phrases(query: str) -> Tuple[List[str], List[str]]:
+    '''
+    Quoted phrases of the query, and the negated ones
+    '''
+    phrases, negated = [], []
+    for match in PHRASE.finditer(query):
+        phrase = " ".join(match.group(2).lower().split())
+        if phrase:
+            (negated if match.group(1) else phrases).append(phrase)
+    return phrases, negated
+
+def without_phrases(query: str) -> str:
+    '''
+    The query with quoted phrases turned into plain words and negated phrases removed
+    '''
+    return PHRASE.sub(lambda match: " " if match.group(1) else f" {match.group(2)} ", query)
+
+def matches_phrases(text: str, phrases: List[str], negated: List[str]) -> bool:
+    text = " ".join(text.lower().split())
+    return all(phrase in text for phrase in phrases) and not any(phrase in text for phrase in negated)
+
+def query_terms(query: str) -> List[str]:
+    '''
+    Words to highlight: every word of the query except negated ones, quoted phrases included
+    '''
+    terms = []
+    for match in re.finditer(r'(-?)"([^"]*)"|(-?)(\S+)', query):
+        if match.group(2) is not None:
+            if not match.group(1):
+                terms.extend(re.findall(r"\w+", match.group(2)))
+        elif not match.group(3):
+            terms.extend(re.findall(r"\w+", match.group(4)))
+    return [term.lower() for term in terms if len(term) > 1]
+
+def snippet_with_highlights(text: str, terms: List[str]) -> Tuple[str, List[Tuple[int, int]]]:
+    '''
+    A window of the text around the first matched word, and the offsets of matched words inside it.
+    Words are matched by prefix so stemmed matches ('osmosis' for 'osmotic') are mostly found too.
+    '''
+    pattern = re.compile(
+        r"\b(?:" + "|".join(re.escape(term[:max(4, len(term) - 2)]) for term in terms) + r")\w*",
+        re.IGNORECASE
+    ) if terms else None
+
+    first = pattern.search(text) if pattern else None
+    anchor = first.start() if first else 0
+    start = max(0, anchor - SNIPPET_LENGTH // 3)
+    if start > 0:
+        # Start and end at word boundaries
+        start = text.find(" ", start, anchor) + 1 or start
+    end = min(len(text), start + SNIPPET_LENGTH)
+    if end < len(text):
+        space = text.rfind(" ", anchor, end)
+        end = space if space > anchor else end
+
+    # Only the window is cleaned up, extracted text can be megabytes long
+    snippet = " ".join(text[start:end].split())
+    highlights = [(match.start(), match.end()) for match in pattern.finditer(snippet)] if pattern else []
+    if start > 0:
+        snippet = "…" + snippet
+        highlights = [(begin + 1, finish + 1) for begin, finish in highlights]
+    if end < len(text):
+        snippet += "…"
+    return snippet, highlights
+
+def ranked_matches(collection, learning_space_id: str, query: str, projection: Dict[str, int], limit: int) -> List[Dict[str, Any]]:
+    '''
+    The best scored text matches of a learning space. The search indexes need an equality match on
+    learningSpaceId, so each stored form of the reference is queried on its own.
+    '''
+    matches: List[Dict[str, Any]] = []
+    for learning_space_ref in id_values(learning_space_id):
+        matches.extend(collection.find(
+            {"learningSpaceId": learning_space_ref, "$text": {"$search": query}},
+            {"score": {"$meta": "textScore"}, **projection}
+        ).sort([("score", {"$meta": "textScore"})]).limit(limit))
+    matches.sort(key=lambda match: match["score"], reverse=True)
+    return matches[:limit]
+
+@mongo_timed("Search")
+async def search_learning_space(
+    learning_space_id: str,
+    query: str,
+    skip: int = 0,
+    limit: int = 20,
+    sources: Tuple[str, ...] = SEARCH_SOURCES
+) -> SearchResults:
+    '''
+    Ranked full-text search over the extracted text of a learning space's files and its chat messages.
+    Both collections are ranked by text score and merged. Only the IDs and scores of the first
+    skip + limit + 1 hits are read, file text is then fetched for the returned page alone.
+    File text is compressed and only its words are indexed (searchTerms), so quoted phrases are matched
+    on their words by MongoDB and then checked against the text of the PHRASE_CANDIDATE_LIMIT best of them.
+    '''
+    wanted = skip + limit + 1
+    hits: List[Dict[str, Any]] = []
+    file_texts: Dict[Any, str] = {}
+
+    if "file" in sources:
+        phrases, negated = query_phrases(query)
+        if phrases or negated:
+            candidates = ranked_matches(files_collection, learning_space_id, without_phrases(query),
+                                        {"name": 1, "uploadedAt": 1}, PHRASE_CANDIDATE_LIMIT)
+            texts = {
+                doc["_id"]: decode_text_fields(doc).get("extractedText") or ""
+                for doc in files_collection.find({"_id": {"$in": [doc["_id"] for doc in candidates]}}, FILE_TEXT_PROJECTION)
+            }
+            for doc in candidates:
+                text = texts.get(doc["_id"], "")
+                if matches_phrases(text, phrases, negated):
+                    file_texts[doc["_id"]] = text
+                    hits.append({"source": "file", **doc})
+        else:
+            matches = ranked_matches(files_collection, learning_space_id, query, {"name": 1, "uploadedAt": 1}, wanted)
+            hits.extend({"source": "file", **doc} for doc in matches)
+
+    if "chat" in sources:
+        # Messages still queued in the write-behind buffer are searchable too
+        await chat_write_buffer.flush()
+        matches = ranked_matches(chat_messages_collection, learning_space_id, query,
+                                 {"role": 1, "content": 1, "timestamp": 1}, wanted)
+        hits.extend({"source": "chat", **doc} for doc in matches)
+
+    hits.sort(key=lambda hit: hit["score"], reverse=True)
+    page = hits[skip:skip + limit]
+
+    file_ids = [hit["_id"] for hit in page if hit["source"] == "file" and hit["_id"] not in file_texts]
+    if file_ids:
+        for doc in files_collection.find({"_id": {"$in": file_ids}}, FILE_TEXT_PROJECTION):
+            file_texts[doc["_id"]] = decode_text_fields(doc).get("extractedText") or ""
+
+    terms = query_terms(query)
+    results = []
+    for hit in page:
+        if hit["source"] == "file":
+            text, title, timestamp = file_texts.get(hit["_id"], ""), hit["name"], hit["uploadedAt"]
+        else:
+            text, title, timestamp = hit["content"], hit["role"], hit["timestamp"]
+        snippet, highlights = snippet_with_highlights(text, terms)
+        results.append(SearchResult(
+            source=hit["source"],
+            id=str(hit["_id"]),
+            title=title,
+            score=hit["score"],
+            snippet=snippet,
+            highlights=highlights,
+            timestamp=timestamp
+        ))
+
+    return SearchResults(query=query, results=results, skip=skip, limit=limit, hasMore=len(hits) > skip + limit)
@@ -1,13 +1,41 @@
 from datetime import datetime
 from typing import Optional, Dict, Any, List
 from bson import ObjectId
+from pymongo import ReturnDocument
+from pydantic import TypeAdapter
 from models.database import ToolHistory
 from .MongoConnection import mongo_connection
+from ..metrics import mongo_timed
+from .ids import id_match
+from ..cache import TTLCache
 
 # Get the tool history collection
 tool_history_collection = mongo_connection.get_collection('ToolHistory')
 
+# Read-through cache for get_tool_history, every write below refreshes or invalidates its entry
+tool_history_cache: TTLCache[ToolHistory] = TTLCache("tool_history")
 
+tool_history_list = TypeAdapter(List[ToolHistory])
+
+
+def cache_tool_history(doc: Dict[str, Any]) -> ToolHistory:
+    """
+    Build the model from a document read or written just now, cache it and return a copy
+    """
+    tool_history = ToolHistory(
+        id=str(doc["_id"]),
+        learningSpaceId=str(doc["learningSpaceId"]),
+        type=doc["type"],
+        createdAt=doc["createdAt"],
+        updatedAt=doc["updatedAt"],
+        status=doc["status"],
+        toolData=doc.get("toolData"),
+        tags=doc.get("tags")
+    )
+    tool_history_cache.set(tool_history.id, tool_history)
+    return tool_history.model_copy(deep=True)
+
+@mongo_timed("ToolHistory")
 async def create_tool_history(learning_space_id: str, tool_type: str, tool_data: Optional[Dict[str, Any]] = None) -> ToolHistory:
     """
     Create a new tool history entry
@@ -15,7 +43,9 @@ async def create_tool_history(learning_space_id: str, tool_type: str, tool_data:
 
     collection = tool_history_collection
     
+    # MongoDB keeps milliseconds, truncated so the returned and cached entry match what is stored
     current_time = datetime.now()
+    current_time = current_time.replace(microsecond=current_time.microsecond // 1000 * 1000)
     
     tool_history_data = {
         "learningSpaceId": ObjectId(learning_space_id),
@@ -29,48 +59,36 @@ async def create_tool_history(learning_space_id: str, tool_type: str, tool_data:
         tool_history_data["toolData"] = tool_data
     
     try:
-        result = collection.insert_one(tool_history_data)
-
-        # Retrieve the created document
-        created_doc = collection.find_one({"_id": result.inserted_id})
-        
-        return ToolHistory(
-            id=str(created_doc["_id"]),
-            learningSpaceId=str(created_doc["learningSpaceId"]),
-            type=created_doc["type"],
-            createdAt=created_doc["createdAt"],
-            updatedAt=created_doc["updatedAt"],
-            status=created_doc["status"],
-            toolData=created_doc.get("toolData"),
-            tags=created_doc.get("tags")
-        )
+        # insert_one adds the _id to the document, it is not read back
+        collection.insert_one(tool_history_data)
+
+        return cache_tool_history(tool_history_data)
 
     except Exception as e:
         print(f"Error creating tool history: {e}")
         raise e
 
-async def get_tool_history(tool_history_id: str) -> Optional[ToolHistory]:
+@mongo_timed("ToolHistory")
+async def get_tool_history(tool_history_id: str, use_cache: bool = True) -> Optional[ToolHistory]:
     """
     Get a tool history entry by ID
+    Returns a copy, so callers can change toolData without touching the cached entry.
     """
     collection = tool_history_collection
+
+    if use_cache:
+        cached = tool_history_cache.get(tool_history_id)
+        if cached is not None:
+            return cached.model_copy(deep=True)
     
     doc = collection.find_one({"_id": ObjectId(tool_history_id)})
     
     if not doc:
         return None
     
-    return ToolHistory(
-        id=str(doc["_id"]),
-        learningSpaceId=str(doc["learningSpaceId"]),
-        type=doc["type"],
-        createdAt=doc["createdAt"],
-        updatedAt=doc["updatedAt"],
-        status=doc["status"],
-        toolData=doc.get("toolData"),
-        tags=doc.get("tags")
-    )
+    return cache_tool_history(doc)
 
+@mongo_timed("ToolHistory")
 async def update_tool_history(tool_history_id: str, update_data: Dict[str, Any]) -> Optional[ToolHistory]:
     """
     Update a tool history entry
@@ -84,17 +102,20 @@ async def update_tool_history(tool_history_id: str, update_data: Dict[str, Any])
     if "learningSpaceId" in update_data:
         update_data["learningSpaceId"] = ObjectId(update_data["learningSpaceId"])
     
-    result = collection.update_one(
+    # Update and get the updated document in the same round trip
+    doc = collection.find_one_and_update(
         {"_id": ObjectId(tool_history_id)},
-        {"$set": update_data}
+        {"$set": update_data},
+        return_document=ReturnDocument.AFTER
     )
+    tool_history_cache.invalidate(tool_history_id)
     
-    if result.matched_count == 0:
+    if not doc:
         return None
     
-    # Return the updated document
-    return await get_tool_history(tool_history_id)
+    return cache_tool_history(doc)
 
+@mongo_timed("ToolHistory")
 async def update_tool_data(tool_history_id: str, tool_data_updates: Dict[str, Any]) -> Optional[ToolHistory]:
     """
     Update specific fields in toolData
@@ -102,22 +123,25 @@ async def update_tool_data(tool_history_id: str, tool_data_updates: Dict[str, An
     collection = tool_history_collection
     
     # Create update operations for nested toolData fields
-    update_ops = {"updatedAt": datetime.utcnow()}
+    update_ops = {"updatedAt": datetime.now()}
     
     for key, value in tool_data_updates.items():
         update_ops[f"toolData.{key}"] = value
     
-    result = collection.update_one(
+    # Update and get the updated document in the same round trip
+    doc = collection.find_one_and_update(
         {"_id": ObjectId(tool_history_id)},
-        {"$set": update_ops}
+        {"$set": update_ops},
+        return_document=ReturnDocument.AFTER
     )
+    tool_history_cache.invalidate(tool_history_id)
     
-    if result.matched_count == 0:
+    if not doc:
         return None
     
-    # Return the updated document
-    return await get_tool_history(tool_history_id)
+    return cache_tool_history(doc)
 
+@mongo_timed("ToolHistory")
 async def get_tool_history_by_learning_space(learning_space_id: str) -> List[ToolHistory]:
     """
     Get all tool history entries for a learning space
@@ -125,28 +149,51 @@ async def get_tool_history_by_learning_space(learning_space_id: str) -> List[Too
     collection = tool_history_collection
     
     cursor = collection.find({
-        "learningSpaceId": ObjectId(learning_space_id)
+        "learningSpaceId": id_match(learning_space_id)
     }).sort("createdAt", -1)
 
-    tool_histories = []
-    for doc in cursor:
-        tool_histories.append(ToolHistory(
-            id=str(doc["_id"]),
-            learningSpaceId=str(doc["learningSpaceId"]),
-            type=doc["type"],
-            createdAt=doc["createdAt"],
-            updatedAt=doc["updatedAt"],
-            status=doc["status"],
-            toolData=doc.get("toolData"),
-            tags=doc.get("tags")
-        ))
-
-    return tool_histories
+    # Validate the whole list in one call instead of building each model from Python
+    docs = list(cursor)
+    for doc in docs:
+        doc["id"] = str(doc.pop("_id"))
+    return tool_history_list.validate_python(docs)
+
+@mongo_timed("ToolHistory")
+async def get_tool_history_version(learning_space_id: str) -> Dict[str, Any]:
+    """
+    Version of a learning space's tool history list, derived from the entries themselves so
+    writes need no second round trip to keep a counter. Every create and update moves updatedAt
+    forward and every delete changes the count, covered by the (learningSpaceId, updatedAt) index.
+    """
+    result = list(tool_history_collection.aggregate([
+        {"$match": {"learningSpaceId": id_match(learning_space_id)}},
+        {"$group": {
+            "_id": None,
+            "count": {"$sum": 1},
+            "updatedAt": {"$max": "$updatedAt"},
+            # Also changes when an older entry is updated in the same millisecond as the newest one
+            "updatedAtSum": {"$sum": {"$toLong": "$updatedAt"}}
+        }}
+    ]))
+    if not result:
+        return {"count": 0, "updatedAt": None, "updatedAtSum": 0}
+    result[0].pop("_id")
+    return result[0]
 
+@mongo_timed("ToolHistory")
 async def delete_tool_history(tool_history_id: str) -> bool:
     """
     Delete a tool history entry by ID
     """
     collection = tool_history_collection
-    result = collection.delete_one({"_id": ObjectId(tool_history_id)})
-    return result.deleted_count > 0
+    deleted = collection.find_one_and_delete({"_id": ObjectId(tool_history_id)}, {"learningSpaceId": 1})
+    tool_history_cache.invalidate(tool_history_id)
+    return deleted is not None
+
+@mongo_timed("ToolHistory")
+async def get_tool_history_updated_at(tool_history_id: str) -> Optional[datetime]:
+    """
+    Get only the updatedAt of a tool history entry, to validate cached copies
+    """
+    doc = tool_history_collection.find_one({"_id": ObjectId(tool_history_id)}, {"updatedAt": 1})
+    return doc["updatedAt"] if doc else None
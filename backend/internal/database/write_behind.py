@@ -0,0 +1,199 @@
+import asyncio
+import contextvars
+import os
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from pymongo import InsertOne
+from pymongo.errors import BulkWriteError
+
+# Duplicate key errors on a retried batch mean the insert already landed
+DUPLICATE_KEY_ERROR = 11000
+
+FLUSH_INTERVAL = float(os.getenv('WRITE_BEHIND_FLUSH_INTERVAL', '0.05'))
+MAX_BATCH_SIZE = int(os.getenv('WRITE_BEHIND_MAX_BATCH_SIZE', '500'))
+MAX_RETRY_DELAY = float(os.getenv('WRITE_BEHIND_MAX_RETRY_DELAY', '5'))
+# A batch that keeps failing (e.g. Mongo is down) is dropped after this many attempts, about 12s with the delays above
+MAX_RETRIES = int(os.getenv('WRITE_BEHIND_MAX_RETRIES', '8'))
+# New inserts are refused once this many operations are waiting
+MAX_QUEUE_SIZE = int(os.getenv('WRITE_BEHIND_MAX_QUEUE_SIZE', '10000'))
+# Longest flush() and close() wait for queued writes
+FLUSH_TIMEOUT = float(os.getenv('WRITE_BEHIND_FLUSH_TIMEOUT', '15'))
+
+class WriteBehindError(Exception):
+    '''
+    Queued writes could not be made durable: the queue is full, a flush timed out or a batch was dropped
+    '''
+
+class WriteBehindBuffer:
+    '''
+    Ordered write-behind queue for a single MongoDB collection.
+    Operations are accepted immediately and written in batches by a background task,
+    so callers on a latency sensitive path never wait on a Mongo round-trip.
+    flush() waits until everything queued so far has been acknowledged by the server.
+    '''
+
+    def __init__(self, collection, flush_interval: float = FLUSH_INTERVAL, max_batch_size: int = MAX_BATCH_SIZE,
+                 max_queue_size: int = MAX_QUEUE_SIZE, flush_timeout: float = FLUSH_TIMEOUT):
+        self.collection = collection
+        self.flush_interval = flush_interval
+        self.max_batch_size = max_batch_size
+        self.max_queue_size = max_queue_size
+        self.flush_timeout = flush_timeout
+        self._operations: List[Any] = []
+        self._pending_documents: Dict[Any, dict] = {}
+        self._queued = 0  # Sequence number of the last queued operation
+        self._written = 0  # Sequence number of the last durable operation
+        self._wakeup: Optional[asyncio.Event] = None
+        self._written_condition: Optional[asyncio.Condition] = None
+        self._task: Optional[asyncio.Task] = None
+        # Sequence number ranges of recently dropped batches, checked by flush()
+        self._dropped: Deque[Tuple[int, int]] = deque(maxlen=100)
+
+    def _ensure_started(self):
+        '''
+        Start the background flush task on the running event loop
+        '''
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._written_condition = asyncio.Condition()
+            # Run in an empty context so flushes are not attributed to the request that started the task
+            self._task = asyncio.get_running_loop().create_task(self._run(), context=contextvars.Context())
+
+    def insert(self, document: dict) -> int:
+        '''
+        Queue a document insert. Returns the sequence number of the write.
+        Raises WriteBehindError when the queue is full, so new work is refused while Mongo is not keeping up.
+        Updates of documents already queued are always accepted, they belong to work that is in progress.
+        '''
+        if len(self._operations) >= self.max_queue_size:
+            raise WriteBehindError(f"Write-behind queue is full ({len(self._operations)} operations waiting)")
+        self._pending_documents[document["_id"]] = document
+        return self.enqueue(InsertOne(document), document["_id"])
+
+    def enqueue(self, operation: Any, document_id: Any = None) -> int:
+        '''
+        Queue a pymongo bulk write operation (InsertOne, UpdateOne, ...)
+        Operations are written in the order they were queued
+        '''
+        self._ensure_started()
+        self._operations.append((operation, document_id))
+        self._queued += 1
+        self._wakeup.set()
+        return self._queued
+
+    @property
+    def depth(self) -> int:
+        '''
+        Number of operations waiting to be written
+        '''
+        return len(self._operations)
+
+    @property
+    def written(self) -> int:
+        '''
+        Sequence number of the last operation that was written (or dropped), compare with the number insert() and enqueue() return
+        '''
+        return self._written
+
+    def pending_documents(self, query: Dict[str, Any]) -> List[dict]:
+        '''
+        Get queued inserts that have not been written yet and match a simple equality query
+        '''
+        return [
+            doc for doc in self._pending_documents.values()
+            if all(doc.get(key) == value for key, value in query.items())
+        ]
+
+    async def flush(self, sequence: Optional[int] = None) -> None:
+        '''
+        Wait until every operation queued so far (or up to the given sequence number) is durable.
+        Raises WriteBehindError if that takes longer than flush_timeout or some of them were dropped.
+        '''
+        target = self._queued if sequence is None else sequence
+        if self._written >= target or self._written_condition is None:
+            return
+        start = self._written
+        self._wakeup.set()
+        try:
+            async with self._written_condition:
+                await asyncio.wait_for(
+                    self._written_condition.wait_for(lambda: self._written >= target),
+                    self.flush_timeout
+                )
+        except asyncio.TimeoutError:
+            raise WriteBehindError(f"Queued writes were not flushed within {self.flush_timeout}s")
+        if any(first <= target and last > start for first, last in self._dropped):
+            raise WriteBehindError("Queued writes were dropped after repeated errors")
+
+    async def close(self) -> None:
+        '''
+        Flush outstanding writes and stop the background task.
+        Writes still queued after flush_timeout are lost, which is logged.
+        '''
+        if self._task is None:
+            return
+        try:
+            await self.flush()
+        except WriteBehindError as e:
+            print(f"Error closing write-behind buffer, {len(self._operations)} operations not written: {e}")
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        retry_delay = self.flush_interval
+        attempts = 0
+        while True:
+            await self._wakeup.wait()
+            # Give concurrent writers a short window to join the batch
+            await asyncio.sleep(self.flush_interval)
+            self._wakeup.clear()
+
+            while self._operations:
+                batch = self._operations[:self.max_batch_size]
+                try:
+                    written = await asyncio.to_thread(self._write_batch, [operation for operation, _ in batch])
+                except Exception as e:
+                    attempts += 1
+                    if attempts < MAX_RETRIES:
+                        print(f"Error flushing write-behind buffer: {e}")
+                        await asyncio.sleep(retry_delay)
+                        retry_delay = min(retry_delay * 2, MAX_RETRY_DELAY)
+                        continue
+                    print(f"Dropping {len(batch)} write-behind operations after {attempts} attempts: {e}")
+                    self._dropped.append((self._written + 1, self._written + len(batch)))
+                    written = len(batch)
+
+                attempts = 0
+                retry_delay = self.flush_interval
+                await self._mark_written(batch[:written])
+
+    def _write_batch(self, batch: List[Any]) -> int:
+        '''
+        Write a batch in order. Returns how many operations from the front of the batch are durable
+        '''
+        try:
+            self.collection.bulk_write(batch, ordered=True)
+            return len(batch)
+        except BulkWriteError as e:
+            write_errors = e.details.get("writeErrors", [])
+            if not write_errors:
+                raise
+            first_error = write_errors[0]
+            if first_error.get("code") != DUPLICATE_KEY_ERROR:
+                # Write errors are per document and will not succeed on retry, so drop the operation
+                print(f"Dropping write-behind operation: {first_error.get('errmsg')}")
+            # Everything before the failed operation is durable, the rest is retried on the next pass
+            return first_error["index"] + 1
+
+    async def _mark_written(self, batch: List[Any]):
+        del self._operations[:len(batch)]
+        for _, document_id in batch:
+            if document_id is not None:
+                self._pending_documents.pop(document_id, None)
+        self._written += len(batch)
+        async with self._written_condition:
+            self._written_condition.notify_all()
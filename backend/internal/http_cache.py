@@ -0,0 +1,53 @@
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, Optional
+from fastapi import Request, Response
+
+def make_etag(*parts) -> str:
+    '''
+    Strong ETag from the values that identify a version of a resource, e.g. an ID and its updatedAt
+    '''
+    digest = hashlib.sha1(":".join(str(part) for part in parts).encode()).hexdigest()
+    return f'"{digest[:24]}"'
+
+def as_utc(value: datetime) -> datetime:
+    # Stored datetimes are naive local time (written with datetime.now()), astimezone reads them as such
+    return value.astimezone(timezone.utc)
+
+def http_date(value: datetime) -> str:
+    return format_datetime(as_utc(value), usegmt=True)
+
+def cache_headers(etag: str, last_modified: Optional[datetime] = None) -> Dict[str, str]:
+    '''
+    Validator headers. no-cache lets the browser keep the response but makes it revalidate on every use.
+    '''
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    return headers
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[datetime] = None) -> bool:
+    '''
+    Evaluate If-None-Match, or If-Modified-Since when no If-None-Match was sent (RFC 9110 13.2.2)
+    '''
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        # Weak comparison, so W/ prefixed tags added by proxies still match
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return etag in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        # HTTP dates have a resolution of one second
+        return as_utc(last_modified).replace(microsecond=0) <= since
+    return False
+
+def not_modified_response(etag: str, last_modified: Optional[datetime] = None) -> Response:
+    return Response(status_code=304, headers=cache_headers(etag, last_modified))
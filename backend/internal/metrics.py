@@ -0,0 +1,454 @@
+import asyncio
+import bisect
+import functools
+import glob
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from .tracing import start_span, SPAN_KIND_CLIENT
+
+# Every metric registers itself here when it is created
+_registry: List['Metric'] = []
+
+# Seconds between the snapshots each worker writes to METRICS_DIR when several workers run
+METRICS_SNAPSHOT_INTERVAL = float(os.getenv('METRICS_SNAPSHOT_INTERVAL', '1'))
+
+# Default latency buckets in seconds, from sub-millisecond Mongo reads to long LLM generations
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+RATE_BUCKETS = (1, 5, 10, 20, 40, 60, 80, 100, 150, 200, 400)
+
+class Metric:
+    '''
+    Base class for metrics, optionally split by label values
+    '''
+    type = "untyped"
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def _label_text(self, key: Tuple[str, ...], extra: str = "") -> str:
+        pairs = [f'{label}="{_escape(value)}"' for label, value in zip(self.labels, key)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def state(self) -> List[Any]:
+        '''
+        JSON-serializable values of this worker, for the snapshot read by the other workers
+        '''
+        raise NotImplementedError
+
+    def merged_samples(self, states: Dict[str, List[Any]]) -> List[str]:
+        '''
+        Samples combining the state of every worker, by worker pid
+        '''
+        raise NotImplementedError
+
+    def render(self, states: Optional[Dict[str, List[Any]]] = None) -> str:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self.samples() if states is None else self.merged_samples(states))
+        return "\n".join(lines)
+
+class Counter(Metric):
+    '''
+    Monotonically increasing counter
+    '''
+    type = "counter"
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, description, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self, values: Optional[Dict[Tuple[str, ...], float]] = None) -> List[str]:
+        values = self._values if values is None else values
+        return [f"{self.name}{self._label_text(key)} {value}" for key, value in list(values.items())]
+
+    def state(self) -> List[Any]:
+        return [[list(key), value] for key, value in list(self._values.items())]
+
+    def merged_samples(self, states: Dict[str, List[Any]]) -> List[str]:
+        # Summed over workers, including exited ones, so the total never goes down
+        totals: Dict[Tuple[str, ...], float] = {}
+        for state in states.values():
+            for key, value in state:
+                totals[tuple(key)] = totals.get(tuple(key), 0) + value
+        return self.samples(totals)
+
+class Gauge(Metric):
+    '''
+    Value that goes up and down. If a function is given, it is called at scrape time instead,
+    which keeps things like queue depths free on the hot path.
+    '''
+    type = "gauge"
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = (), function: Optional[Callable[[], float]] = None):
+        super().__init__(name, description, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._function = function
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str):
+        self._values[self._key(labels)] = value
+
+    def value(self, **labels: str) -> float:
+        if self._function is not None:
+            return self._function()
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[str]:
+        if self._function is not None:
+            return [f"{self.name} {self._function()}"]
+        return [f"{self.name}{self._label_text(key)} {value}" for key, value in list(self._values.items())]
+
+    def state(self) -> List[Any]:
+        if self._function is not None:
+            return [[[], self._function()]]
+        return [[list(key), value] for key, value in list(self._values.items())]
+
+    def merged_samples(self, states: Dict[str, List[Any]]) -> List[str]:
+        # Current values do not add up across workers, each one is reported with its worker label
+        lines = []
+        for pid, state in states.items():
+            worker_label = f'worker="{pid}"'
+            for key, value in state:
+                lines.append(f"{self.name}{self._label_text(tuple(key), worker_label)} {value}")
+        return lines
+
+class Histogram(Metric):
+    '''
+    Distribution of observed values over fixed buckets
+    '''
+    type = "histogram"
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label key: [bucket counts..., +Inf count], sum
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+                self._sums[key] = 0.0
+            counts[index] += 1
+            self._sums[key] += value
+
+    def count(self, **labels: str) -> int:
+        return sum(self._counts.get(self._key(labels), []))
+
+    def samples(self, counts_by_key: Optional[Dict[Tuple[str, ...], List[int]]] = None,
+                sums: Optional[Dict[Tuple[str, ...], float]] = None) -> List[str]:
+        counts_by_key = self._counts if counts_by_key is None else counts_by_key
+        sums = self._sums if sums is None else sums
+        lines = []
+        for key, counts in list(counts_by_key.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                bucket_label = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{self._label_text(key, bucket_label)} {cumulative}")
+            cumulative += counts[-1]
+            bucket_label = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{self._label_text(key, bucket_label)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_text(key)} {sums[key]}")
+            lines.append(f"{self.name}_count{self._label_text(key)} {cumulative}")
+        return lines
+
+    def state(self) -> List[Any]:
+        with self._lock:
+            return [[list(key), list(counts), self._sums[key]] for key, counts in self._counts.items()]
+
+    def merged_samples(self, states: Dict[str, List[Any]]) -> List[str]:
+        counts_by_key: Dict[Tuple[str, ...], List[int]] = {}
+        sums: Dict[Tuple[str, ...], float] = {}
+        for state in states.values():
+            for key, counts, total in state:
+                key = tuple(key)
+                merged = counts_by_key.setdefault(key, [0] * len(counts))
+                counts_by_key[key] = [a + b for a, b in zip(merged, counts)]
+                sums[key] = sums.get(key, 0.0) + total
+        return self.samples(counts_by_key, sums)
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def metrics_dir() -> Optional[str]:
+    '''
+    Directory shared by the workers of one server, set by main.py when it starts several workers
+    '''
+    return os.getenv('METRICS_DIR') or None
+
+def prepare_metrics_dir(path: str):
+    '''
+    Create the snapshot directory and drop the snapshots of a previous run, before the workers start
+    '''
+    os.makedirs(path, exist_ok=True)
+    for snapshot in glob.glob(os.path.join(path, "*.json")):
+        os.remove(snapshot)
+
+def write_metrics_snapshot(path: str):
+    snapshot = {metric.name: metric.state() for metric in _registry}
+    target = os.path.join(path, f"{os.getpid()}.json")
+    with open(f"{target}.tmp", "w") as f:
+        json.dump(snapshot, f)
+    # Readers only ever see a complete snapshot
+    os.replace(f"{target}.tmp", target)
+
+def read_metrics_snapshots(path: str) -> Dict[str, Dict[str, List[Any]]]:
+    '''
+    Snapshots by worker pid, including the last ones of workers that exited
+    '''
+    snapshots = {}
+    for file_name in glob.glob(os.path.join(path, "*.json")):
+        pid = os.path.basename(file_name)[:-len(".json")]
+        try:
+            with open(file_name) as f:
+                snapshots[pid] = json.load(f)
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+def worker_alive(pid: str) -> bool:
+    try:
+        os.kill(int(pid), 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except (PermissionError, ValueError):
+        return True
+
+async def publish_metrics_snapshots():
+    '''
+    Write this worker's metrics to METRICS_DIR every METRICS_SNAPSHOT_INTERVAL, so whichever worker
+    answers a scrape can report all of them. Runs until cancelled, does nothing with a single worker.
+    '''
+    path = metrics_dir()
+    if path is None:
+        return
+    while True:
+        try:
+            await asyncio.to_thread(write_metrics_snapshot, path)
+        except OSError as e:
+            print(f"Error writing metrics snapshot: {e}")
+        await asyncio.sleep(METRICS_SNAPSHOT_INTERVAL)
+
+def render_metrics() -> str:
+    '''
+    Render every registered metric in the Prometheus text exposition format.
+    With several workers, counters and histograms are summed over all of them and gauges get a worker
+    label, leaving out workers that exited. The other workers' values are at most METRICS_SNAPSHOT_INTERVAL old.
+    '''
+    path = metrics_dir()
+    if path is None:
+        return "\n".join(metric.render() for metric in _registry) + "\n"
+
+    write_metrics_snapshot(path)
+    snapshots = read_metrics_snapshots(path)
+    alive = {pid for pid in snapshots if worker_alive(pid)}
+    rendered = []
+    for metric in _registry:
+        states = {
+            pid: snapshot.get(metric.name, [])
+            for pid, snapshot in snapshots.items()
+            if metric.type != "gauge" or pid in alive
+        }
+        rendered.append(metric.render(states))
+    return "\n".join(rendered) + "\n"
+
+def mongo_timed(collection: str):
+    '''
+    Decorator recording the latency of an async database function, labelled by collection and function.
+    The call is also traced as a client span of the current request.
+    '''
+    def decorator(function):
+        span_name = f"mongo {collection}.{function.__name__}"
+
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                with start_span(span_name, kind=SPAN_KIND_CLIENT, **{"db.system": "mongodb", "db.collection": collection}):
+                    return await function(*args, **kwargs)
+            finally:
+                mongo_operation_duration.observe(
+                    time.perf_counter() - start,
+                    collection=collection,
+                    function=function.__name__
+                )
+        return wrapper
+    return decorator
+
+async def monitor_event_loop_lag(interval: float = 0.1):
+    '''
+    Measure how late the event loop wakes up from a sleep, which is the time callbacks had to
+    wait behind blocking work. Runs until cancelled.
+    '''
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        event_loop_lag.observe(max(time.perf_counter() - start - interval, 0))
+
+class MetricsMiddleware:
+    '''
+    ASGI middleware recording request latency per route template and status.
+    Timing ends when the last body chunk is sent, so streamed responses are measured in full.
+    '''
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            http_request_duration.observe(
+                time.perf_counter() - start,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=str(status_code)
+            )
+
+# HTTP
+http_request_duration = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency per route, until the last byte of the response",
+    ("method", "route", "status")
+)
+
+http_response_bytes = Counter(
+    "http_response_bytes_total",
+    "Response body bytes before and after compression",
+    ("encoding", "stage")
+)
+
+event_loop_lag = Histogram(
+    "event_loop_lag_seconds",
+    "Delay between a scheduled event loop wake-up and when it ran",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+)
+
+# LLM generations
+llm_generations_cancelled = Counter(
+    "llm_generations_cancelled_total",
+    "LLM generations cancelled because the client disconnected",
+    ("endpoint",)
+)
+llm_time_to_first_token = Histogram(
+    "llm_time_to_first_token_seconds",
+    "Time from sending a streaming request to OpenRouter until the first content chunk",
+    ("model",)
+)
+llm_tokens_per_second = Histogram(
+    "llm_tokens_per_second",
+    "Completion tokens per second after the first token of a streaming request",
+    ("model",),
+    buckets=RATE_BUCKETS
+)
+llm_request_duration = Histogram(
+    "llm_request_duration_seconds",
+    "Total duration of an OpenRouter request",
+    ("model", "streaming")
+)
+
+# Streaming
+stream_chunks_received = Counter(
+    "stream_chunks_received_total",
+    "Chunks received from the model before coalescing"
+)
+stream_chunks_sent = Counter(
+    "stream_chunks_sent_total",
+    "Chunks written to clients after coalescing"
+)
+streams_in_flight = Gauge(
+    "chat_streams_in_flight",
+    "Assistant replies currently being generated"
+)
+
+# MongoDB
+mongo_operation_duration = Histogram(
+    "mongo_operation_duration_seconds",
+    "Latency of database functions in internal/database",
+    ("collection", "function")
+)
+
+# Caches
+cache_requests = Counter(
+    "cache_requests_total",
+    "Lookups in the in-process read-through caches",
+    ("cache", "result")
+)
+cache_evictions = Counter(
+    "cache_evictions_total",
+    "Entries dropped from a cache because it was full",
+    ("cache",)
+)
+
+# File parsing
+parse_file_duration = Histogram(
+    "parse_file_duration_seconds",
+    "Time spent extracting text from an uploaded file",
+    ("file_type",)
+)
+parse_file_size = Histogram(
+    "parse_file_size_bytes",
+    "Size of files passed to parse_file",
+    ("file_type",),
+    buckets=SIZE_BUCKETS
+)
+ingestion_tokens = Counter(
+    "ingestion_tokens_total",
+    "Estimated LLM tokens of extracted text stored after normalization",
+    ("file_type",)
+)
+ingestion_tokens_saved = Counter(
+    "ingestion_tokens_saved_total",
+    "Estimated LLM tokens removed from extracted text by normalization",
+    ("file_type",)
+)
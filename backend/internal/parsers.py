@@ -0,0 +1,394 @@
+import asyncio
+import io
+import multiprocessing
+import os
+import posixpath
+import re
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from html.parser import HTMLParser
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from xml.etree import ElementTree
+import pymupdf
+from .tracing import start_span
+from .metrics import parse_file_duration, parse_file_size, ingestion_tokens, ingestion_tokens_saved
+from .text_normalization import NormalizedText, normalize_sections, join_sections
+
+# Cost classes. Cheap parsers run inline on the event loop for small uploads, expensive ones in the process pool.
+CHEAP = "cheap"
+EXPENSIVE = "expensive"
+
+# Uploads larger than this many bytes go to the process pool even for cheap parsers:
+# HTML and plain text extract and normalize at roughly 2-3 MB a second, so 64 KB stays around 30 ms
+PARSER_INLINE_MAX_SIZE = int(os.getenv('PARSER_INLINE_MAX_SIZE', str(64 * 1024)))
+
+# Processes extracting text from expensive formats and large uploads, per worker
+PARSER_PROCESSES = int(os.getenv('PARSER_PROCESSES', str(min(2, os.cpu_count() or 1))))
+# Recycle pool processes now and then, native parsers can hold on to memory
+PARSER_MAX_TASKS_PER_CHILD = int(os.getenv('PARSER_MAX_TASKS_PER_CHILD', '100'))
+
+@dataclass(frozen=True)
+class Parser:
+    '''
+    A file format. sniff recognizes the format from the content, extract yields its text one section
+    (page, chapter, heading) at a time. The sections are collected before they are normalized, which
+    looks at all pages at once, so a parse holds the whole text in memory next to the upload.
+    paginated formats yield printed pages, whose running headers and footers are removed.
+    '''
+    file_type: str
+    extensions: Tuple[str, ...]
+    mime_types: Tuple[str, ...]
+    cost: str
+    extract: Callable[[bytes], Iterator[str]]
+    sniff: Optional[Callable[[bytes], bool]] = None
+    paginated: bool = False
+
+@dataclass
+class ParsedFile:
+    file_type: str
+    sections: List[str]  # In document order, empty ones are kept so that PDF section numbers are page numbers
+    original_tokens: int = 0  # Estimated tokens of the text as extracted
+    tokens: int = 0  # Estimated tokens of the text after normalization
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.original_tokens - self.tokens
+
+    @property
+    def text(self) -> Optional[str]:
+        text = join_sections(self.sections)
+        return text if text.strip() else None
+
+PARSERS: Dict[str, Parser] = {}
+
+def register_parser(file_type: str, extensions: Tuple[str, ...] = (), mime_types: Tuple[str, ...] = (),
+                    cost: str = CHEAP, sniff: Optional[Callable[[bytes], bool]] = None, paginated: bool = False):
+    '''
+    Decorator registering an extractor for a file type. Parsers with a sniff function are tried in
+    registration order before extensions and MIME types are looked at.
+    '''
+    def decorator(extract: Callable[[bytes], Iterator[str]]):
+        PARSERS[file_type] = Parser(file_type, extensions, mime_types, cost, extract, sniff, paginated)
+        return extract
+    return decorator
+
+def detect_file_type(content: bytes, filename: Optional[str] = None, mime_type: Optional[str] = None) -> Optional[str]:
+    '''
+    File type from magic bytes, then the file extension, then the MIME type the client sent.
+    Content that decodes as text is treated as plain text. None if nothing can read the file.
+    '''
+    for parser in PARSERS.values():
+        if parser.sniff and parser.sniff(content):
+            return parser.file_type
+
+    extension = posixpath.splitext((filename or "").lower())[1]
+    if extension:
+        for parser in PARSERS.values():
+            if extension in parser.extensions:
+                return parser.file_type
+
+    mime_type = (mime_type or "").split(";")[0].strip().lower()
+    if mime_type:
+        for parser in PARSERS.values():
+            if mime_type in parser.mime_types:
+                return parser.file_type
+
+    sample = content[:4096]
+    if b"\x00" not in sample:
+        try:
+            # The sample can end in the middle of a character
+            sample.decode("utf-8")
+            return "txt"
+        except UnicodeDecodeError as e:
+            if e.start >= len(sample) - 3:
+                return "txt"
+    return None
+
+def extract_sections(file_type: str, content: bytes) -> NormalizedText:
+    '''
+    Run a parser to completion and normalize its text. Module level so it can be sent to the process pool.
+    '''
+    parser = PARSERS[file_type]
+    return normalize_sections(list(parser.extract(content)), paginated=parser.paginated)
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+def process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        # spawn rather than fork: the worker already runs pymongo and event loop threads
+        _process_pool = ProcessPoolExecutor(
+            max_workers=PARSER_PROCESSES,
+            mp_context=multiprocessing.get_context("spawn"),
+            max_tasks_per_child=PARSER_MAX_TASKS_PER_CHILD
+        )
+    return _process_pool
+
+def runs_in_pool(parser: Parser, size: int) -> bool:
+    return parser.cost == EXPENSIVE or size > PARSER_INLINE_MAX_SIZE
+
+def shutdown_parser_pool():
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+
+async def parse_file(content: bytes, filename: Optional[str] = None, mime_type: Optional[str] = None) -> Optional[ParsedFile]:
+    '''
+    Detect the file type and extract its text. The result has the type even when no text could be
+    extracted, and is None only for content no parser recognizes.
+    '''
+    file_type = detect_file_type(content, filename, mime_type)
+    if file_type is None:
+        return None
+
+    parser = PARSERS[file_type]
+    in_pool = runs_in_pool(parser, len(content))
+    with start_span("parse_file", **{"file.type": file_type, "file.size": len(content), "parser.cost": parser.cost,
+                                     "parser.in_pool": in_pool}):
+        start = time.perf_counter()
+        try:
+            if in_pool:
+                loop = asyncio.get_running_loop()
+                normalized = await loop.run_in_executor(process_pool(), extract_sections, file_type, content)
+            else:
+                normalized = extract_sections(file_type, content)
+            ingestion_tokens.inc(normalized.tokens, file_type=file_type)
+            ingestion_tokens_saved.inc(normalized.tokens_saved, file_type=file_type)
+            return ParsedFile(file_type, normalized.sections, normalized.original_tokens, normalized.tokens)
+        except BrokenProcessPool as e:
+            # A parser process died, e.g. on a malformed file. Start a fresh pool for the next upload.
+            print(f"Parser process pool broke while parsing {file_type}: {e}")
+            shutdown_parser_pool()
+            return ParsedFile(file_type, [])
+        except Exception as e:
+            print(f"Error parsing {file_type} file: {e}")
+            return ParsedFile(file_type, [])
+        finally:
+            parse_file_duration.observe(time.perf_counter() - start, file_type=file_type)
+            parse_file_size.observe(len(content), file_type=file_type)
+
+# Formats
+
+def decode_text(content: bytes) -> str:
+    try:
+        # Try UTF-8 first, a byte order mark is dropped
+        return content.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        # Fallback to latin-1 for other encodings
+        return content.decode('latin-1')
+
+def parse_text_file(content: bytes) -> Optional[str]:
+    '''
+    Text of a plain text file as one string
+    '''
+    return ParsedFile("txt", extract_sections("txt", content).sections).text
+
+def parse_pdf_file(content: bytes) -> Optional[str]:
+    '''
+    Text of a PDF as one string, pages separated by a blank line
+    '''
+    return ParsedFile("pdf", extract_sections("pdf", content).sections).text
+
+def is_pdf(content: bytes) -> bool:
+    # Only a byte order mark or whitespace may come before the header, so text quoting "%PDF-" stays text
+    return content[:1024].lstrip(b"\xef\xbb\xbf \t\r\n").startswith(b"%PDF-")
+
+@register_parser("pdf", extensions=(".pdf",), mime_types=("application/pdf",), cost=EXPENSIVE, sniff=is_pdf,
+                 paginated=True)
+def extract_pdf(content: bytes) -> Iterator[str]:
+    '''
+    One section per page, using PyMuPDF
+    Based on: https://pymupdf.readthedocs.io/en/latest/the-basics.html
+    '''
+    with pymupdf.open(stream=content, filetype="pdf") as doc:
+        for page in doc:
+            text = page.get_text()  # get plain text (is in UTF-8)
+            # Clean up extra whitespace
+            yield '\n'.join(line.strip() for line in text.split('\n') if line.strip())
+
+def zip_member_names(content: bytes) -> List[str]:
+    if not content.startswith(b"PK\x03\x04"):
+        return []
+    try:
+        with zipfile.ZipFile(io.BytesIO(content)) as archive:
+            return archive.namelist()
+    except zipfile.BadZipFile:
+        return []
+
+def is_docx(content: bytes) -> bool:
+    return "word/document.xml" in zip_member_names(content)
+
+def is_epub(content: bytes) -> bool:
+    # EPUBs start with an uncompressed 'mimetype' member
+    return content[30:38] == b"mimetype" and b"application/epub+zip" in content[38:100]
+
+WORD_NAMESPACE = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+@register_parser(
+    "docx",
+    extensions=(".docx",),
+    mime_types=("application/vnd.openxmlformats-officedocument.wordprocessingml.document",),
+    cost=EXPENSIVE,
+    sniff=is_docx
+)
+def extract_docx(content: bytes) -> Iterator[str]:
+    '''
+    Paragraph text from word/document.xml, read with iterparse so the XML tree is never built whole.
+    A new section starts at every heading.
+    '''
+    paragraphs: List[str] = []
+    with zipfile.ZipFile(io.BytesIO(content)) as archive, archive.open("word/document.xml") as document:
+        for _, element in ElementTree.iterparse(document, events=("end",)):
+            if element.tag != f"{WORD_NAMESPACE}p":
+                continue
+
+            style = element.find(f"{WORD_NAMESPACE}pPr/{WORD_NAMESPACE}pStyle")
+            style_name = style.get(f"{WORD_NAMESPACE}val", "") if style is not None else ""
+            if style_name.lower().startswith(("heading", "title")) and paragraphs:
+                yield "\n".join(paragraphs)
+                paragraphs = []
+
+            parts = []
+            for node in element.iter():
+                if node.tag == f"{WORD_NAMESPACE}t" and node.text:
+                    parts.append(node.text)
+                elif node.tag == f"{WORD_NAMESPACE}tab":
+                    parts.append("\t")
+                elif node.tag in (f"{WORD_NAMESPACE}br", f"{WORD_NAMESPACE}cr"):
+                    parts.append("\n")
+            text = "".join(parts).strip()
+            if text:
+                paragraphs.append(text)
+            # Drop parsed paragraphs so memory stays flat on long documents
+            element.clear()
+    if paragraphs:
+        yield "\n".join(paragraphs)
+
+class HTMLTextExtractor(HTMLParser):
+    '''
+    Visible text of an HTML document, split into sections at h1 and h2 headings
+    '''
+    BLOCK_TAGS = {
+        "p", "div", "br", "li", "ul", "ol", "tr", "table", "section", "article", "header", "footer",
+        "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "pre", "hr", "dd", "dt"
+    }
+    SKIP_TAGS = {"script", "style", "noscript", "template", "head", "svg"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.sections: List[str] = []
+        self._parts: List[str] = []
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag in ("h1", "h2"):
+            self.end_section()
+        if tag in self.BLOCK_TAGS:
+            self._parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+        if tag in self.BLOCK_TAGS:
+            self._parts.append("\n")
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self._parts.append(data)
+
+    def end_section(self):
+        lines = (" ".join(line.split()) for line in "".join(self._parts).split("\n"))
+        text = "\n".join(line for line in lines if line)
+        if text:
+            self.sections.append(text)
+        self._parts = []
+
+    def take_sections(self) -> List[str]:
+        sections, self.sections = self.sections, []
+        return sections
+
+def extract_html_sections(html: str, chunk_size: int = 64 * 1024) -> Iterator[str]:
+    extractor = HTMLTextExtractor()
+    for offset in range(0, len(html), chunk_size):
+        extractor.feed(html[offset:offset + chunk_size])
+        yield from extractor.take_sections()
+    extractor.close()
+    extractor.end_section()
+    yield from extractor.take_sections()
+
+def is_html(content: bytes) -> bool:
+    start = content[:512].lstrip(b"\xef\xbb\xbf \t\r\n").lower()
+    return start.startswith((b"<!doctype html", b"<html"))
+
+@register_parser("html", extensions=(".html", ".htm", ".xhtml"), mime_types=("text/html", "application/xhtml+xml"), sniff=is_html)
+def extract_html(content: bytes) -> Iterator[str]:
+    yield from extract_html_sections(decode_text(content))
+
+@register_parser(
+    "epub",
+    extensions=(".epub",),
+    mime_types=("application/epub+zip",),
+    cost=EXPENSIVE,
+    sniff=is_epub
+)
+def extract_epub(content: bytes) -> Iterator[str]:
+    '''
+    One section per chapter, in reading order (the spine of the package document)
+    '''
+    with zipfile.ZipFile(io.BytesIO(content)) as archive:
+        container = ElementTree.fromstring(archive.read("META-INF/container.xml"))
+        rootfile = container.find(".//{urn:oasis:names:tc:opendocument:xmlns:container}rootfile")
+        package_path = rootfile.get("full-path")
+        package = ElementTree.fromstring(archive.read(package_path))
+
+        namespace = "{http://www.idpf.org/2007/opf}"
+        manifest = {
+            item.get("id"): item.get("href")
+            for item in package.iter(f"{namespace}item")
+        }
+        base = posixpath.dirname(package_path)
+        for itemref in package.iter(f"{namespace}itemref"):
+            href = manifest.get(itemref.get("idref"))
+            if not href:
+                continue
+            path = posixpath.normpath(posixpath.join(base, href.split("#")[0]))
+            try:
+                chapter = archive.read(path)
+            except KeyError:
+                continue
+            # A chapter's headings are part of the chapter, so it stays one section
+            text = "\n\n".join(extract_html_sections(decode_text(chapter)))
+            if text:
+                yield text
+
+MARKDOWN_HEADING = re.compile(r"^#{1,2}\s")
+
+@register_parser("markdown", extensions=(".md", ".markdown"), mime_types=("text/markdown", "text/x-markdown"))
+def extract_markdown(content: bytes) -> Iterator[str]:
+    '''
+    Markdown is kept as written, split into sections at level 1 and 2 headings outside code blocks
+    '''
+    lines: List[str] = []
+    in_code = False
+    for line in decode_text(content).splitlines():
+        if line.lstrip().startswith(("```", "~~~")):
+            in_code = not in_code
+        if not in_code and MARKDOWN_HEADING.match(line) and lines:
+            yield "\n".join(lines)
+            lines = []
+        lines.append(line)
+    if lines:
+        yield "\n".join(lines)
+
+@register_parser("txt", extensions=(".txt", ".text", ".csv", ".log"), mime_types=("text/plain", "text/csv"))
+def extract_text(content: bytes) -> Iterator[str]:
+    '''
+    Plain text, split into pages at form feeds
+    '''
+    yield from decode_text(content).split("\f")
@@ -0,0 +1,214 @@
+import asyncio
+import json
+import os
+import time
+from contextlib import aclosing
+from typing import Any, AsyncGenerator, Awaitable, Dict, Optional, Tuple, TypeVar
+from fastapi import Request
+from .metrics import llm_generations_cancelled, stream_chunks_received, stream_chunks_sent
+from .chat_stream import ChatStreamSession, follow_stored_message
+from .database.chat_messages import get_chat_message_by_id
+
+# How often an idle stream or a long running request checks whether the client is still connected
+DISCONNECT_POLL_INTERVAL = float(os.getenv('DISCONNECT_POLL_INTERVAL', '1.0'))
+# Idle event streams send a comment this often so proxies and load balancers keep them open
+HEARTBEAT_INTERVAL = float(os.getenv('SSE_HEARTBEAT_INTERVAL', '15'))
+
+# Model deltas are coalesced until this many bytes are buffered or the first one has waited this long.
+# Set COALESCE_BYTES to 0 to send every delta on its own
+COALESCE_BYTES = int(os.getenv('COALESCE_BYTES', '32'))
+COALESCE_WINDOW = float(os.getenv('COALESCE_WINDOW_MS', '30')) / 1000
+
+SSE_HEARTBEAT = ": keep-alive\n\n"
+
+# Headers for event streams: no caching, and no response buffering in nginx style proxies
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+}
+
+T = TypeVar("T")
+
+class ClientDisconnected(Exception):
+    '''
+    Raised when the client went away before the response was ready
+    '''
+
+async def stream_until_disconnect(
+    request: Request,
+    stream: AsyncGenerator[T, None],
+    heartbeat: Optional[T] = None,
+    heartbeat_interval: float = HEARTBEAT_INTERVAL
+) -> AsyncGenerator[T, None]:
+    '''
+    Yield from a stream until it ends or the client disconnects.
+    The client is checked while waiting for the next item, so a disconnect is noticed even when
+    nothing is being written, and the stream is closed right away so it can release upstream work.
+    If a heartbeat is given, it is yielded whenever the stream has been idle for heartbeat_interval.
+    '''
+    next_item = asyncio.ensure_future(stream.__anext__())
+    last_yield = time.monotonic()
+    try:
+        while True:
+            done, _ = await asyncio.wait({next_item}, timeout=min(DISCONNECT_POLL_INTERVAL, heartbeat_interval))
+            if not done:
+                if await request.is_disconnected():
+                    return
+                if heartbeat is not None and time.monotonic() - last_yield >= heartbeat_interval:
+                    last_yield = time.monotonic()
+                    yield heartbeat
+                continue
+
+            try:
+                item = next_item.result()
+            except StopAsyncIteration:
+                return
+            last_yield = time.monotonic()
+            yield item
+            next_item = asyncio.ensure_future(stream.__anext__())
+    finally:
+        if not next_item.done():
+            next_item.cancel()
+            try:
+                await next_item
+            except (asyncio.CancelledError, StopAsyncIteration):
+                pass
+        await stream.aclose()
+
+async def run_until_disconnect(request: Request, awaitable: Awaitable[T], endpoint: str) -> T:
+    '''
+    Await a long running call such as an LLM request, cancelling it if the client disconnects.
+    Raises ClientDisconnected when the call was cancelled.
+    '''
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                llm_generations_cancelled.inc(endpoint=endpoint)
+                raise ClientDisconnected()
+    finally:
+        if not task.done():
+            task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+async def coalesce_chunks(
+    stream: AsyncGenerator[str, None],
+    min_bytes: int = COALESCE_BYTES,
+    max_delay: float = COALESCE_WINDOW
+) -> AsyncGenerator[str, None]:
+    '''
+    Merge small text chunks into larger writes.
+    Buffered text is flushed as soon as it reaches min_bytes or the oldest buffered chunk has waited
+    max_delay seconds, so perceived latency stays the same while far fewer writes reach the socket.
+    '''
+    async with aclosing(stream) as chunks:
+        if min_bytes <= 0:
+            async for chunk in chunks:
+                stream_chunks_received.inc()
+                stream_chunks_sent.inc()
+                yield chunk
+            return
+
+        loop = asyncio.get_running_loop()
+        buffer = []
+        size = 0
+        deadline = 0.0
+        next_item = asyncio.ensure_future(chunks.__anext__())
+        try:
+            while True:
+                timeout = max(deadline - loop.time(), 0) if buffer else None
+                done, _ = await asyncio.wait({next_item}, timeout=timeout)
+
+                if done:
+                    try:
+                        chunk = next_item.result()
+                    except StopAsyncIteration:
+                        break
+                    stream_chunks_received.inc()
+                    if not buffer:
+                        deadline = loop.time() + max_delay
+                    buffer.append(chunk)
+                    size += len(chunk.encode())
+                    next_item = asyncio.ensure_future(chunks.__anext__())
+                    if size < min_bytes:
+                        continue
+
+                # Threshold reached or the window expired
+                stream_chunks_sent.inc()
+                yield "".join(buffer)
+                buffer = []
+                size = 0
+        finally:
+            if not next_item.done():
+                next_item.cancel()
+                try:
+                    await next_item
+                except (asyncio.CancelledError, StopAsyncIteration):
+                    pass
+
+        if buffer:
+            stream_chunks_sent.inc()
+            yield "".join(buffer)
+
+async def chat_events(session: ChatStreamSession, offset: int = 0) -> AsyncGenerator[Tuple[str, Dict[str, Any]], None]:
+    '''
+    Follow a chat stream session as typed events:
+    token ({text, offset}) for each chunk, then usage and error when present, and finally done
+    '''
+    async with aclosing(coalesce_chunks(session.follow(offset))) as chunks:
+        async for text in chunks:
+            yield "token", {"text": text, "offset": offset}
+            offset += len(text)
+
+    if session.usage:
+        yield "usage", session.usage
+    if session.error:
+        yield "error", {"message": session.error}
+    yield "done", {"messageId": session.message_id, "status": session.status}
+
+async def stored_message_events(message_id: str, offset: int = 0) -> AsyncGenerator[Tuple[str, Dict[str, Any]], None]:
+    '''
+    Same events as chat_events for a message followed from its stored checkpoints
+    '''
+    async with aclosing(follow_stored_message(message_id, offset)) as chunks:
+        async for text in chunks:
+            yield "token", {"text": text, "offset": offset}
+            offset += len(text)
+
+    message = await get_chat_message_by_id(message_id)
+    if message and message.error:
+        yield "error", {"message": message.error}
+    # A message still marked 'streaming' here was interrupted
+    yield "done", {"messageId": message_id, "status": (message.status if message else None) or "complete"}
+
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    '''
+    Frame an event for a text/event-stream response.
+    Token events carry the offset after the chunk as the event ID, so an EventSource that reconnects
+    sends it back in Last-Event-ID and the stream resumes where it stopped.
+    '''
+    lines = [f"event: {event}"]
+    if event == "token":
+        lines.append(f"id: {data['offset'] + len(data['text'])}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+async def sse_stream(events: AsyncGenerator[Tuple[str, Dict[str, Any]], None]) -> AsyncGenerator[str, None]:
+    '''
+    Frame typed events for a text/event-stream response
+    '''
+    async with aclosing(events) as framed:
+        async for event, data in framed:
+            yield format_sse(event, data)
+
+def accepts_event_stream(request: Request) -> bool:
+    '''
+    Whether the client asked for a text/event-stream response
+    '''
+    return "text/event-stream" in request.headers.get("accept", "")
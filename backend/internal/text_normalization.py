@@ -0,0 +1,163 @@
+import math
+import os
+import re
+from collections import Counter
+from dataclasses import dataclass
+from itertools import takewhile
+from typing import List, Set, Tuple
+
+# Normalize extracted text before it is stored. Files uploaded before are left as they were.
+TEXT_NORMALIZATION = os.getenv('TEXT_NORMALIZATION', 'true').lower() == 'true'
+
+# Lines at the top and bottom of each page looked at for running headers and footers. Only pages with
+# more lines than that have body text to tell headers from, shorter pages are left as they are.
+EDGE_LINES = 2
+# Running headers and footers are short, longer edge lines are body text
+RUNNING_LINE_MAX_LENGTH = 80
+# A header or footer has to repeat on at least this share of the pages, and on at least 3 of them
+REPEAT_SHARE = 0.5
+MIN_REPEATS = 3
+# Repeated paragraphs shorter than this are kept, they are usually labels like 'Example' or 'Answer'
+BOILERPLATE_MIN_LENGTH = 80
+
+HYPHENATED_BREAK = re.compile(r"(\w)[-\u00ad]\n[ \t]*(?=[a-z])")
+# Tabs are kept, they separate table columns
+INNER_WHITESPACE = re.compile(r"(?<=\S)(?:[ \u00a0]{2,}|\u00a0)(?=\S)")
+BLANK_LINES = re.compile(r"\n{3,}")
+# Page numbers on their own: '12', '- 12 -', 'Page 3 of 10', 'p. 4', '3/10'
+FOLIO = re.compile(r"^[\W_]*(?:page|p\.|pg\.?)?\s*\d+(?:\s*(?:of|/)\s*\d+)?[\W_]*$")
+# Markdown headings and code fences repeat from section to section but are never running headers
+STRUCTURAL_LINE = re.compile(r"^\s*(?:#{1,6}\s|```|~~~)")
+
+SECTION_SEPARATOR = "\n\n"
+
+@dataclass
+class NormalizedText:
+    sections: List[str]
+    original_tokens: int
+    tokens: int
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.original_tokens - self.tokens
+
+def join_sections(sections: List[str]) -> str:
+    '''
+    The text of a file: its non-empty sections separated by a blank line
+    '''
+    return SECTION_SEPARATOR.join(section for section in sections if section.strip())
+
+def estimate_tokens(text: str) -> int:
+    '''
+    Rough LLM token count, about 4 characters per token for English text
+    '''
+    return math.ceil(len(text) / 4)
+
+def line_key(line: str) -> str:
+    # Page numbers change from page to page, they all share one key. Other lines have to repeat exactly,
+    # 'Question 3' or 'Wait 5 minutes' is content even when every page has one.
+    key = " ".join(line.lower().split())
+    return "#" if FOLIO.match(key) else key
+
+def running_line_candidates(lines: List[str]) -> Tuple[List[int], List[int]]:
+    '''
+    Indexes of the short lines at the top and at the bottom of a page, outermost first.
+    Empty on pages without body text between them.
+    '''
+    filled = [index for index, line in enumerate(lines) if line.strip()]
+    if len(filled) <= 2 * EDGE_LINES:
+        return [], []
+
+    def candidate(index: int) -> bool:
+        line = lines[index].strip()
+        return len(line) <= RUNNING_LINE_MAX_LENGTH and not STRUCTURAL_LINE.match(line)
+
+    top = list(takewhile(candidate, filled[:EDGE_LINES]))
+    bottom = list(takewhile(candidate, reversed(filled[-EDGE_LINES:])))
+    return top, bottom
+
+def remove_running_lines(pages: List[str]) -> List[str]:
+    '''
+    Drop lines repeated at the top or bottom of most pages: running headers and footers, page numbers
+    ('12', 'Page 3 of 10'), copyright notes. Only meant for printed pages, the sections of other formats
+    start and end with headings and short lines that repeat legitimately.
+    Lines are only peeled off from the edges of pages with body text, so no page is left empty.
+    Documents with fewer than MIN_REPEATS pages are left as they are.
+    '''
+    if len(pages) < MIN_REPEATS:
+        return pages
+
+    split_pages = [page.split("\n") for page in pages]
+    candidates = [running_line_candidates(lines) for lines in split_pages]
+    repeats: Counter = Counter()
+    for lines, (top, bottom) in zip(split_pages, candidates):
+        # Counted once per page, a line repeated on one page is not a header
+        repeats.update({line_key(lines[index]) for index in top + bottom})
+    threshold = max(MIN_REPEATS, math.ceil(len(pages) * REPEAT_SHARE))
+    running = {key for key, count in repeats.items() if count >= threshold and key}
+    if not running:
+        return pages
+
+    cleaned = []
+    for lines, (top, bottom) in zip(split_pages, candidates):
+        # From each edge inwards, up to the first line that is not a running line
+        removed = set(takewhile(lambda index: line_key(lines[index]) in running, top))
+        removed |= set(takewhile(lambda index: line_key(lines[index]) in running, bottom))
+        cleaned.append("\n".join(line for index, line in enumerate(lines) if index not in removed))
+    return cleaned
+
+def fix_hyphenation(text: str) -> str:
+    '''
+    Join words broken across lines ('photo-\\nsynthesis') and drop soft hyphens.
+    Only breaks followed by a lowercase letter are joined, 'X-\\nRay' stays as it is.
+    '''
+    return HYPHENATED_BREAK.sub(r"\1", text).replace("\u00ad", "")
+
+def collapse_whitespace(text: str) -> str:
+    '''
+    Strip trailing whitespace, collapse runs of spaces inside lines and runs of blank lines.
+    Leading indentation and Markdown code blocks are kept as written.
+    '''
+    lines = []
+    in_code = False
+    for line in text.split("\n"):
+        if line.lstrip().startswith(("```", "~~~")):
+            in_code = not in_code
+        line = line.rstrip()
+        if not in_code:
+            line = INNER_WHITESPACE.sub(" ", line)
+        lines.append(line)
+    return BLANK_LINES.sub("\n\n", "\n".join(lines)).strip("\n")
+
+def remove_repeated_blocks(sections: List[str]) -> List[str]:
+    '''
+    Keep only the first occurrence of long paragraphs repeated in the file: disclaimers, license notes,
+    navigation text copied on every chapter
+    '''
+    seen: Set[str] = set()
+    cleaned = []
+    for section in sections:
+        paragraphs = []
+        for paragraph in section.split("\n\n"):
+            key = " ".join(paragraph.lower().split())
+            if len(key) >= BOILERPLATE_MIN_LENGTH:
+                if key in seen:
+                    continue
+                seen.add(key)
+            paragraphs.append(paragraph)
+        cleaned.append("\n\n".join(paragraphs))
+    return cleaned
+
+def normalize_sections(sections: List[str], paginated: bool = False) -> NormalizedText:
+    '''
+    Shorten extracted text without changing what it says, so less of it is sent to the LLM on every
+    chat turn. Sections (pages, chapters) keep their positions, the ones left empty stay as empty strings.
+    Running headers and footers are only removed when the sections are printed pages (paginated).
+    '''
+    original_tokens = estimate_tokens(join_sections(sections))
+    if TEXT_NORMALIZATION:
+        if paginated:
+            sections = remove_running_lines(sections)
+        sections = [collapse_whitespace(fix_hyphenation(section)) for section in sections]
+        sections = remove_repeated_blocks(sections)
+    return NormalizedText(sections, original_tokens, estimate_tokens(join_sections(sections)))
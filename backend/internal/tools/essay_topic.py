@@ -1,7 +1,8 @@
 import json
-from typing import List, Dict, Any
+import time
+from typing import List, Dict, Any, Optional
 from models.database import File
-from internal.common import open_router_api
+from internal.common import open_router_api, track_llm_usage_later
 
 async def generate_essay_instructions(learning_space_id: str, files: List[File]) -> Dict[str, Any]:
     """
@@ -67,7 +68,13 @@ async def generate_essay_instructions(learning_space_id: str, files: List[File])
     }
     
     # Use the common open_router_api function with structured output
-    response = await open_router_api(model="gpt-4o", prompt=prompt, response_format=response_format)
+    usage = {}
+    start = time.perf_counter()
+    try:
+        response = await open_router_api(model="gpt-4o", prompt=prompt, response_format=response_format, usage=usage)
+    finally:
+        # Also when the call is cancelled because the client disconnected, it counts without tokens
+        track_llm_usage_later(learning_space_id, "essay", "gpt-4o", usage, time.perf_counter() - start)
     
     if "error" in response:
         raise Exception(f"OpenRouter API error: {response['error']}")
@@ -86,7 +93,7 @@ async def generate_essay_instructions(learning_space_id: str, files: List[File])
     except (json.JSONDecodeError, KeyError, IndexError) as e:
         raise Exception(f"Failed to parse OpenRouter structured response: {e}")
 
-async def generate_essay_feedback(student_essay: str, essay_instructions: Dict[str, Any]) -> Dict[str, Any]:
+async def generate_essay_feedback(student_essay: str, essay_instructions: Dict[str, Any], learning_space_id: Optional[str] = None) -> Dict[str, Any]:
     """
     Generate comprehensive feedback for a student's essay
     """
@@ -172,7 +179,13 @@ async def generate_essay_feedback(student_essay: str, essay_instructions: Dict[s
     }
     
     # Use the common open_router_api function with structured output
-    response = await open_router_api(model="gpt-4o", prompt=prompt, response_format=response_format)
+    usage = {}
+    start = time.perf_counter()
+    try:
+        response = await open_router_api(model="gpt-4o", prompt=prompt, response_format=response_format, usage=usage)
+    finally:
+        # Also when the call is cancelled because the client disconnected, it counts without tokens
+        track_llm_usage_later(learning_space_id, "essay", "gpt-4o", usage, time.perf_counter() - start)
     
     if "error" in response:
         raise Exception(f"OpenRouter API error: {response['error']}")
@@ -0,0 +1,272 @@
+import asyncio
+import contextvars
+import json
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+import requests
+
+# Finished spans are exported as OTLP/JSON, to a file (one export request per line) and/or a collector
+TRACE_EXPORT_FILE = os.getenv('TRACE_EXPORT_FILE')
+TRACE_OTLP_ENDPOINT = os.getenv('TRACE_OTLP_ENDPOINT')  # e.g. http://localhost:4318/v1/traces
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '1.0'))
+TRACE_EXPORT_INTERVAL = float(os.getenv('TRACE_EXPORT_INTERVAL', '2.0'))
+SERVICE_NAME = os.getenv('TRACE_SERVICE_NAME', 'ilearner-backend')
+
+TRACING_ENABLED = bool(TRACE_EXPORT_FILE or TRACE_OTLP_ENDPOINT)
+
+# OTLP span kinds and status codes
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+class Span:
+    '''
+    A timed operation within a trace
+    '''
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "start", "end", "attributes", "status", "status_message")
+
+    recording = True
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], kind: int, attributes: Dict[str, Any]):
+        self.trace_id = trace_id
+        self.span_id = "%016x" % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start = time.time_ns()
+        self.end: Optional[int] = None
+        self.attributes = attributes
+        self.status = STATUS_OK
+        self.status_message = ""
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def set_error(self, error: BaseException):
+        self.status = STATUS_ERROR
+        self.status_message = f"{type(error).__name__}: {error}"
+
+    def finish(self):
+        self.end = time.time_ns()
+        _exporter.export(self)
+
+class NonRecordingSpan:
+    '''
+    Stand-in for spans that are not sampled. Children of a non-recording span are not sampled either
+    '''
+    recording = False
+
+    def __init__(self, trace_id: str = "", span_id: str = ""):
+        self.trace_id = trace_id
+        self.span_id = span_id
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def set_error(self, error: BaseException):
+        pass
+
+    def finish(self):
+        pass
+
+_NOT_SAMPLED = NonRecordingSpan()
+
+_current_span: contextvars.ContextVar[Optional[Any]] = contextvars.ContextVar("current_span", default=None)
+
+def current_span():
+    '''
+    Get the active span of the current task, if any
+    '''
+    return _current_span.get()
+
+def _new_span(name: str, parent: Any, kind: int, attributes: Dict[str, Any]):
+    if parent is not None:
+        if not parent.recording:
+            return _NOT_SAMPLED
+        return Span(name, parent.trace_id, parent.span_id, kind, attributes)
+
+    if random.random() >= TRACE_SAMPLE_RATE:
+        return _NOT_SAMPLED
+    return Span(name, "%032x" % random.getrandbits(128), None, kind, attributes)
+
+@contextmanager
+def start_span(name: str, kind: int = SPAN_KIND_INTERNAL, activate: bool = True, **attributes: Any) -> Iterator[Any]:
+    '''
+    Time a block as a child of the current span.
+    Use activate=False inside async generators, where the span must not become the current span
+    because the generator can be resumed from other contexts.
+    '''
+    if not TRACING_ENABLED:
+        yield _NOT_SAMPLED
+        return
+
+    span = _new_span(name, _current_span.get(), kind, attributes)
+    token = _current_span.set(span) if activate else None
+    try:
+        yield span
+    except (GeneratorExit, asyncio.CancelledError) as e:
+        # Closed early by the consumer, e.g. a client that went away
+        span.set_attribute("cancelled", True)
+        raise
+    except BaseException as e:
+        span.set_error(e)
+        raise
+    finally:
+        if token is not None:
+            _current_span.reset(token)
+        span.finish()
+
+class RemoteParent(NonRecordingSpan):
+    '''
+    Span of the caller, continued from a W3C traceparent header
+    '''
+
+    def __init__(self, trace_id: str, span_id: str, sampled: bool):
+        super().__init__(trace_id, span_id)
+        self.recording = sampled
+
+def parse_traceparent(header: Optional[str]) -> Optional[RemoteParent]:
+    '''
+    Continue a trace from a W3C traceparent header, honouring the caller's sampling decision
+    '''
+    if not header:
+        return None
+    parts = header.split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        sampled = bool(int(parts[3], 16) & 1)
+    except ValueError:
+        return None
+    return RemoteParent(parts[1], parts[2], sampled)
+
+class TracingMiddleware:
+    '''
+    ASGI middleware opening the root span of every request.
+    The span is named after the route template once routing is done.
+    '''
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not TRACING_ENABLED or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        remote_parent = parse_traceparent(headers.get(b"traceparent", b"").decode() or None)
+        parent_token = _current_span.set(remote_parent) if remote_parent is not None else None
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                span.set_attribute("http.status_code", message["status"])
+            await send(message)
+
+        try:
+            with start_span(f"{scope['method']} {scope['path']}", kind=SPAN_KIND_SERVER, **{
+                "http.method": scope["method"],
+                "http.target": scope["path"],
+            }) as span:
+                try:
+                    await self.app(scope, receive, send_wrapper)
+                finally:
+                    route = scope.get("route")
+                    if span.recording and route is not None:
+                        span.name = f"{scope['method']} {route.path}"
+                        span.set_attribute("http.route", route.path)
+        finally:
+            if parent_token is not None:
+                _current_span.reset(parent_token)
+
+class SpanExporter:
+    '''
+    Batches finished spans and exports them from a background thread
+    '''
+
+    def __init__(self):
+        self._queue: "queue.Queue[Span]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+                    self._thread.start()
+        self._queue.put(span)
+
+    def _run(self):
+        while True:
+            time.sleep(TRACE_EXPORT_INTERVAL)
+            self.flush()
+
+    def flush(self):
+        spans: List[Span] = []
+        while True:
+            try:
+                spans.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if not spans:
+            return
+
+        payload = json.dumps(_otlp_request(spans))
+        try:
+            if TRACE_EXPORT_FILE:
+                with open(TRACE_EXPORT_FILE, "a") as export_file:
+                    export_file.write(payload + "\n")
+            if TRACE_OTLP_ENDPOINT:
+                requests.post(TRACE_OTLP_ENDPOINT, data=payload, headers={"Content-Type": "application/json"}, timeout=5)
+        except Exception as e:
+            print(f"Error exporting spans: {e}")
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+def _otlp_request(spans: List[Span]) -> Dict[str, Any]:
+    '''
+    Build an OTLP/JSON ExportTraceServiceRequest
+    '''
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{
+                "scope": {"name": "ilearner"},
+                "spans": [{
+                    "traceId": span.trace_id,
+                    "spanId": span.span_id,
+                    **({"parentSpanId": span.parent_id} if span.parent_id else {}),
+                    "name": span.name,
+                    "kind": span.kind,
+                    "startTimeUnixNano": str(span.start),
+                    "endTimeUnixNano": str(span.end),
+                    "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span.attributes.items()],
+                    "status": {"code": span.status, **({"message": span.status_message} if span.status_message else {})}
+                } for span in spans]
+            }]
+        }]
+    }
+
+_exporter = SpanExporter()
+
+def shutdown_tracing():
+    '''
+    Export spans that are still queued
+    '''
+    if TRACING_ENABLED:
+        _exporter.flush()
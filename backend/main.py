@@ -1,15 +1,58 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
 import uvicorn
+import argparse
 import asyncio
 import os
+import tempfile
 from dotenv import load_dotenv
-from routers import template, common, chat
+from routers import template, common, chat, metrics, usage, health, search
 from routers.database import files, learning_spaces, tool_history
 from routers.tools import essay_topic
+from internal.database.MongoConnection import mongo_connection
+from internal.database.chat_messages import chat_write_buffer
+from internal.database.search import ensure_search_indexes
+from internal.database.file_pages import ensure_file_page_indexes
+from internal.database.llm_usage import ensure_llm_usage_indexes
+from internal.chat_stream import drain_sessions
+from internal.compression import CompressionMiddleware
+from internal.metrics import MetricsMiddleware, monitor_event_loop_lag, publish_metrics_snapshots, prepare_metrics_dir
+from internal.tracing import TracingMiddleware, shutdown_tracing
+from internal.parsers import shutdown_parser_pool
+from internal.common import close_http_client
 
+# Seconds to wait at shutdown for in-flight chat replies before cancelling them
+SHUTDOWN_DRAIN_SECONDS = float(os.getenv('SHUTDOWN_DRAIN_SECONDS', '20'))
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Each worker process creates its own client
+    mongo_connection.connect()
+    lag_monitor = asyncio.create_task(monitor_event_loop_lag())
+    metrics_snapshots = asyncio.create_task(publish_metrics_snapshots())
+    # Build the search indexes without holding up startup
+    search_indexes = asyncio.create_task(asyncio.to_thread(ensure_search_indexes))
+    page_indexes = asyncio.create_task(asyncio.to_thread(ensure_file_page_indexes))
+    usage_indexes = asyncio.create_task(asyncio.to_thread(ensure_llm_usage_indexes))
+    yield
+    lag_monitor.cancel()
+    metrics_snapshots.cancel()
+    search_indexes.cancel()
+    page_indexes.cancel()
+    usage_indexes.cancel()
+    # Let replies that are still being generated finish, their clients can resume them from the database
+    await drain_sessions(SHUTDOWN_DRAIN_SECONDS)
+    # Make sure queued chat messages are durable before the worker exits
+    await chat_write_buffer.close()
+    await close_http_client()
+    mongo_connection.close()
+    shutdown_parser_pool()
+    shutdown_tracing()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Setup CORS to allow calls from React server
 app.add_middleware(
@@ -18,8 +61,18 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Message-Id", "ETag", "Last-Modified"],
 )
 
+# Negotiated zstd/brotli/gzip compression, streamed responses are flushed chunk by chunk
+app.add_middleware(CompressionMiddleware)
+
+# Record request latency per route for /metrics
+app.add_middleware(MetricsMiddleware)
+
+# Open a root tracing span per request (enabled by TRACE_EXPORT_FILE or TRACE_OTLP_ENDPOINT)
+app.add_middleware(TracingMiddleware)
+
 app.include_router(template.router)
 app.include_router(common.router)
 app.include_router(learning_spaces.router)
@@ -27,16 +80,62 @@ app.include_router(files.router)
 app.include_router(chat.router)
 app.include_router(tool_history.router)
 app.include_router(essay_topic.router)
+app.include_router(metrics.router)
+app.include_router(usage.router)
+app.include_router(health.router)
+app.include_router(search.router)
+
+# Workers started by default at most. Each one has its own Mongo connection pool and parser processes.
+MAX_DEFAULT_WORKERS = 8
+
+def default_workers() -> int:
+    '''
+    CPUs this process may use: its CPU affinity, lowered to the cgroup CPU quota in containers.
+    os.cpu_count() reports every CPU of the host.
+    '''
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            cpus = min(cpus, max(1, int(quota) // int(period)))
+    except (OSError, ValueError):
+        pass
+    return max(1, min(cpus, MAX_DEFAULT_WORKERS))
+
+def server_options(reload: bool) -> dict:
+    '''
+    uvicorn settings. Production runs several workers with uvloop and httptools when they are installed
+    (uvicorn[standard]), development runs a single reloading worker.
+    '''
+    options = {
+        "host": os.getenv('HOST', '0.0.0.0'),
+        "port": int(os.getenv('PORT', '8000')),
+        # Longer than the usual 60s idle timeout of load balancers, so they close idle connections first
+        "timeout_keep_alive": int(os.getenv('KEEP_ALIVE_SECONDS', '75')),
+        "backlog": int(os.getenv('BACKLOG', '2048')),
+        # Time open responses such as chat streams get to complete after a shutdown signal
+        "timeout_graceful_shutdown": int(os.getenv('GRACEFUL_SHUTDOWN_SECONDS', '30')),
+        "loop": "auto",
+        "http": "auto",
+    }
+
+    if reload:
+        return {**options, "reload": True}
+
+    workers = int(os.getenv('WEB_CONCURRENCY', default_workers()))
+    if workers > 1:
+        # Each worker has its own metrics, they share snapshots so any of them can answer /metrics for all
+        os.environ['METRICS_DIR'] = os.getenv('METRICS_DIR') or tempfile.mkdtemp(prefix="backend-metrics-")
+        prepare_metrics_dir(os.environ['METRICS_DIR'])
+    return {**options, "workers": workers}
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the backend")
+    parser.add_argument("--reload", action="store_true", help="Development mode: single worker that reloads on code changes")
+    args = parser.parse_args()
 
     # Load environment variables from .env file
     load_dotenv()
 
-    uvicorn.run(
-        "main:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=True,
-        factory=False,
-    )
+    uvicorn.run("main:app", **server_options(args.reload))
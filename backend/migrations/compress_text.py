@@ -0,0 +1,74 @@
+'''
+Online migration rewriting the extracted text of files stored before it was compressed (textVersion 1)
+in the compressed format (textVersion 2), which also gives them a preview and search terms.
+
+The app reads both versions, so this can run while it serves traffic. Files are rewritten in small
+batches in _id order with the progress checkpointed in the Migrations collection, like normalize_ids.
+Each update only applies to documents still without a textVersion. The search index over searchTerms is
+built by migrations.search_indexes. From /backend:
+
+    python -m migrations.compress_text --batch-size 50 --pause 0.1
+'''
+import argparse
+import sys
+import time
+from datetime import datetime
+from typing import Any, Dict
+from pymongo import UpdateOne
+from internal.database.MongoConnection import mongo_connection
+from internal.database.file_text import encode_text_fields
+from .normalize_ids import load_progress, save_progress
+
+MIGRATION_ID = "compress_text"
+
+def migrate(db, state: Dict[str, Any], batch_size: int, pause: float):
+    progress = state["progress"].get("Files", {"lastId": None, "converted": 0, "bytesBefore": 0, "bytesAfter": 0})
+
+    while True:
+        query: Dict[str, Any] = {"textVersion": {"$exists": False}}
+        if progress["lastId"] is not None:
+            query["_id"] = {"$gt": progress["lastId"]}
+        # Batches are small, extracted text can be megabytes per file
+        batch = list(db.Files.find(query, {"extractedText": 1}).sort("_id", 1).limit(batch_size))
+        if not batch:
+            break
+
+        updates = []
+        for doc in batch:
+            text = doc.get("extractedText")
+            fields = encode_text_fields(text)
+            updates.append(UpdateOne(
+                {"_id": doc["_id"], "textVersion": {"$exists": False}},
+                {"$set": fields, "$unset": {"extractedText": ""}}
+            ))
+            progress["bytesBefore"] += len((text or "").encode("utf-8"))
+            progress["bytesAfter"] += len(fields["extractedTextCompressed"] or b"")
+
+        result = db.Files.bulk_write(updates, ordered=False)
+        progress["converted"] += result.modified_count
+        progress["lastId"] = batch[-1]["_id"]
+        save_progress(db, "Files", progress, MIGRATION_ID)
+        print(f"Files: {progress['converted']} converted, text {progress['bytesBefore']} -> {progress['bytesAfter']} bytes")
+
+        if pause > 0:
+            # Leave room for application traffic between batches
+            time.sleep(pause)
+
+def main(args: argparse.Namespace) -> int:
+    db = mongo_connection.connect()[mongo_connection.database_name]
+    state = load_progress(db, args.restart, MIGRATION_ID)
+    migrate(db, state, args.batch_size, args.pause)
+
+    remaining = db.Files.count_documents({"textVersion": {"$exists": False}})
+    print(f"Files: {remaining} still stored uncompressed")
+    if remaining:
+        return 1
+    db.Migrations.update_one({"_id": MIGRATION_ID}, {"$set": {"completedAt": datetime.now()}})
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compress the extracted text of files stored before textVersion 2")
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--pause", type=float, default=0.1, help="Seconds to wait between batches")
+    parser.add_argument("--restart", action="store_true", help="Ignore the saved checkpoint and scan from the start")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,143 @@
+'''
+Online migration storing every learningSpaceId and toolHistoryId reference as an ObjectId.
+
+Files and ChatMessages used to store these references as strings while ToolHistory stored ObjectIds,
+which kept $lookup joins and shared compound indexes from working. The app writes ObjectIds and reads
+both forms while ID_DUAL_READ is on, so this can run while it serves traffic.
+
+Documents are rewritten in small batches in _id order. Each update only applies if the reference still
+holds the string that was read, so concurrent writes are never overwritten. Progress is checkpointed in
+the Migrations collection after every batch and a restarted run continues from there.
+A verification pass counts the references still stored as strings and creates the compound indexes
+once none are left. From /backend:
+
+    python -m migrations.normalize_ids --batch-size 500 --pause 0.1
+    python -m migrations.normalize_ids --verify-only
+
+Chat message _ids stay UUID strings: an _id cannot be changed in place, and message IDs are handed to
+clients to resume streams. Once verification passes, set ID_DUAL_READ=false.
+'''
+import argparse
+import sys
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+from bson import ObjectId
+from pymongo import UpdateOne
+from internal.database.MongoConnection import mongo_connection
+
+MIGRATION_ID = "normalize_ids"
+
+# Reference fields per collection
+REFERENCE_FIELDS: Dict[str, Tuple[str, ...]] = {
+    "Files": ("learningSpaceId",),
+    "ChatMessages": ("learningSpaceId", "toolHistoryId"),
+    "ToolHistory": ("learningSpaceId",),
+}
+
+# Compound indexes for the list queries and dashboard lookups, usable once references have one type
+INDEXES: Dict[str, List[List[Tuple[str, int]]]] = {
+    "Files": [[("learningSpaceId", 1), ("uploadedAt", -1)]],
+    "ChatMessages": [[("learningSpaceId", 1), ("timestamp", -1)], [("toolHistoryId", 1), ("timestamp", -1)]],
+    "ToolHistory": [[("learningSpaceId", 1), ("createdAt", -1)], [("learningSpaceId", 1), ("updatedAt", -1)]],
+}
+
+def load_progress(db, restart: bool, migration_id: str = MIGRATION_ID) -> Dict[str, Any]:
+    if restart:
+        db.Migrations.delete_one({"_id": migration_id})
+    state = db.Migrations.find_one({"_id": migration_id})
+    if state is None:
+        state = {"_id": migration_id, "progress": {}, "startedAt": datetime.now()}
+        db.Migrations.insert_one(state)
+    return state
+
+def save_progress(db, key: str, progress: Dict[str, Any], migration_id: str = MIGRATION_ID):
+    db.Migrations.update_one({"_id": migration_id}, {"$set": {f"progress.{key}": progress, "updatedAt": datetime.now()}})
+
+def migrate_field(db, collection_name: str, field: str, state: Dict[str, Any], batch_size: int, pause: float):
+    '''
+    Convert one reference field of one collection, continuing from the saved checkpoint
+    '''
+    key = f"{collection_name}.{field}"
+    progress = state["progress"].get(key, {"lastId": None, "converted": 0, "invalid": 0})
+
+    collection = db[collection_name]
+    while True:
+        query: Dict[str, Any] = {field: {"$type": "string"}}
+        if progress["lastId"] is not None:
+            query["_id"] = {"$gt": progress["lastId"]}
+        batch = list(collection.find(query, {field: 1}).sort("_id", 1).limit(batch_size))
+        if not batch:
+            break
+
+        updates = []
+        for doc in batch:
+            value = doc[field]
+            if ObjectId.is_valid(value):
+                updates.append(UpdateOne({"_id": doc["_id"], field: value}, {"$set": {field: ObjectId(value)}}))
+            else:
+                # Not an ObjectId, left as it is and reported by the verification pass
+                progress["invalid"] += 1
+
+        if updates:
+            result = collection.bulk_write(updates, ordered=False)
+            progress["converted"] += result.modified_count
+        progress["lastId"] = batch[-1]["_id"]
+        save_progress(db, key, progress)
+        print(f"{key}: {progress['converted']} converted, {progress['invalid']} invalid")
+
+        if pause > 0:
+            # Leave room for application traffic between batches
+            time.sleep(pause)
+
+def verify(db) -> bool:
+    '''
+    Count references still stored as strings and references to learning spaces that do not exist
+    '''
+    clean = True
+    space_ids = set(db.LearningSpaces.distinct("_id"))
+    for collection_name, fields in REFERENCE_FIELDS.items():
+        collection = db[collection_name]
+        for field in fields:
+            remaining = collection.count_documents({field: {"$type": "string"}})
+            line = f"{collection_name}.{field}: {remaining} stored as strings"
+            if field == "learningSpaceId":
+                # Orphans are reported but do not fail verification, they were orphans before too
+                orphans = [value for value in collection.distinct(field) if value not in space_ids]
+                line += f", {len(orphans)} learning spaces referenced that do not exist"
+            print(line)
+            clean = clean and remaining == 0
+    return clean
+
+def create_indexes(db):
+    for collection_name, indexes in INDEXES.items():
+        for keys in indexes:
+            name = db[collection_name].create_index(keys)
+            print(f"{collection_name}: index {name}")
+
+def main(args: argparse.Namespace) -> int:
+    db = mongo_connection.connect()[mongo_connection.database_name]
+
+    if not args.verify_only:
+        state = load_progress(db, args.restart)
+        for collection_name, fields in REFERENCE_FIELDS.items():
+            for field in fields:
+                migrate_field(db, collection_name, field, state, args.batch_size, args.pause)
+
+    if not verify(db):
+        # Chat message _ids are random, so messages written by old app versions can land behind the checkpoint
+        print("Verification failed: references are still stored as strings, keep ID_DUAL_READ on and run again with --restart")
+        return 1
+
+    create_indexes(db)
+    db.Migrations.update_one({"_id": MIGRATION_ID}, {"$set": {"verifiedAt": datetime.now()}}, upsert=True)
+    print("Verification passed: ID_DUAL_READ can be set to false")
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Store learningSpaceId and toolHistoryId references as ObjectIds")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--pause", type=float, default=0.1, help="Seconds to wait between batches")
+    parser.add_argument("--restart", action="store_true", help="Ignore the saved checkpoint and scan from the start")
+    parser.add_argument("--verify-only", action="store_true")
+    sys.exit(main(parser.parse_args()))
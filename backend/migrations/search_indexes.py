@@ -0,0 +1,25 @@
+'''
+Replace the search text indexes created by earlier versions with the current ones: per learning space
+(learningSpaceId first) and, for files, over searchTerms. Workers create missing indexes at startup but
+never drop one, so this runs once when upgrading.
+
+A collection has at most one text index: search over a collection fails from the moment its old index is
+dropped until the new one is built. From /backend:
+
+    python -m migrations.search_indexes
+'''
+import sys
+from internal.database.MongoConnection import mongo_connection
+from internal.database.search import FILE_SEARCH_WEIGHTS, CHAT_SEARCH_WEIGHTS, replace_search_index
+
+def main() -> int:
+    db = mongo_connection.connect()[mongo_connection.database_name]
+    for collection_name, weights in (("Files", FILE_SEARCH_WEIGHTS), ("ChatMessages", CHAT_SEARCH_WEIGHTS)):
+        if replace_search_index(db[collection_name], weights):
+            print(f"{collection_name}: search index rebuilt")
+        else:
+            print(f"{collection_name}: search index already current")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
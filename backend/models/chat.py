@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, List
 from models.database import File
 
@@ -7,4 +7,8 @@ class ChatRequest(BaseModel):
     learning_space_id: str
     model: str = "gpt-4o"
     tool_history_id: Optional[str] = None
-    files: Optional[List[File]] = None
\ No newline at end of file
+    files: Optional[List[File]] = None
+
+class ChatResumeRequest(BaseModel):
+    resume: str  # ID of the assistant message to resume
+    offset: int = Field(0, ge=0)  # Characters the client already has
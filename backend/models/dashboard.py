@@ -0,0 +1,31 @@
+from pydantic import BaseModel
+from datetime import datetime
+from typing import Optional, List, Dict
+from models.database import LearningSpace, ChatMessage
+
+class FileSummary(BaseModel):
+    # File metadata without content or extracted text
+    id: str
+    name: str
+    type: str
+    size: int
+    mimeType: str
+    uploadedAt: datetime
+    textPreview: Optional[str] = None
+
+class ToolHistorySummary(BaseModel):
+    id: str
+    type: str
+    status: str
+    createdAt: datetime
+    updatedAt: datetime
+    # Taken from toolData when the tool has them
+    topic: Optional[str] = None
+    score: Optional[float] = None
+
+class LearningSpaceDashboard(BaseModel):
+    learningSpace: LearningSpace
+    files: List[FileSummary]
+    toolHistory: List[ToolHistorySummary]  # Most recent first
+    toolHistoryCounts: Dict[str, int]  # Entries per tool type
+    chatMessages: List[ChatMessage]  # Latest messages, oldest first
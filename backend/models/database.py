@@ -1,6 +1,10 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, BeforeValidator
+from bson import ObjectId
 from datetime import datetime
-from typing import Optional, List, Dict, Any, Union
+from typing import Optional, List, Dict, Any, Union, Annotated
+
+# References are stored as ObjectIds and exposed as strings
+ObjectIdStr = Annotated[str, BeforeValidator(lambda value: str(value) if isinstance(value, ObjectId) else value)]
 
 class LearningSpace(BaseModel):
     id: str
@@ -11,19 +15,24 @@ class LearningSpace(BaseModel):
 
 class File(BaseModel):
     id: str
-    learningSpaceId: str
+    learningSpaceId: ObjectIdStr
     name: str
     type: str  # 'pdf', 'txt', 'text'
     size: int  # File size in bytes
     mimeType: str  # MIME type for uploaded files
     uploadedAt: datetime
     extractedText: Optional[str] = None  # Content of parsed file into text
+    textPreview: Optional[str] = None  # Start of extractedText, also returned when the text is left out
+    tokenCount: Optional[int] = None  # Estimated LLM tokens of extractedText (null for files uploaded before normalization)
+    tokensSaved: Optional[int] = None  # Estimated tokens removed from the extracted text by normalization
+    pageCount: Optional[int] = None  # Pages (sections for formats without pages) stored in FilePages, null for files uploaded before
+    textLength: Optional[int] = None  # Characters in extractedText
     content: Optional[bytes] = None  # Actual file content
 
 class ChatMessage(BaseModel):
     id: str
-    learningSpaceId: str  # Reference to LearningSpaces._id
-    toolHistoryId: Optional[str] = None  # Reference to ToolHistory._id (null for general learning space chat)
+    learningSpaceId: ObjectIdStr  # Reference to LearningSpaces._id
+    toolHistoryId: Optional[ObjectIdStr] = None  # Reference to ToolHistory._id (null for general learning space chat)
     
     # Message details
     role: str  # 'user', 'assistant'
@@ -32,12 +41,15 @@ class ChatMessage(BaseModel):
     
     # Message metadata
     messageId: str  # Unique identifier for this message
+    status: Optional[str] = None  # 'streaming', 'complete', 'cancelled', 'error' (null for messages saved in one write)
+    error: Optional[str] = None  # Why generation of a streamed message failed
+    updatedAt: Optional[datetime] = None  # Last checkpoint of a streamed message
 
 
 
 class ToolHistory(BaseModel):
     id: str
-    learningSpaceId: str  # Reference to LearningSpaces._id
+    learningSpaceId: ObjectIdStr  # Reference to LearningSpaces._id
     type: str  # 'essay', 'mcq', etc.
     createdAt: datetime
     updatedAt: datetime
@@ -0,0 +1,23 @@
+from pydantic import BaseModel
+from typing import List
+
+class FilePage(BaseModel):
+    page: int  # Page of a PDF, section of other formats, from 1
+    start: int  # Character offset of the page in the file's extractedText
+    length: int
+    text: str
+
+class FilePageRange(BaseModel):
+    fileId: str
+    pageCount: int
+    first: int
+    last: int
+    pages: List[FilePage]  # Pages of the range with text, blank pages are left out
+
+class FileTextRange(BaseModel):
+    fileId: str
+    offset: int
+    length: int  # Characters returned, shorter than asked at the end of the text
+    textLength: int  # Characters in the whole extractedText
+    pages: List[int]  # Pages the range overlaps, for citations
+    text: str
@@ -0,0 +1,19 @@
+from pydantic import BaseModel
+from datetime import datetime
+from typing import List, Tuple
+
+class SearchResult(BaseModel):
+    source: str  # 'file' or 'chat'
+    id: str  # File or chat message ID
+    title: str  # File name, or the role of the chat message author
+    score: float  # MongoDB text score, higher is more relevant
+    snippet: str
+    highlights: List[Tuple[int, int]]  # Start and end offsets of the matched words in snippet
+    timestamp: datetime  # Upload time of the file or time of the message
+
+class SearchResults(BaseModel):
+    query: str
+    results: List[SearchResult]
+    skip: int
+    limit: int
+    hasMore: bool
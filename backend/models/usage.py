@@ -0,0 +1,17 @@
+from pydantic import BaseModel
+from datetime import datetime
+from typing import Optional
+
+class LLMUsageTotals(BaseModel):
+    # Group keys, set when the totals are grouped by them
+    learningSpaceId: Optional[str] = None
+    toolType: Optional[str] = None
+    model: Optional[str] = None
+    day: Optional[datetime] = None
+
+    requests: int = 0
+    promptTokens: int = 0
+    completionTokens: int = 0
+    cachedTokens: int = 0
+    cost: float = 0.0  # USD
+    durationSeconds: float = 0.0
@@ -1,14 +1,27 @@
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, Request, WebSocket, WebSocketDisconnect, status
 from fastapi.responses import StreamingResponse
+from contextlib import aclosing
+import json
 from typing import List, Optional
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 from models.database import ChatMessage
-from models.chat import ChatRequest
+from models.chat import ChatRequest, ChatResumeRequest
 from internal.chat import (
-    send_chat_message_with_streaming,
+    start_chat_message_stream,
     get_chat_history,
     delete_chat_history
 )
+from internal.chat_stream import ChatStreamSession, get_session, follow_stored_message
+from internal.streaming import (
+    stream_until_disconnect,
+    coalesce_chunks,
+    chat_events,
+    stored_message_events,
+    sse_stream,
+    accepts_event_stream,
+    SSE_HEADERS,
+    SSE_HEARTBEAT
+)
 from internal.database.chat_messages import (
     get_chat_message_by_id,
     update_chat_message,
@@ -18,41 +31,165 @@ from internal.database.chat_messages import (
 router = APIRouter(prefix="/chat", tags=["chat"])
 
 
-@router.post("/message")
-async def send_chat_message(request: ChatRequest):
+def session_response(request: Request, session: ChatStreamSession, offset: int = 0) -> StreamingResponse:
     """
-    Send a chat message and get a streaming response.
+    Stream a live chat session as text/event-stream if the client asked for it, plain text otherwise
     """
+    if accepts_event_stream(request):
+        return StreamingResponse(
+            stream_until_disconnect(request, sse_stream(chat_events(session, offset)), heartbeat=SSE_HEARTBEAT),
+            media_type="text/event-stream",
+            headers={"X-Message-Id": session.message_id, **SSE_HEADERS}
+        )
 
-    try:
-        
-        async def generate_response():
-            try:
-                chunk_count = 0
-                async for chunk in send_chat_message_with_streaming(
-                    learning_space_id=request.learning_space_id,
-                    user_message=request.content,
-                    model=request.model,
-                    tool_history_id=request.tool_history_id,
-                    files=request.files
-                ):
+    async def generate_response():
+        try:
+            chunk_count = 0
+            async with aclosing(coalesce_chunks(session.follow(offset))) as chunks:
+                async for chunk in chunks:
                     chunk_count += 1
                     yield chunk
-                
-            except Exception as e:
-                error_msg = f"Error in streaming generation: {str(e)}"
-                yield error_msg
 
-        return StreamingResponse(
-            generate_response(),
-            media_type="text/plain"
+            # Plain text streams carry errors in-band
+            if session.error:
+                yield session.error
+            
+        except Exception as e:
+            error_msg = f"Error in streaming generation: {str(e)}"
+            yield error_msg
+
+    return StreamingResponse(
+        stream_until_disconnect(request, generate_response()),
+        media_type="text/plain",
+        headers={"X-Message-Id": session.message_id}
+    )
+
+@router.post("/message")
+async def send_chat_message(request: ChatRequest, http_request: Request):
+    """
+    Send a chat message and get a streaming response.
+    With `Accept: text/event-stream` the response is an event stream with token, usage, error
+    and done events and keep-alive comments, otherwise the reply is streamed as plain text.
+    The assistant message ID is returned in the X-Message-Id header so the client can resume the stream.
+    If the client disconnects and does not resume, the upstream generation is cancelled.
+    """
+
+    try:
+        session = await start_chat_message_stream(
+            learning_space_id=request.learning_space_id,
+            user_message=request.content,
+            model=request.model,
+            tool_history_id=request.tool_history_id,
+            files=request.files
         )
+
+        return session_response(http_request, session)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to process chat message: {str(e)}"
         )
 
+@router.get("/message/{message_id}/stream")
+async def resume_chat_message(message_id: str, request: Request, offset: Optional[int] = None):
+    """
+    Resume an assistant message stream.
+    Replays the message from a character offset and keeps following it while it is being generated.
+    Event stream clients can send Last-Event-ID instead of an offset.
+    """
+    if offset is None:
+        last_event_id = request.headers.get("last-event-id", "0")
+        offset = int(last_event_id) if last_event_id.isdigit() else 0
+
+    if offset < 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Offset must not be negative"
+        )
+
+    session = get_session(message_id)
+    if session:
+        return session_response(request, session, offset)
+
+    try:
+        message = await get_chat_message_by_id(message_id)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to retrieve message: {str(e)}"
+        )
+    if not message:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Message not found"
+        )
+
+    if accepts_event_stream(request):
+        return StreamingResponse(
+            stream_until_disconnect(request, sse_stream(stored_message_events(message_id, offset)), heartbeat=SSE_HEARTBEAT),
+            media_type="text/event-stream",
+            headers={"X-Message-Id": message_id, **SSE_HEADERS}
+        )
+
+    return StreamingResponse(
+        stream_until_disconnect(request, follow_stored_message(message_id, offset)),
+        media_type="text/plain",
+        headers={"X-Message-Id": message_id}
+    )
+
+@router.websocket("/ws")
+async def chat_websocket(websocket: WebSocket):
+    """
+    Chat over a single WebSocket connection, one turn after another.
+    Each incoming JSON message is a ChatRequest, or {"resume": message_id, "offset": n} to resume a stream.
+    Replies are sent as {"event": ..., "data": ...} frames with the same events as the event stream.
+    Invalid messages are answered with an error event and the connection stays open.
+    Keep-alive is handled by the server's WebSocket ping frames.
+    """
+    await websocket.accept()
+    try:
+        while True:
+            try:
+                payload = json.loads(await websocket.receive_text())
+            except (ValueError, KeyError):
+                # KeyError: a binary frame
+                await websocket.send_json({"event": "error", "data": {"message": "Messages must be JSON text"}})
+                continue
+
+            if isinstance(payload, dict) and "resume" in payload:
+                try:
+                    resume_request = ChatResumeRequest.model_validate(payload)
+                except ValidationError as e:
+                    await websocket.send_json({"event": "error", "data": {"message": f"Invalid resume request: {str(e)}"}})
+                    continue
+
+                message_id, offset = resume_request.resume, resume_request.offset
+                session = get_session(message_id)
+                events = chat_events(session, offset) if session else stored_message_events(message_id, offset)
+            else:
+                try:
+                    chat_request = ChatRequest.model_validate(payload)
+                except ValidationError as e:
+                    await websocket.send_json({"event": "error", "data": {"message": f"Invalid chat request: {str(e)}"}})
+                    continue
+
+                session = await start_chat_message_stream(
+                    learning_space_id=chat_request.learning_space_id,
+                    user_message=chat_request.content,
+                    model=chat_request.model,
+                    tool_history_id=chat_request.tool_history_id,
+                    files=chat_request.files
+                )
+                events = chat_events(session)
+
+            async with aclosing(events) as turn_events:
+                async for event, data in turn_events:
+                    await websocket.send_json({"event": event, "data": data})
+
+    except WebSocketDisconnect:
+        # Closing the turn's events lets the session cancel generation if nobody resumes it
+        pass
+
 @router.get("/history/{learning_space_id}", response_model=List[ChatMessage])
 async def get_chat_history_endpoint(
     learning_space_id: str, 
@@ -1,8 +1,12 @@
-from fastapi import APIRouter, HTTPException, status, UploadFile, File as FastAPIFile
+from fastapi import APIRouter, HTTPException, Query, Request, Response, status, UploadFile, File as FastAPIFile
 from fastapi.responses import StreamingResponse
-from typing import List
+from typing import List, Optional
 import io
 from models.database import File
+from models.file_pages import FilePageRange, FileTextRange
+from internal.compression import no_compression
+from internal.http_cache import make_etag, cache_headers, is_not_modified, not_modified_response
+from internal.database.learning_spaces import get_learning_space_versions
 from internal.database.files import (
     create_file,
     get_file,
@@ -10,6 +14,11 @@ from internal.database.files import (
     get_files_by_learning_space,
     delete_file
 )
+from internal.database.file_pages import get_file_pages, get_file_text_range
+
+# Most pages and characters returned by one page or text range request
+MAX_PAGES_PER_REQUEST = 50
+MAX_TEXT_RANGE_LENGTH = 100_000
 
 router = APIRouter(prefix="/database/files", tags=["files"])
 
@@ -22,25 +31,10 @@ async def upload_file_endpoint(learning_space_id: str, file: UploadFile = FastAP
         # Read file content
         content = await file.read()
         
-        # Determine file type based on extension or mime type
-        file_type = "text"  # default
-        if file.content_type:
-            if "pdf" in file.content_type:
-                file_type = "pdf"
-            elif "text" in file.content_type:
-                file_type = "txt"
-        elif file.filename:
-            # Check file extension
-            if file.filename.lower().endswith('.pdf'):
-                file_type = "pdf"
-            elif file.filename.lower().endswith(('.txt', '.md')):
-                file_type = "txt"
-        
-        # Create file record with content
+        # Create file record with content, the type is detected while extracting its text
         new_file = await create_file(
             learning_space_id=learning_space_id,
             name=file.filename or "untitled",
-            file_type=file_type,
             size=len(content),
             mime_type=file.content_type or "application/octet-stream",
             content=content
@@ -54,12 +48,23 @@ async def upload_file_endpoint(learning_space_id: str, file: UploadFile = FastAP
         )
 
 @router.get("/learning-space/{learning_space_id}", response_model=List[File])
-async def get_files_for_learning_space_endpoint(learning_space_id: str):
+async def get_files_for_learning_space_endpoint(learning_space_id: str, request: Request, response: Response, include_text: bool = True):
     '''
     Get all files for a specific learning space (metadata only, no content)
+    With include_text=false the extracted text is left out and only textPreview is returned.
+    Supports conditional requests: the ETag follows the learning space's file version,
+    so If-None-Match is answered with 304 without reading the files.
     '''
     try:
-        files = await get_files_by_learning_space(learning_space_id)
+        versions = await get_learning_space_versions(learning_space_id)
+        if versions:
+            # The list with and without text are different representations, each gets its own ETag
+            etag = make_etag("files", learning_space_id, versions["filesVersion"], include_text)
+            if is_not_modified(request, etag, versions["filesUpdatedAt"]):
+                return not_modified_response(etag, versions["filesUpdatedAt"])
+            response.headers.update(cache_headers(etag, versions["filesUpdatedAt"]))
+
+        files = await get_files_by_learning_space(learning_space_id, include_text=include_text)
         return files
     except Exception as e:
         raise HTTPException(
@@ -89,18 +94,26 @@ async def get_file_by_id_endpoint(file_id: str):
         )
 
 @router.get("/{file_id}/download")
-async def download_file_endpoint(file_id: str):
+@no_compression
+async def download_file_endpoint(file_id: str, request: Request):
     '''
     Download file content
+    Sent as stored, without response compression: most uploads are PDFs that are already compressed.
+    Files never change after upload, so the ETag is derived from the ID and upload time and
+    a matching If-None-Match is answered with 304 before the content is read.
     '''
     try:
         # Get file metadata
-        file_metadata = await get_file(file_id, include_content=False)
+        file_metadata = await get_file(file_id, include_content=False, include_text=False)
         if not file_metadata:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="File not found"
             )
+
+        etag = make_etag("file", file_id, file_metadata.uploadedAt.isoformat())
+        if is_not_modified(request, etag, file_metadata.uploadedAt):
+            return not_modified_response(etag, file_metadata.uploadedAt)
         
         # Get file content
         content = await get_file_content(file_id)
@@ -117,7 +130,8 @@ async def download_file_endpoint(file_id: str):
             io.BytesIO(content),
             media_type=file_metadata.mimeType,
             headers={
-                "Content-Disposition": f"attachment; filename=\"{file_metadata.name}\""
+                "Content-Disposition": f"attachment; filename=\"{file_metadata.name}\"",
+                **cache_headers(etag, file_metadata.uploadedAt)
             }
         )
     except HTTPException:
@@ -135,7 +149,7 @@ async def get_file_content_text_endpoint(file_id: str):
     '''
     try:
         # Get file metadata
-        file_metadata = await get_file(file_id, include_content=False)
+        file_metadata = await get_file(file_id, include_content=False, include_text=False)
         if not file_metadata:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -143,7 +157,7 @@ async def get_file_content_text_endpoint(file_id: str):
             )
         
         # Only allow text files
-        if file_metadata.type not in ['txt', 'text']:
+        if file_metadata.type not in ['txt', 'text', 'markdown']:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Content endpoint only supports text files"
@@ -175,6 +189,61 @@ async def get_file_content_text_endpoint(file_id: str):
             detail=f"Failed to retrieve file content: {str(e)}"
         )
 
+@router.get("/{file_id}/pages", response_model=FilePageRange)
+async def get_file_pages_endpoint(file_id: str, first: int = Query(1, ge=1), last: Optional[int] = Query(None, ge=1)):
+    '''
+    Get the extracted text of pages first to last (sections for formats without pages), without
+    reading the rest of the file. last defaults to first.
+    '''
+    last = last or first
+    if last < first or last - first >= MAX_PAGES_PER_REQUEST:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"last must be between first and first + {MAX_PAGES_PER_REQUEST - 1}"
+        )
+
+    try:
+        pages = await get_file_pages(file_id, first, last)
+        if not pages:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="File not found"
+            )
+        return pages
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to retrieve file pages: {str(e)}"
+        )
+
+@router.get("/{file_id}/text", response_model=FileTextRange)
+async def get_file_text_range_endpoint(
+    file_id: str,
+    offset: int = Query(0, ge=0),
+    length: int = Query(2000, ge=1, le=MAX_TEXT_RANGE_LENGTH)
+):
+    '''
+    Get length characters of the extracted text from offset, reading only the pages they fall on.
+    Offsets are the same as in extractedText, e.g. search or citation positions.
+    '''
+    try:
+        text_range = await get_file_text_range(file_id, offset, length)
+        if not text_range:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="File not found"
+            )
+        return text_range
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to retrieve file text: {str(e)}"
+        )
+
 @router.delete("/{file_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_file_by_id_endpoint(file_id: str):
     '''
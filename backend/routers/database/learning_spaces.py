@@ -1,6 +1,8 @@
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, Query, Request, Response, status
 from typing import List
 from models.database import LearningSpace
+from models.dashboard import LearningSpaceDashboard
+from internal.http_cache import make_etag, cache_headers, is_not_modified, not_modified_response
 from internal.database.learning_spaces import (
     create_learning_space,
     get_learning_space,
@@ -8,6 +10,7 @@ from internal.database.learning_spaces import (
     update_learning_space,
     delete_learning_space
 )
+from internal.database.dashboard import get_learning_space_dashboard
 
 router = APIRouter(prefix="/database/learning-spaces", tags=["learning-spaces"])
 
@@ -26,12 +29,21 @@ async def create_learning_space_endpoint(name: str):
         )
 
 @router.get("/", response_model=List[LearningSpace])
-async def get_all_learning_spaces_endpoint():
+async def get_all_learning_spaces_endpoint(request: Request, response: Response):
     '''
     Get all learning spaces
+    Learning space documents are small, so the ETag is computed from the fetched list and only
+    saves sending the body again.
     '''
     try:
         learning_spaces = await get_all_learning_spaces()
+        etag = make_etag("learning-spaces", *(
+            f"{space.id}:{space.updatedAt.isoformat()}:{space.fileCount}" for space in learning_spaces
+        ))
+        last_modified = max((space.updatedAt for space in learning_spaces), default=None)
+        if is_not_modified(request, etag, last_modified):
+            return not_modified_response(etag, last_modified)
+        response.headers.update(cache_headers(etag, last_modified))
         return learning_spaces
     except Exception as e:
         raise HTTPException(
@@ -40,7 +52,7 @@ async def get_all_learning_spaces_endpoint():
         )
 
 @router.get("/{learning_space_id}", response_model=LearningSpace)
-async def get_learning_space_endpoint(learning_space_id: str):
+async def get_learning_space_endpoint(learning_space_id: str, request: Request, response: Response):
     '''
     Get a learning space by ID
     '''
@@ -51,6 +63,10 @@ async def get_learning_space_endpoint(learning_space_id: str):
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Learning space not found"
             )
+        etag = make_etag("learning-space", learning_space.id, learning_space.updatedAt.isoformat(), learning_space.fileCount)
+        if is_not_modified(request, etag, learning_space.updatedAt):
+            return not_modified_response(etag, learning_space.updatedAt)
+        response.headers.update(cache_headers(etag, learning_space.updatedAt))
         return learning_space
     except HTTPException:
         raise
@@ -60,6 +76,31 @@ async def get_learning_space_endpoint(learning_space_id: str):
             detail=f"Failed to retrieve learning space: {str(e)}"
         )
 
+@router.get("/{learning_space_id}/dashboard", response_model=LearningSpaceDashboard)
+async def get_learning_space_dashboard_endpoint(
+    learning_space_id: str,
+    tool_history_limit: int = Query(20, ge=0, le=100),
+    chat_limit: int = Query(50, ge=0, le=200)
+):
+    '''
+    Get a learning space with its files, recent tool history and latest chat messages in one request
+    '''
+    try:
+        dashboard = await get_learning_space_dashboard(learning_space_id, tool_history_limit, chat_limit)
+        if not dashboard:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Learning space not found"
+            )
+        return dashboard
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to retrieve learning space dashboard: {str(e)}"
+        )
+
 @router.patch("/{learning_space_id}", response_model=LearningSpace)
 async def update_learning_space_endpoint(learning_space_id: str, name: str = None):
     '''
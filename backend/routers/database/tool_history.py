@@ -1,12 +1,15 @@
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, Request, Response, status
 from typing import List, Dict, Any, Optional
 from models.database import ToolHistory
+from internal.http_cache import make_etag, cache_headers, is_not_modified, not_modified_response
 from internal.database.tool_history import (
     create_tool_history,
     get_tool_history,
+    get_tool_history_updated_at,
     update_tool_history,
     update_tool_data,
     get_tool_history_by_learning_space,
+    get_tool_history_version,
     delete_tool_history
 )
 
@@ -27,12 +30,23 @@ async def create_tool_history_endpoint(learning_space_id: str, tool_type: str, t
         )
 
 @router.get("/{tool_history_id}", response_model=ToolHistory)
-async def get_tool_history_endpoint(tool_history_id: str):
+async def get_tool_history_endpoint(tool_history_id: str, request: Request, response: Response):
     """
     Get a tool history entry by ID
+    Supports conditional requests on updatedAt, checked before the tool data is read.
     """
     try:
+        updated_at = await get_tool_history_updated_at(tool_history_id)
+        if updated_at:
+            etag = make_etag("tool-history", tool_history_id, updated_at.isoformat())
+            if is_not_modified(request, etag, updated_at):
+                return not_modified_response(etag, updated_at)
+            response.headers.update(cache_headers(etag, updated_at))
+
         tool_history = await get_tool_history(tool_history_id)
+        if tool_history and updated_at and tool_history.updatedAt != updated_at:
+            # Cached copy from before a write in another worker, must not be sent with the new ETag
+            tool_history = await get_tool_history(tool_history_id, use_cache=False)
         if not tool_history:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -90,11 +104,19 @@ async def update_tool_data_endpoint(tool_history_id: str, tool_data_updates: Dic
         )
 
 @router.get("/learning-space/{learning_space_id}", response_model=List[ToolHistory])
-async def get_tool_history_by_learning_space_endpoint(learning_space_id: str):
+async def get_tool_history_by_learning_space_endpoint(learning_space_id: str, request: Request, response: Response):
     """
     Get all tool history entries for a learning space
+    Supports conditional requests on the version of the learning space's tool history.
     """
     try:
+        version = await get_tool_history_version(learning_space_id)
+        etag = make_etag("tool-history", learning_space_id, version["count"], version["updatedAt"], version["updatedAtSum"])
+        # ETag only: deleting an entry does not move the newest updatedAt, so it is no Last-Modified
+        if is_not_modified(request, etag):
+            return not_modified_response(etag)
+        response.headers.update(cache_headers(etag))
+
         tool_histories = await get_tool_history_by_learning_space(learning_space_id)
         return tool_histories
     except Exception as e:
@@ -0,0 +1,42 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+import asyncio
+import os
+from internal.database.MongoConnection import mongo_connection
+
+router = APIRouter(prefix="/health", tags=["health"])
+
+# The readiness probe fails if the database does not answer a ping within this many seconds
+READINESS_TIMEOUT = float(os.getenv('READINESS_TIMEOUT_SECONDS', '2'))
+
+@router.get("/live")
+async def liveness():
+    '''
+    Liveness probe: the worker is running and its event loop is responsive.
+    Does not touch the database, so a database outage does not get the worker restarted.
+    '''
+    return {"status": "ok"}
+
+@router.get("/ready")
+async def readiness():
+    '''
+    Readiness probe: the database answers a ping through this worker's connection pool.
+    Returns 503 with the pool state otherwise, so the worker is taken out of rotation.
+    '''
+    stats = mongo_connection.pool_stats
+    pool = {
+        "open": stats.open,
+        "checkedOut": stats.checked_out,
+        "waiting": stats.waiting,
+        "checkoutFailures": stats.checkout_failures
+    }
+
+    try:
+        await asyncio.wait_for(asyncio.to_thread(mongo_connection.ping), timeout=READINESS_TIMEOUT)
+    except Exception as e:
+        return JSONResponse(
+            status_code=503,
+            content={"status": "unavailable", "error": f"Database ping failed: {type(e).__name__}", "pool": pool}
+        )
+
+    return {"status": "ok", "pool": pool}
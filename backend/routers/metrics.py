@@ -0,0 +1,15 @@
+import asyncio
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from internal.metrics import render_metrics
+
+router = APIRouter(tags=["metrics"])
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    '''
+    Prometheus scrape endpoint
+    Returns: every metric in the text exposition format, of all workers when several run
+    '''
+    # Reads the other workers' snapshot files when several run
+    return PlainTextResponse(await asyncio.to_thread(render_metrics), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,34 @@
+from fastapi import APIRouter, HTTPException, Query, status
+from typing import List
+from models.search import SearchResults
+from internal.database.search import search_learning_space, SEARCH_SOURCES
+
+router = APIRouter(prefix="/search", tags=["search"])
+
+@router.get("/{learning_space_id}", response_model=SearchResults)
+async def search_learning_space_endpoint(
+    learning_space_id: str,
+    q: str = Query(..., min_length=1, max_length=500),
+    skip: int = Query(0, ge=0, le=1000),
+    limit: int = Query(20, ge=1, le=100),
+    sources: List[str] = Query(default=list(SEARCH_SOURCES))
+):
+    '''
+    Search the extracted text of a learning space's files and its chat messages, most relevant first.
+    Supports MongoDB text search syntax: "quoted phrases" and -excluded words.
+    Each result has a snippet with the offsets of the matched words to highlight.
+    '''
+    invalid = [source for source in sources if source not in SEARCH_SOURCES]
+    if invalid:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown sources {', '.join(invalid)}. Valid sources: {', '.join(SEARCH_SOURCES)}"
+        )
+
+    try:
+        return await search_learning_space(learning_space_id, q, skip, limit, tuple(sources))
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to search learning space: {str(e)}"
+        )
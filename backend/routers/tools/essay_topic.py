@@ -1,15 +1,16 @@
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, Request, Response, status
 from typing import Dict, Any
 from models.database import ToolHistory
 from internal.database.tool_history import create_tool_history, update_tool_data, get_tool_history
 from internal.database.files import get_files_by_learning_space
 from internal.tools.essay_topic import generate_essay_instructions, generate_essay_feedback
+from internal.streaming import run_until_disconnect, ClientDisconnected
 from models.tools import EssaySubmission
 
 router = APIRouter(prefix="/tools/essay-topic", tags=["essay-topic-tool"])
 
 @router.post("/generate/{learning_space_id}")
-async def generate_essay_topic(learning_space_id: str) -> Dict[str, Any]:
+async def generate_essay_topic(learning_space_id: str, request: Request) -> Dict[str, Any]:
     """
     Step 1: Generate essay instructions when tool is clicked from learning space
     Creates a new tool history entry and generates topic, guidelines, and helping material
@@ -24,8 +25,12 @@ async def generate_essay_topic(learning_space_id: str) -> Dict[str, Any]:
                 detail="No files found in learning space. Please upload files before using the essay tool."
             )
         
-        # Generate essay instructions using AI
-        instructions = await generate_essay_instructions(learning_space_id, files)
+        # Generate essay instructions using AI, cancelled if the client goes away
+        instructions = await run_until_disconnect(
+            request,
+            generate_essay_instructions(learning_space_id, files),
+            endpoint="essay_generate"
+        )
         
         # Create tool history entry with initial data
         initial_tool_data = {
@@ -48,6 +53,9 @@ async def generate_essay_topic(learning_space_id: str) -> Dict[str, Any]:
             "helpingMaterial": instructions.get("helpingMaterial", [])
         }
         
+    except ClientDisconnected:
+        # Nobody is waiting for this response anymore
+        return Response(status_code=499)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -55,7 +63,7 @@ async def generate_essay_topic(learning_space_id: str) -> Dict[str, Any]:
         )
 
 @router.post("/submit/{tool_history_id}")
-async def submit_essay(tool_history_id: str, submission: EssaySubmission) -> Dict[str, Any]:
+async def submit_essay(tool_history_id: str, submission: EssaySubmission, request: Request) -> Dict[str, Any]:
     """
     Step 2: Submit student essay and generate feedback
     Updates the tool history with the essay and generates comprehensive feedback
@@ -84,8 +92,12 @@ async def submit_essay(tool_history_id: str, submission: EssaySubmission) -> Dic
             "helpingMaterial": tool_data.get("helpingMaterial", [])
         }
         
-        # Generate feedback using AI
-        feedback_result = await generate_essay_feedback(submission.essay_text, essay_instructions)
+        # Generate feedback using AI, cancelled if the client goes away
+        feedback_result = await run_until_disconnect(
+            request,
+            generate_essay_feedback(submission.essay_text, essay_instructions, tool_history.learningSpaceId),
+            endpoint="essay_submit"
+        )
         
         # Update tool history with essay and feedback
         tool_data_updates = {
@@ -136,6 +148,9 @@ async def submit_essay(tool_history_id: str, submission: EssaySubmission) -> Dic
         
     except HTTPException:
         raise
+    except ClientDisconnected:
+        # Nobody is waiting for this response anymore
+        return Response(status_code=499)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -0,0 +1,43 @@
+from fastapi import APIRouter, HTTPException, Query, status
+from datetime import date
+from typing import List, Optional
+from models.usage import LLMUsageTotals
+from internal.database.llm_usage import get_llm_usage_totals, USAGE_GROUP_FIELDS
+
+router = APIRouter(prefix="/usage", tags=["usage"])
+
+@router.get("", response_model=List[LLMUsageTotals])
+async def get_usage_endpoint(
+    learning_space_id: Optional[str] = None,
+    tool_type: Optional[str] = None,
+    model: Optional[str] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    group_by: List[str] = Query(default=[])
+):
+    '''
+    Get LLM token usage and cost totals, most expensive first.
+    Filter by learning space, tool type, model and date range, and group by any of
+    learningSpaceId, toolType, model and day (e.g. ?group_by=learningSpaceId&group_by=day).
+    '''
+    invalid = [field for field in group_by if field not in USAGE_GROUP_FIELDS]
+    if invalid:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Cannot group by {', '.join(invalid)}. Valid fields: {', '.join(USAGE_GROUP_FIELDS)}"
+        )
+
+    try:
+        return await get_llm_usage_totals(
+            learning_space_id=learning_space_id,
+            tool_type=tool_type,
+            model=model,
+            start_date=start_date,
+            end_date=end_date,
+            group_by=group_by
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to retrieve usage: {str(e)}"
+        )
@@ -0,0 +1,24 @@
+import time
+from datetime import datetime
+from types import SimpleNamespace
+import pytest
+from internal.http_cache import http_date, is_not_modified
+
+@pytest.fixture
+def berlin_time(monkeypatch):
+    monkeypatch.setenv("TZ", "Europe/Berlin")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+def test_local_timestamps_are_sent_in_gmt(berlin_time):
+    assert http_date(datetime(2024, 7, 1, 14, 30)) == "Mon, 01 Jul 2024 12:30:00 GMT"
+
+def test_if_modified_since_compares_in_utc(berlin_time):
+    stored = datetime(2024, 7, 1, 14, 30, 0, 500000)
+    request = SimpleNamespace(headers={"if-modified-since": "Mon, 01 Jul 2024 12:30:00 GMT"})
+    earlier = SimpleNamespace(headers={"if-modified-since": "Mon, 01 Jul 2024 12:29:59 GMT"})
+
+    assert is_not_modified(request, '"etag"', stored)
+    assert not is_not_modified(earlier, '"etag"', stored)
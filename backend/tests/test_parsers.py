@@ -0,0 +1,11 @@
+from internal.parsers import detect_file_type
+
+def test_pdf_header_must_start_the_file():
+    assert detect_file_type(b"%PDF-1.7\n%binary", "notes", None) == "pdf"
+    assert detect_file_type(b"\xef\xbb\xbf\r\n%PDF-1.4\n", "notes", None) == "pdf"
+
+def test_text_mentioning_the_pdf_header_stays_text():
+    content = b"Every PDF file starts with %PDF- followed by the version."
+
+    assert detect_file_type(content, "notes.txt", "text/plain") == "txt"
+    assert detect_file_type(content, "notes.md", None) == "markdown"
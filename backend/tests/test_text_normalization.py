@@ -0,0 +1,86 @@
+from internal.parsers import extract_sections
+from internal.text_normalization import normalize_sections
+
+BODIES = ["Cells divide by mitosis.", "Plants use sunlight.", "Water boils at sea level.", "Sound needs a medium.", "Light bends in water."]
+
+def markdown_sections():
+    return [
+        f"## Chapter {number}\n\nBody of chapter {number} explains topic {number}.\n\n```python\nprint({number})\n```\nSee also"
+        for number in range(1, 6)
+    ]
+
+def test_markdown_sections_keep_their_body():
+    sections = markdown_sections()
+    normalized = normalize_sections(sections)
+
+    assert len(normalized.sections) == len(sections)
+    for number, section in enumerate(normalized.sections, 1):
+        assert f"## Chapter {number}" in section
+        assert f"Body of chapter {number} explains topic {number}." in section
+        assert "```python" in section
+        assert "See also" in section
+
+def test_markdown_file_keeps_its_body():
+    content = "\n\n".join(markdown_sections()).encode()
+    normalized = extract_sections("markdown", content)
+
+    assert len(normalized.sections) == 5
+    assert all(f"Body of chapter {number} explains" in section for number, section in enumerate(normalized.sections, 1))
+
+def test_html_sections_keep_their_body():
+    # Sections as the HTML extractor yields them: short heading and closing lines on every section
+    sections = [f"Lesson\nPart {number}\nExercises for part {number}.\nNext" for number in range(1, 6)]
+    normalized = normalize_sections(sections)
+
+    assert normalized.sections == sections
+
+def test_headings_are_not_running_lines_on_pages():
+    sections = [f"# Notes\n```\n{body}\n```" for body in BODIES]
+    normalized = normalize_sections(sections, paginated=True)
+
+    assert normalized.sections == sections
+
+def handbook_pages():
+    return [
+        f"Course Handbook 2024\nUnit {number}\n{body}\nReview the unit notes.\nTry the exercises.\nConfidential - do not share\n{folio}"
+        for number, (body, folio) in enumerate(zip(BODIES, ["1", "- 2 -", "Page 3 of 5", "p. 4", "5/5"]), 1)
+    ]
+
+def test_pdf_running_headers_and_page_numbers_are_removed():
+    normalized = normalize_sections(handbook_pages(), paginated=True)
+
+    assert normalized.sections == [
+        f"Unit {number}\n{body}\nReview the unit notes.\nTry the exercises."
+        for number, body in enumerate(BODIES, 1)
+    ]
+    assert normalized.tokens < normalized.original_tokens
+
+def test_numbered_lines_are_not_page_numbers():
+    pages = [f"Question {number}\nExplain topic {number} in your own words.\nAnswer in 200 words." for number in range(1, 7)]
+    pages += [f"Step {number}: mix {2 * number} grams of salt\nStir well\nWait {number} minutes" for number in range(1, 7)]
+
+    assert normalize_sections(pages, paginated=True).sections == pages
+
+def test_numbered_edge_lines_of_long_pages_are_kept():
+    pages = [
+        f"Step {number}: mix {2 * number} grams of salt\nStir well\n{body}\nWrite it down\nWait {number} minutes"
+        for number, body in enumerate(BODIES, 1)
+    ]
+    normalized = normalize_sections(pages, paginated=True)
+
+    assert all(f"Step {number}: mix" in page and f"Wait {number} minutes" in page
+               for number, page in enumerate(normalized.sections, 1))
+
+def test_pages_are_never_emptied():
+    pages = [f"Course Handbook 2024\nConfidential - do not share\n{number}" for number in range(1, 7)]
+    pages += handbook_pages()
+    normalized = normalize_sections(pages, paginated=True)
+
+    assert all(page.strip() for page in normalized.sections)
+    assert normalized.sections[:6] == pages[:6]
+
+def test_long_edge_lines_are_body_text():
+    sentence = "This paragraph is long enough to be body text rather than a running header of the page."
+    pages = [f"{sentence}\nPart {number}\n{body}\nMore text.\n{sentence}" for number, body in enumerate(BODIES, 1)]
+
+    assert normalize_sections(pages, paginated=True).sections == pages
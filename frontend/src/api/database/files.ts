@@ -1,4 +1,4 @@
-import type { FileItem, FileUploadResponse, FileContentResponse, ExtractedTextResponse } from '../../types/learningSpace';
+import type { FileItem, FileType, FileUploadResponse, FileContentResponse, ExtractedTextResponse } from '../../types/learningSpace';
 
 const API_BASE_URL = 'http://localhost:8000/database/files';
 
@@ -147,7 +147,7 @@ export const uploadMultipleFiles = async (
     id: response.id,
     learningSpaceId: response.learningSpaceId,
     name: response.name,
-    type: response.type as 'pdf' | 'txt' | 'text',
+    type: response.type as FileType,
     size: response.size,
     mimeType: response.mimeType,
     uploadedAt: new Date(response.uploadedAt),
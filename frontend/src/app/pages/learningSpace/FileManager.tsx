@@ -16,7 +16,11 @@ import {
   IconPlus, 
   IconFile, 
   IconFileTypePdf, 
+  IconFileTypeDocx,
+  IconFileTypeHtml,
   IconFileText, 
+  IconMarkdown,
+  IconBook,
   IconTrash, 
   IconDownload,
   IconEye,
@@ -26,7 +30,13 @@ import {
 import FileUploadModal from './FileUploadModal';
 import PdfViewer from '../../../components/PdfViewer';
 import { filesApi } from '../../../api/database/files';
-import type { FileItem } from '../../../types/learningSpace';
+import type { FileItem, FileType } from '../../../types/learningSpace';
+
+// Types whose content is shown as plain text instead of being downloaded
+const TEXT_FILE_TYPES: string[] = ['txt', 'text', 'markdown', 'html'];
+
+const escapeHtml = (text: string) =>
+  text.replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;');
 
 interface FileManagerProps {
   learningSpaceId: string;
@@ -66,7 +76,7 @@ export default function FileManager({
       // Convert upload response to FileItem format
       const fileItems: FileItem[] = uploadedFiles.map(file => ({
         ...file,
-        type: file.type as 'pdf' | 'txt' | 'text',
+        type: file.type as FileType,
         uploadedAt: file.uploadedAt
       }));
       
@@ -112,12 +122,13 @@ export default function FileManager({
           url: fileUrl,
           type: file.type
         });
-      } else if (file.type === 'txt' || file.type === 'text') {
+      } else if (TEXT_FILE_TYPES.includes(file.type)) {
         const content = await filesApi.getContent(file.id);
         // You can show content in a modal or new window
         const newWindow = window.open();
         if (newWindow) {
-          newWindow.document.write(`<pre>${content}</pre>`);
+          // Escaped so HTML and Markdown files show their source instead of being rendered
+          newWindow.document.write(`<pre>${escapeHtml(content)}</pre>`);
           newWindow.document.title = file.name;
         }
       } else {
@@ -136,6 +147,10 @@ export default function FileManager({
 
   const getFileIcon = (type: string) => {
     if (type === 'pdf') return IconFileTypePdf;
+    if (type === 'docx') return IconFileTypeDocx;
+    if (type === 'html') return IconFileTypeHtml;
+    if (type === 'markdown') return IconMarkdown;
+    if (type === 'epub') return IconBook;
     if (type === 'txt' || type === 'text') return IconFileText;
     return IconFile;
   };
@@ -4,6 +4,17 @@ import { Button, Group, Text, useMantineTheme } from '@mantine/core';
 import { Dropzone, MIME_TYPES } from '@mantine/dropzone';
 import classes from './DropzoneCustom.module.css';
 
+// Formats the backend extracts text from, by MIME type and extension
+const ACCEPTED_FILES = {
+  [MIME_TYPES.pdf]: ['.pdf'],
+  [MIME_TYPES.docx]: ['.docx'],
+  'application/epub+zip': ['.epub'],
+  'text/html': ['.html', '.htm', '.xhtml'],
+  'text/markdown': ['.md', '.markdown'],
+  'text/plain': ['.txt', '.text', '.log'],
+  'text/csv': ['.csv'],
+};
+
 interface DropzoneCustomProps {
   onDrop: (files: File[]) => void;
 }
@@ -19,7 +30,7 @@ export function DropzoneCustom({ onDrop }: DropzoneCustomProps) {
         onDrop={onDrop}
         className={classes.dropzone}
         radius="md"
-        accept={[MIME_TYPES.pdf]}
+        accept={ACCEPTED_FILES}
         maxSize={30 * 1024 ** 2}
       >
         <div style={{ pointerEvents: 'none' }}>
@@ -37,12 +48,12 @@ export function DropzoneCustom({ onDrop }: DropzoneCustomProps) {
 
           <Text ta="center" fw={700} fz="lg" mt="xl">
             <Dropzone.Accept>Drop files here</Dropzone.Accept>
-            <Dropzone.Reject>Pdf file less than 30mb</Dropzone.Reject>
+            <Dropzone.Reject>Supported file less than 30mb</Dropzone.Reject>
             <Dropzone.Idle>Upload Files</Dropzone.Idle>
           </Text>
 
           <Text className={classes.description}>
-            Drag and drop files here to upload. Only <i>.pdf</i> and <i>.txt</i> files with readable text are supported
+            Drag and drop files here to upload. PDF, Word (<i>.docx</i>), EPUB, HTML, Markdown and text files with readable text are supported
           </Text>
         </div>
       </Dropzone>
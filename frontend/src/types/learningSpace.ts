@@ -1,8 +1,12 @@
+// Detected by the backend from the file content, name and MIME type. 'text' is used by older uploads,
+// 'binary' by files no parser could read.
+export type FileType = 'pdf' | 'txt' | 'text' | 'markdown' | 'html' | 'docx' | 'epub' | 'binary';
+
 export interface FileItem {
   id: string;
   learningSpaceId: string;
   name: string;
-  type: 'pdf' | 'txt' | 'text';
+  type: FileType;
   size: number;
   mimeType: string;
   uploadedAt: Date;